@@ -1,28 +1,254 @@
+import argparse
+import functools
+import random
 import sys
+import time
+from collections import OrderedDict, deque
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QGridLayout, QWidget, 
                             QPushButton, QMessageBox, QVBoxLayout, QHBoxLayout, 
-                            QLabel, QSystemTrayIcon, QMenu, QAction, QStyle)
-from PyQt5.QtCore import Qt, QTimer, QPoint
-from PyQt5.QtGui import QFont, QPainter, QPen, QColor
+                            QLabel, QSystemTrayIcon, QMenu, QAction, QStyle,
+                            QFileDialog, QShortcut)
+from PyQt5.QtCore import Qt, QTimer, QPoint, QRect, QThread, pyqtSignal
+from PyQt5.QtGui import QFont, QPainter, QPen, QColor, QPixmap, QKeySequence
+from PyQt5.QtNetwork import QTcpSocket
+
+import xiangqi_book
+import xiangqi_engine
+import xiangqi_notation
+import xiangqi_position
+import xiangqi_record
+import xiangqi_repetition
+import xiangqi_rules
+import xiangqi_server
+import xiangqi_tablebase
+
+ANALYSIS_PANEL_WIDTH = 220  # 分析面板宽度
+RECORD_FILTER = '对局记录 (*.xqr)'
+MOVE_CACHE_SIZE = 512  # 合法走法缓存的条目数，一个局面最多 16 个可选的棋子
+
+RED_CHARS = '车马相仕帅炮兵'
+
+# 绘制模式下棋子在各状态的底色
+GLYPH_BACKGROUNDS = {
+    'normal': QColor('#F0E4D0'),
+    'selected': QColor('#FFE4B5'),
+    'capture': QColor(255, 200, 200, 180),
+    'target': QColor(144, 238, 144, 180),
+}
+
+# 按钮显示方式下各状态的样式表模板，按 (颜色, 状态, 大小) 生成一次后复用
+BUTTON_BACKGROUNDS = {
+    'normal': '#F0E4D0',
+    'selected': '#FFE4B5',
+    'capture': 'rgba(255, 200, 200, 180)',
+    'target': 'rgba(144, 238, 144, 180)',
+}
+PIECE_BUTTON_STYLE = '''
+    QPushButton { 
+        %s
+        background-color: %s; 
+        border: 2px solid #8B4513;
+        border-radius: %dpx;
+    }
+    QPushButton:hover { 
+        background-color: %s; 
+    }
+    QPushButton:pressed { 
+        background-color: %s; 
+    }
+'''
+EMPTY_BUTTON_STYLE = '''
+    QPushButton { 
+        background: transparent;
+        border: none;
+        color: transparent;
+        outline: none;
+    }
+    QPushButton:hover { 
+        background: transparent;
+        border: none;
+    }
+    QPushButton:pressed { 
+        background: transparent;
+        border: none;
+    }
+    QPushButton:focus { 
+        outline: none;
+        border: none;
+    }
+'''
+
+@functools.lru_cache(maxsize=None)
+def button_style(colour, state, size):
+    """colour 为 'red'、'black' 或 ''（空位），state 为 BUTTON_BACKGROUNDS 的键或 'empty'"""
+    if state == 'empty':
+        return EMPTY_BUTTON_STYLE
+    background = BUTTON_BACKGROUNDS[state]
+    color = 'color: %s;' % colour if colour else ''
+    return PIECE_BUTTON_STYLE % (color, background, size // 2, background, background)
 
 class ChessBoardWidget(QWidget):
+    """棋盘背景；绘制模式下棋子、高亮和上一步标记也由它直接画出
+
+    绘制模式下棋盘线画在缓存的整张图上，棋子按 (棋子, 状态, 大小) 缓存成小图，
+    局面变化时只把内容变了的格子标记为需要重绘，paintEvent 只画这些格子。
+    """
+    square_clicked = pyqtSignal(int, int)
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setMinimumSize(300, 500)  # 调整最小尺寸
-        
+        self.draw_pieces = False
+        self.pieces = [[''] * 9 for _ in range(10)]
+        self.selected = None      # 选中的棋子 (行, 列)
+        self.targets = set()      # 选中棋子可以走到的格子
+        self.last_move = None     # 上一步的 ((起行, 起列), (终行, 终列))
+        self.background = None    # 画好棋盘线的整张图，大小变化时重画
+        self.glyphs = {}          # (棋子, 状态, 大小) -> QPixmap
+        self.frame_times = deque(maxlen=240)  # 最近每次 paintEvent 的用时（秒）
+
+    def board_geometry(self):
+        """返回 (格子大小, 左边距, 上边距)，棋盘线和棋子共用"""
+        board_width = self.width()
+        board_height = self.height() - 50
+        cell_size = min(board_width // 9, board_height // 10)
+        margin_x = (board_width - cell_size * 8) // 2
+        return cell_size, margin_x, 25
+
+    def square_rect(self, row, col):
+        """一个交叉点周围一格大小的区域，重绘这个格子时只刷新这里"""
+        cell_size, margin_x, margin_y = self.board_geometry()
+        x = margin_x + col * cell_size - cell_size // 2
+        y = margin_y + row * cell_size - cell_size // 2
+        return QRect(x, y, cell_size, cell_size)
+
+    def set_position(self, board, last_move=None):
+        """换成新的局面并清除选中，只重绘变化的格子"""
+        dirty = set()
+        for row in range(10):
+            old_row = self.pieces[row]
+            new_row = board[row]
+            if old_row != new_row:
+                dirty.update((row, col) for col in range(9) if old_row[col] != new_row[col])
+        self.pieces = [list(row) for row in board]
+        if last_move != self.last_move:
+            dirty.update(self.last_move or ())
+            dirty.update(last_move or ())
+            self.last_move = last_move
+        self.set_selection(None, ())
+        self.mark_dirty(dirty)
+
+    def set_selection(self, selected, targets):
+        """设置选中的棋子和它能走到的格子"""
+        targets = set(targets)
+        dirty = self.targets ^ targets
+        if selected != self.selected:
+            dirty.update(square for square in (self.selected, selected) if square)
+        self.selected = selected
+        self.targets = targets
+        self.mark_dirty(dirty)
+
+    def mark_dirty(self, squares):
+        # 多次 update 会被 Qt 合并成一次重绘
+        for row, col in squares:
+            self.update(self.square_rect(row, col))
+
+    def glyph(self, piece, state, size):
+        key = (piece, state, size)
+        pixmap = self.glyphs.get(key)
+        if pixmap is None:
+            pixmap = self.glyphs[key] = self.render_glyph(piece, state, size)
+        return pixmap
+
+    def render_glyph(self, piece, state, size):
+        pixmap = QPixmap(size, size)
+        pixmap.fill(Qt.transparent)
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.Antialiasing)
+        if state == 'last':
+            # 上一步的起点和终点画四个角标
+            painter.setPen(QPen(QColor('#1E64C8'), 2))
+            arm = size // 4
+            for x, dx in ((1, 1), (size - 2, -1)):
+                for y, dy in ((1, 1), (size - 2, -1)):
+                    painter.drawLine(x, y, x + dx * arm, y)
+                    painter.drawLine(x, y, x, y + dy * arm)
+        else:
+            painter.setPen(QPen(QColor('#8B4513'), 2))
+            painter.setBrush(GLYPH_BACKGROUNDS[state])
+            painter.drawEllipse(1, 1, size - 2, size - 2)
+            if piece:
+                painter.setFont(QFont('SimSun', max(1, int(size / 0.8 * 0.4))))
+                painter.setPen(QColor('red' if piece in RED_CHARS else 'black'))
+                painter.drawText(pixmap.rect(), Qt.AlignCenter, piece)
+        painter.end()
+        return pixmap
+
+    def render_background(self):
+        pixmap = QPixmap(self.size())
+        pixmap.fill(Qt.transparent)
+        painter = QPainter(pixmap)
+        self.draw_grid(painter)
+        painter.end()
+        return pixmap
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.background = None
+
+    def mousePressEvent(self, event):
+        if not self.draw_pieces or event.button() != Qt.LeftButton:
+            return super().mousePressEvent(event)
+        cell_size, margin_x, margin_y = self.board_geometry()
+        col = round((event.x() - margin_x) / cell_size)
+        row = round((event.y() - margin_y) / cell_size)
+        if 0 <= row < 10 and 0 <= col < 9:
+            self.square_clicked.emit(row, col)
+
     def paintEvent(self, event):
+        start = time.perf_counter()
         painter = QPainter(self)
+        if self.background is None:
+            self.background = self.render_background()
+        rect = event.rect()
+        painter.drawPixmap(rect, self.background, rect)
+        if self.draw_pieces:
+            self.draw_squares(painter, event.region())
+        painter.end()
+        self.frame_times.append(time.perf_counter() - start)
+
+    def draw_squares(self, painter, region):
+        """画出 region 范围内的棋子、可走位置和上一步标记"""
+        cell_size, margin_x, margin_y = self.board_geometry()
+        size = int(cell_size * 0.8)
+        last_squares = self.last_move or ()
+        for row in range(10):
+            for col in range(9):
+                if not region.intersects(self.square_rect(row, col)):
+                    continue
+                piece = self.pieces[row][col]
+                if (row, col) == self.selected:
+                    state = 'selected'
+                elif (row, col) in self.targets:
+                    state = 'capture' if piece else 'target'
+                else:
+                    state = 'normal'
+                x = margin_x + col * cell_size
+                y = margin_y + row * cell_size
+                if piece or state == 'target':
+                    painter.drawPixmap(x - size // 2, y - size // 2, self.glyph(piece, state, size))
+                if (row, col) in last_squares:
+                    painter.drawPixmap(x - cell_size // 2, y - cell_size // 2,
+                                       self.glyph('', 'last', cell_size))
+
+    def draw_grid(self, painter):
         painter.setRenderHint(QPainter.Antialiasing)
         
         pen = QPen(QColor(0, 0, 0), 2)
         painter.setPen(pen)
         
         # 计算棋盘绘制区域
-        board_width = self.width()
-        board_height = self.height() - 50
-        cell_size = min(board_width // 9, board_height // 10)
-        margin_x = (board_width - cell_size * 8) // 2
-        margin_y = 25
+        cell_size, margin_x, margin_y = self.board_geometry()
         
         # 绘制横线
         for i in range(10):
@@ -60,9 +286,109 @@ class ChessBoardWidget(QWidget):
         painter.drawLine(margin_x + cell_size * 5, margin_y + cell_size * 7,
                         margin_x + cell_size * 3, margin_y + cell_size * 9)
 
+class EngineThread(QThread):
+    """在后台线程中运行搜索，思考时棋盘仍然可以响应"""
+    info_updated = pyqtSignal(object)
+    search_finished = pyqtSignal(object)
+
+    def __init__(self, engine, position, time_limit, history=(), parent=None):
+        super().__init__(parent)
+        self.engine = engine
+        self.position = position
+        self.time_limit = time_limit
+        self.history = list(history)
+        # 停止标志在启动前清除，线程还没进入 search 时调用 stop() 也有效
+        engine.clear_stop()
+
+    def run(self):
+        result = self.engine.search(self.position, time_limit=self.time_limit,
+                                    info_callback=self.info_updated.emit,
+                                    history=self.history)
+        self.search_finished.emit(result)
+
+    def stop(self):
+        self.engine.stop()
+        self.wait()
+
+class AnalysisThread(QThread):
+    """分析模式的后台搜索，不限时间，界面更新按 interval 秒节流"""
+    info_updated = pyqtSignal(object)
+
+    def __init__(self, engine, position, history=(), interval=0.2, parent=None):
+        super().__init__(parent)
+        self.engine = engine
+        self.position = position
+        self.history = list(history)
+        self.interval = interval
+        self.cancelled = False
+        engine.clear_stop()
+        self.last_emit = 0.0
+        self.pending = None
+
+    def run(self):
+        # 启动后、进入搜索前就被取消时直接结束，不限时的分析搜索不会自己停下
+        if self.cancelled:
+            return
+        self.engine.search(self.position, info_callback=self.on_info, history=self.history)
+        if self.pending is not None and not self.cancelled:
+            self.info_updated.emit(self.pending)
+
+    def on_info(self, info):
+        # 浅层几毫秒就搜完一层，只把间隔够长的结果发给界面，其余留到下次或结束时
+        now = time.perf_counter()
+        if now - self.last_emit >= self.interval:
+            self.last_emit = now
+            self.pending = None
+            self.info_updated.emit(info)
+        else:
+            self.pending = info
+
+    def cancel(self):
+        """请求停止，不等待线程结束"""
+        self.cancelled = True
+        self.engine.stop()
+
+class LegalMoveCache:
+    """按 (局面键, 规则模式, 行, 列) 缓存棋子能走到的格子，最久没用的先淘汰
+
+    局面键随走子、悔棋变化，旧局面的条目不会被错用；悔棋回到走过的局面时
+    还能直接命中。摆新局面时整个清空。
+    """
+
+    def __init__(self, size=MOVE_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        moves = self.entries.get(key)
+        if moves is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return moves
+        self.misses += 1
+        moves = tuple(compute())
+        self.entries[key] = moves
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return moves
+
+    def clear(self):
+        self.entries.clear()
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
 class ChessBoard(QMainWindow):
-    def __init__(self):
+    def __init__(self, renderer='painter', server=None):
+        """renderer 为 'painter'（棋盘部件直接绘制棋子）或 'buttons'（每个格子一个按钮）
+
+        server 为 '主机:端口' 时连接 xiangqi_server 联机对战，局面和棋钟以服务器为准。
+        """
         super().__init__()
+        self.renderer = renderer
         
         # 移除桌面小组件相关的窗口标志，使用普通窗口
         self.setWindowFlags(Qt.Window)  # 使用普通窗口标志
@@ -72,10 +398,43 @@ class ChessBoard(QMainWindow):
         self.is_red_turn = True  # 红方先走
         self.game_over = False   # 添加游戏结束标志
         self.move_history = []   # 添加移动历史记录
+        self.strict_rules = True  # 合法走法模式：不能送将，帅将不能照面
+        
+        # 人机对战相关的属性
+        self.ai_enabled = False   # 是否由电脑执黑
+        self.ai_is_red = False
+        self.ai_turn_time = 5     # 电脑每步用时上限（秒），与回合计时一起计算
+        self.ai_hash_mb = 32      # 置换表大小（MB），整局棋共用
+        self.engine = None
+        self.engine_thread = None
+        
+        # 分析模式：后台搜索当前局面，结果显示在右侧面板
+        self.analysis_enabled = False
+        self.analysis_engine = None
+        self.analysis_thread = None
+        self.analysis_pending = False  # 旧的分析线程结束后需要重新开始
+        self.book = xiangqi_book.open_book()  # 开局库，没有库文件时为 None
+        
+        # 联机对战：本地只在服务器确认后才走子
+        self.server_socket = None
+        self.online_side = None    # 服务器分配的 'red' / 'black'，配对前为 None
+        self.move_pending = False  # 走法已发出，等待服务器确认
+        self.clocks = [0, 0]       # 服务器给的红、黑双方剩余时间（毫秒）
+        
+        # 对局记录文件和复盘
+        self.record = None        # 保存后每走一步都追加写入的 xiangqi_record.GameRecord
+        self.replay = None        # 复盘中的 GameRecord，不在复盘时为 None
+        self.replay_ply = 0
+        self.replay_saved = None  # 进入复盘前的 (棋盘, 是否红方走)，退出时恢复
         
         # 初始化棋盘和按钮数组
         self.board = [['' for _ in range(9)] for _ in range(10)]
         self.buttons = [[None for _ in range(9)] for _ in range(10)]
+        # 每个按钮当前显示的 (棋子, 状态, 大小)，没变的按钮不再重设样式
+        self.button_keys = [[None for _ in range(9)] for _ in range(10)]
+        self.highlighted = set()  # 当前高亮（选中和可走）的格子
+        self.click_latencies = deque(maxlen=240)  # 最近每次点击的处理用时（秒）
+        self.move_cache = LegalMoveCache()  # 选子时的可走格子，同一局面再选同一个子直接取
         
         # 添加计时相关的属性
         self.timer = QTimer()
@@ -84,6 +443,7 @@ class ChessBoard(QMainWindow):
         
         # 初始化UI
         self.initUI()
+        self.init_replay_keys()
         self.start_timer()
         
         # 修改窗口样式
@@ -95,6 +455,9 @@ class ChessBoard(QMainWindow):
         
         # 设置固定大小
         self.setFixedSize(300, 450)
+        
+        if server:
+            self.connect_server(server)
 
     def initUI(self):
         # 创建主窗口部件
@@ -104,10 +467,12 @@ class ChessBoard(QMainWindow):
         # 修改容器尺寸和布局
         board_container = QWidget()
         board_container.setFixedSize(300, 350)  # 增加容器高度
+        self.board_container = board_container
         
         # 创建棋盘背景部件
         board_background = ChessBoardWidget(board_container)
         board_background.setGeometry(0, 0, 300, 350)
+        self.board_view = board_background
         
         # 创建棋盘部件并设置为透明背景
         board_widget = QWidget(board_container)
@@ -120,8 +485,16 @@ class ChessBoard(QMainWindow):
         margin_x = (board_width - cell_size * 8) // 2
         margin_y = 25
         
+        # 绘制模式下不用按钮，点击由棋盘部件换算成格子
+        if self.renderer == 'painter':
+            board_widget.hide()
+            board_background.draw_pieces = True
+            board_background.square_clicked.connect(self.on_click)
+        
         # 创建棋盘按钮
         for row in range(10):
+            if self.renderer == 'painter':
+                break
             for col in range(9):
                 button = QPushButton('', board_widget)
                 button_size = int(cell_size * 0.8)
@@ -211,13 +584,39 @@ class ChessBoard(QMainWindow):
         control_panel_layout.addStretch(1)
         
         # 创建一个垂直布局来容纳棋盘和控制面板
-        main_layout = QVBoxLayout(main_widget)
-        main_layout.setContentsMargins(0, 0, 0, 0)
-        main_layout.setSpacing(0)
+        board_column = QWidget()
+        board_layout = QVBoxLayout(board_column)
+        board_layout.setContentsMargins(0, 0, 0, 0)
+        board_layout.setSpacing(0)
         
         # 添加一个弹性空间，将控制面板推到顶部
-        main_layout.addWidget(control_panel)
-        main_layout.addWidget(board_container)
+        board_layout.addWidget(control_panel)
+        board_layout.addWidget(board_container)
+        board_layout.addStretch(1)
+        
+        # 右侧的分析面板，开启分析模式时才显示
+        self.analysis_label = QLabel('')
+        self.analysis_label.setFixedWidth(ANALYSIS_PANEL_WIDTH - 10)
+        self.analysis_label.setWordWrap(True)
+        self.analysis_label.setAlignment(Qt.AlignLeft | Qt.AlignTop)
+        self.analysis_label.setStyleSheet('''
+            QLabel {
+                color: #8B4513;
+                font-family: SimSun;
+                font-size: 10pt;
+                background-color: rgba(255, 248, 220, 200);
+                border: 2px solid #8B4513;
+                border-radius: 10px;
+                padding: 6px;
+            }
+        ''')
+        self.analysis_label.hide()
+        
+        main_layout = QHBoxLayout(main_widget)
+        main_layout.setContentsMargins(0, 0, 5, 5)
+        main_layout.setSpacing(0)
+        main_layout.addWidget(board_column)
+        main_layout.addWidget(self.analysis_label)
         
         # 设置窗口属性
         self.setWindowTitle('中国象棋')
@@ -228,256 +627,267 @@ class ChessBoard(QMainWindow):
         self.update_board()
 
     def init_board(self):
-        # 红方(下方)
-        red_pieces = {
-            9: ['车', '马', '相', '仕', '帅', '仕', '相', '马', '车'],
-            7: ['', '炮', '', '', '', '', '', '炮', ''],  # 红炮在第7行第2列和第8列
-            6: ['兵', '', '兵', '', '兵', '', '兵', '', '兵'],  # 红兵在第6行
-        }
-        
-        # 黑方(上方)
-        black_pieces = {
-            0: ['車', '馬', '象', '士', '将', '士', '象', '馬', '車'],  # 修复了黑象的位置
-            2: ['', '砲', '', '', '', '', '', '砲', ''],  # 黑炮在第2行第2列和第8列
-            3: ['卒', '', '卒', '', '卒', '', '卒', '', '卒']  # 黑卒的位置
-        }
-        
-        # 放置红方棋子
-        for row, pieces in red_pieces.items():
-            for col, piece in enumerate(pieces):
-                if piece:
-                    self.board[row][col] = piece
-        
-        # 放置黑方棋子
-        for row, pieces in black_pieces.items():
-            for col, piece in enumerate(pieces):
-                if piece:
-                    self.board[row][col] = piece
+        # 开局摆子规则放在 xiangqi_rules 中，便于脱离界面使用
+        xiangqi_rules.init_board(self.board)
+        self.start_fen = xiangqi_position.START_FEN  # 本局起始局面，导出棋谱时使用
+        # 局面的 Zobrist 键，走子和悔棋时增量更新
+        self.zobrist_key = xiangqi_position.board_key(self.board, self.is_red_turn)
+        self.reset_position_history()
+
+    def reset_position_history(self):
+        # 记录出现过的局面，用于判定重复局面和长将、长捉
+        side = xiangqi_position.RED if self.is_red_turn else xiangqi_position.BLACK_SIDE
+        self.position_history = xiangqi_repetition.PositionHistory(self.zobrist_key, side)
+
+    def to_fen(self):
+        """当前局面的 FEN"""
+        return xiangqi_notation.board_to_fen(self.board, self.is_red_turn)
+
+    def load_fen(self, fen, moves=()):
+        """从 FEN 摆出局面并清空走子记录，再走完 moves（走法编码），中间不刷新界面"""
+        board, is_red_turn = xiangqi_notation.fen_to_board(fen)
+        # 复盘中摆新局面（粘贴 FEN、联机开局）时直接结束复盘，不再恢复进入前的棋盘
+        if self.replay is not None:
+            self.replay = None
+            self.replay_saved = None
+            self.setWindowTitle('中国象棋')
+        self.stop_engine()
+        self.close_record()
+        self.move_cache.clear()
+        self.board = board
+        self.is_red_turn = is_red_turn
+        self.start_fen = xiangqi_notation.board_to_fen(board, is_red_turn)
+        self.zobrist_key = xiangqi_position.board_key(self.board, self.is_red_turn)
+        self.reset_position_history()
+        self.selected_piece = None
+        self.game_over = False
+        self.move_history.clear()
+        self.current_turn_time = 0
+        for move in moves:
+            (prev_row, prev_col), (row, col) = xiangqi_engine.move_to_coords(move)
+            self.push_move(prev_row, prev_col, row, col)
+        self.update_board()
+        if not self.check_game_over():
+            self.start_engine_if_needed()
+        self.restart_analysis()
+
+    def copy_fen(self):
+        QApplication.clipboard().setText(self.to_fen())
+
+    def paste_fen(self):
+        try:
+            self.load_fen(QApplication.clipboard().text().strip())
+        except (ValueError, KeyError):
+            QMessageBox.warning(self, '无法导入', '剪贴板里不是有效的 FEN 局面')
+
+    def copy_game(self):
+        """把本局棋谱（ICCS 记法）复制到剪贴板"""
+        moves = xiangqi_notation.history_to_moves(self.move_history)
+        QApplication.clipboard().setText(xiangqi_notation.write_game(moves, self.start_fen))
+
+    def close_record(self):
+        """不再往记录文件里写"""
+        if self.record is not None:
+            self.record.close()
+            self.record = None
+
+    def save_game(self):
+        """把本局写入记录文件，之后每走一步、每次悔棋都追加到这个文件"""
+        path, _ = QFileDialog.getSaveFileName(self, '保存对局', '', RECORD_FILTER)
+        if not path:
+            return
+        self.close_record()
+        try:
+            record = xiangqi_record.GameRecord.create(
+                path, xiangqi_position.Position.from_fen(self.start_fen))
+            for move in xiangqi_notation.history_to_moves(self.move_history):
+                record.push(move)
+        except OSError as error:
+            QMessageBox.warning(self, '无法保存', str(error))
+            return
+        self.record = record
+
+    def open_game(self):
+        """读入记录文件并进入复盘"""
+        if self.server_socket is not None:
+            QMessageBox.information(self, '无法复盘', '联机对局中不能复盘')
+            return
+        path, _ = QFileDialog.getOpenFileName(self, '打开对局', '', RECORD_FILTER)
+        if not path:
+            return
+        try:
+            record = xiangqi_record.GameRecord.load(path)
+        except (OSError, ValueError) as error:
+            QMessageBox.warning(self, '无法打开', str(error))
+            return
+        self.enter_replay(record)
+
+    def init_replay_keys(self):
+        """复盘快捷键：左右一步，上下十步，Home/End 到头尾，Esc 退出，回车从这一步接着下"""
+        keys = [
+            (Qt.Key_Left, lambda: self.step_replay(-1)),
+            (Qt.Key_Right, lambda: self.step_replay(1)),
+            (Qt.Key_Up, lambda: self.step_replay(-10)),
+            (Qt.Key_Down, lambda: self.step_replay(10)),
+            (Qt.Key_Home, lambda: self.step_replay(-len(self.replay or ()))),
+            (Qt.Key_End, lambda: self.step_replay(len(self.replay or ()))),
+            (Qt.Key_Escape, lambda: self.leave_replay()),
+            (Qt.Key_Return, lambda: self.leave_replay(resume=True)),
+        ]
+        for key, slot in keys:
+            QShortcut(QKeySequence(key), self).activated.connect(slot)
+
+    def enter_replay(self, record):
+        self.stop_engine()
+        if self.replay is None:
+            self.replay_saved = ([row[:] for row in self.board], self.is_red_turn)
+        self.selected_piece = None
+        self.clear_highlights()
+        self.replay = record
+        self.show_replay_ply(len(record))
+
+    def step_replay(self, delta):
+        if self.replay is not None:
+            self.show_replay_ply(self.replay_ply + delta)
+
+    def show_replay_ply(self, ply):
+        """显示记录中第 ply 步后的局面，从最近的快照算起，与棋局长短无关"""
+        record = self.replay
+        ply = max(0, min(ply, len(record)))
+        self.replay_ply = ply
+        position = record.position(ply)
+        self.board = position.to_board()
+        self.is_red_turn = position.side == xiangqi_position.RED
+        if self.renderer == 'painter':
+            last_move = xiangqi_engine.move_to_coords(record.moves[ply - 1]) if ply else None
+            self.board_view.set_position(self.board, last_move)
+        else:
+            self.update_board()
+        title = '中国象棋 - 复盘 %d/%d' % (ply, len(record))
+        if ply in record.comments:
+            title += '  ' + record.comments[ply]
+        self.setWindowTitle(title)
+        # 分析面板跟着显示的局面走
+        self.restart_analysis()
+
+    def leave_replay(self, resume=False):
+        """退出复盘；resume 时从当前显示的这一步接着下，否则回到原来的对局"""
+        if self.replay is None:
+            return
+        record, ply = self.replay, self.replay_ply
+        self.replay = None
+        self.setWindowTitle('中国象棋')
+        if resume:
+            self.replay_saved = None
+            self.load_fen(record.start_fen, record.moves[:ply])
+        else:
+            self.board, self.is_red_turn = self.replay_saved
+            self.replay_saved = None
+            self.update_board()
+            self.start_engine_if_needed()
+            self.restart_analysis()
 
     def update_board(self):
+        if self.renderer == 'painter':
+            last_move = self.move_history[-1][:2] if self.move_history else None
+            self.board_view.set_position(self.board, last_move)
+            return
+        # 只有内容或状态变了的按钮才会真正更新，一步棋通常只有起点、终点和高亮过的格子
+        self.highlighted.clear()
         for row in range(10):
             for col in range(9):
-                piece = self.board[row][col]
-                self.buttons[row][col].setText(piece)
-                self.update_button_style(self.buttons[row][col], row, col)
+                self.set_button(row, col)
+
+    def set_button(self, row, col, state='normal'):
+        """按棋盘内容和状态设置按钮，与当前显示相同时什么都不做"""
+        button = self.buttons[row][col]
+        piece = self.board[row][col]
+        if not piece and state == 'normal':
+            state = 'empty'
+        size = button.width()
+        key = (piece, state, size)
+        if self.button_keys[row][col] == key:
+            return
+        self.button_keys[row][col] = key
+        colour = ('red' if piece in RED_CHARS else 'black') if piece else ''
+        button.setStyleSheet(button_style(colour, state, size))
+        button.setText(piece)
+        button.setFlat(not piece)
 
     def is_valid_move(self, start_row, start_col, end_row, end_col):
-        piece = self.board[start_row][start_col]
-        target = self.board[end_row][end_col]
-        
-        # 检查否吃自己的子
-        if target:
-            is_red_target = target in '车马相仕帅炮兵'
-            is_red_piece = piece in '车马相仕帅炮兵'
-            if is_red_target == is_red_piece:
-                return False
-
-        # 根据不同的棋子类型检查移动是否合法
-        if piece in '车車':
-            return self.is_valid_chariot_move(start_row, start_col, end_row, end_col)
-        elif piece in '马馬':
-            return self.is_valid_horse_move(start_row, start_col, end_row, end_col)
-        elif piece in '相象':
-            return self.is_valid_elephant_move(start_row, start_col, end_row, end_col)
-        elif piece in '仕士':
-            return self.is_valid_advisor_move(start_row, start_col, end_row, end_col)
-        elif piece in '帅将':
-            return self.is_valid_general_move(start_row, start_col, end_row, end_col)
-        elif piece in '炮砲':
-            return self.is_valid_cannon_move(start_row, start_col, end_row, end_col)
-        elif piece in '兵卒':
-            return self.is_valid_pawn_move(start_row, start_col, end_row, end_col)
-        return False
+        return xiangqi_rules.is_valid_move(self.board, start_row, start_col, end_row, end_col)
 
     def is_valid_chariot_move(self, start_row, start_col, end_row, end_col):
-        # 只能直移动
-        if start_row != end_row and start_col != end_col:
-            return False
-            
-        # 检查路径上是否有其他棋子
-        if start_row == end_row:  # 横向移动
-            min_col = min(start_col, end_col)
-            max_col = max(start_col, end_col)
-            for col in range(min_col + 1, max_col):
-                if self.board[start_row][col]:
-                    return False
-        else:  # 纵向移动
-            min_row = min(start_row, end_row)
-            max_row = max(start_row, end_row)
-            for row in range(min_row + 1, max_row):
-                if self.board[row][start_col]:
-                    return False
-        return True
+        return xiangqi_rules.is_valid_chariot_move(self.board, start_row, start_col, end_row, end_col)
 
     def is_valid_horse_move(self, start_row, start_col, end_row, end_col):
-        row_diff = abs(end_row - start_row)
-        col_diff = abs(end_col - start_col)
-        
-        # 马走"日"字
-        if not ((row_diff == 2 and col_diff == 1) or (row_diff == 1 and col_diff == 2)):
-            return False
-            
-        # 检查马脚
-        if row_diff == 2:
-            block_row = start_row + (1 if end_row > start_row else -1)
-            if self.board[block_row][start_col]:
-                return False
-        else:
-            block_col = start_col + (1 if end_col > start_col else -1)
-            if self.board[start_row][block_col]:
-                return False
-        return True
+        return xiangqi_rules.is_valid_horse_move(self.board, start_row, start_col, end_row, end_col)
 
     def is_valid_elephant_move(self, start_row, start_col, end_row, end_col):
-        # 相/走田字，不能过河
-        row_diff = abs(end_row - start_row)
-        col_diff = abs(end_col - start_col)
-        
-        # 检查是否走"田"字
-        if row_diff != 2 or col_diff != 2:
-            return False
-        
-        # 检查是否过河
-        is_red = self.board[start_row][start_col] == '相'
-        if is_red and end_row < 5:  # 红相不能过河
-            return False
-        if not is_red and end_row > 4:  # 黑象不能过河
-            return False
-        
-        # 检查象心是否被塞
-        block_row = (start_row + end_row) // 2
-        block_col = (start_col + end_col) // 2
-        if self.board[block_row][block_col]:
-            return False
-        
-        return True
+        return xiangqi_rules.is_valid_elephant_move(self.board, start_row, start_col, end_row, end_col)
 
     def is_valid_advisor_move(self, start_row, start_col, end_row, end_col):
-        # 仕/士走斜线，限制在九宫格内
-        row_diff = abs(end_row - start_row)
-        col_diff = abs(end_col - start_col)
-        
-        # 检查是否走斜线一步
-        if row_diff != 1 or col_diff != 1:
-            return False
-        
-        # 检查是否在九宫格内
-        is_red = self.board[start_row][start_col] == '仕'
-        if is_red:
-            if end_row < 7 or end_col < 3 or end_col > 5:  # 红仕限制在下方九宫格
-                return False
-        else:
-            if end_row > 2 or end_col < 3 or end_col > 5:  # 黑士限制在上方九宫格
-                return False
-        
-        return True
+        return xiangqi_rules.is_valid_advisor_move(self.board, start_row, start_col, end_row, end_col)
 
     def is_valid_general_move(self, start_row, start_col, end_row, end_col):
-        # 帅/将走直线一步，限制在九宫格内
-        row_diff = abs(end_row - start_row)
-        col_diff = abs(end_col - start_col)
-        
-        # 检查是否走线一步
-        if row_diff + col_diff != 1:
-            return False
-        
-        # 查是否在九宫格内
-        is_red = self.board[start_row][start_col] == '帅'
-        if is_red:
-            if end_row < 7 or end_col < 3 or end_col > 5:  # 红帅限制下方九宫格
-                return False
-        else:
-            if end_row > 2 or end_col < 3 or end_col > 5:  # 黑将限制在上方九宫格
-                return False
-        
-        return True
+        return xiangqi_rules.is_valid_general_move(self.board, start_row, start_col, end_row, end_col)
 
     def is_valid_cannon_move(self, start_row, start_col, end_row, end_col):
-        # 炮的移动规则：直线移动，吃子时必须一个棋子
-        if start_row != end_row and start_col != end_col:
-            return False
-        
-        # 计算路径上的棋子数量
-        pieces_in_path = 0
-        if start_row == end_row:  # 横向移动
-            min_col = min(start_col, end_col)
-            max_col = max(start_col, end_col)
-            for col in range(min_col + 1, max_col):
-                if self.board[start_row][col]:
-                    pieces_in_path += 1
-        else:  # 纵向移动
-            min_row = min(start_row, end_row)
-            max_row = max(start_row, end_row)
-            for row in range(min_row + 1, max_row):
-                if self.board[row][start_col]:
-                    pieces_in_path += 1
-        
-        # 判断移动否合法
-        target = self.board[end_row][end_col]
-        if target:  # 子时必须跳过一个棋子
-            return pieces_in_path == 1
-        else:  # 移动时不能有棋子阻挡
-            return pieces_in_path == 0
+        return xiangqi_rules.is_valid_cannon_move(self.board, start_row, start_col, end_row, end_col)
 
     def is_valid_pawn_move(self, start_row, start_col, end_row, end_col):
-        # 兵/卒只能向前走，过河后可以横走
-        row_diff = end_row - start_row
-        col_diff = abs(end_col - start_col)
-        
-        is_red = self.board[start_row][start_col] == '兵'
-        
-        # 检查动方向
-        if is_red:
-            if row_diff > 0:  # 红兵只能向上
-                return False
+        return xiangqi_rules.is_valid_pawn_move(self.board, start_row, start_col, end_row, end_col)
+
+    def check_game_over(self):
+        # 检查将帅是否还在棋盘上，合法走法模式下还要检查将死和困毙
+        if self.strict_rules:
+            winner, reason = xiangqi_rules.game_status(self.board, self.is_red_turn)
+            if winner is None:
+                winner, reason = self.position_history.status()
         else:
-            if row_diff < 0:  # 黑卒只能向下
-                return False
-        
-        # 检查移动步数
-        if abs(row_diff) + col_diff != 1:
+            winner, reason = xiangqi_rules.find_winner(self.board), '吃将'
+
+        # 判断胜负
+        if winner is None:
             return False
-        
-        # 检查是否可以横走（过河后）
-        if col_diff == 1:
-            if is_red and start_row > 4:  # 红兵未过河
-                return False
-            if not is_red and start_row < 5:  # 黑卒未过河
-                return False
-        
+        self.show_result(winner, reason)
         return True
 
-    def check_game_over(self):
-        # 检查将帅是否还棋盘上
-        red_general_exists = False
-        black_general_exists = False
-        
-        for row in range(10):
-            for col in range(9):
-                piece = self.board[row][col]
-                if piece == '帅':
-                    red_general_exists = True
-                elif piece == '将':
-                    black_general_exists = True
-                    
-        # 判断胜负
-        if not red_general_exists:
-            self.game_over = True
-            QMessageBox.information(self, '游戏结束', '黑方胜利！')
-            return True
-        elif not black_general_exists:
-            self.game_over = True
-            QMessageBox.information(self, '游戏结束', '红方胜利！')
-            return True
-        return False
+    def show_result(self, winner, reason):
+        """结束对局并弹出结果，winner 为 'red'、'black' 或 'draw'"""
+        if winner == 'draw':
+            message = '和棋！'
+        else:
+            message = '黑方胜利！' if winner == 'black' else '红方胜利！'
+        if reason and reason != '吃将':
+            message = reason + '，' + message
+        self.game_over = True
+        QMessageBox.information(self, '游戏结束', message)
 
     def undo_move(self):
-        if not self.move_history or self.game_over:
+        # 联机对局不能悔棋
+        if (not self.move_history or self.game_over or self.server_socket is not None
+                or self.replay is not None):
             return
-            
+        
+        # 人机对战时连同电脑的应着一起悔掉，回到自己走棋
+        self.stop_engine()
+        self.undo_last_move()
+        if self.is_ai_turn() and self.move_history:
+            self.undo_last_move()
+        if self.record is not None:
+            self.record.truncate(len(self.move_history))
+        self.start_engine_if_needed()
+        self.restart_analysis()
+
+    def undo_last_move(self):
+        """撤销一步棋"""
         # 获取上一步的移记录
         last_move = self.move_history.pop()
         start_pos, end_pos, captured_piece = last_move
+        self.zobrist_key ^= xiangqi_position.move_key_delta(
+            self.board[end_pos[0]][end_pos[1]], start_pos, end_pos, captured_piece)
+        self.position_history.pop()
         
         # 恢复棋子位置
         self.board[start_pos[0]][start_pos[1]] = self.board[end_pos[0]][end_pos[1]]
@@ -490,71 +900,49 @@ class ChessBoard(QMainWindow):
         self.update_board()
 
     def get_valid_moves(self, row, col):
-        """获取指定置棋子的所有合法动位置"""
-        valid_moves = []
-        piece = self.board[row][col]
-        if not piece:
-            return valid_moves
-        
-        # 检查所有可能的位置
-        for end_row in range(10):
-            for end_col in range(9):
-                if self.is_valid_move(row, col, end_row, end_col):
-                    valid_moves.append((end_row, end_col))
-                
-        return valid_moves
+        """获取指定位置棋子的所有合法移动位置，同一局面下重复选子时取缓存"""
+        key = (self.zobrist_key, self.strict_rules, row, col)
+        return self.move_cache.get(key, lambda: self.compute_valid_moves(row, col))
+
+    def compute_valid_moves(self, row, col):
+        if self.strict_rules:
+            return xiangqi_rules.get_legal_moves(self.board, row, col)
+        return xiangqi_rules.get_valid_moves(self.board, row, col)
+
+    def is_legal_move(self, start_row, start_col, end_row, end_col):
+        """检查走法是否合法，合法走法模式下排除送将和白脸将"""
+        if self.strict_rules:
+            return xiangqi_rules.is_legal_move(self.board, start_row, start_col, end_row, end_col)
+        return self.is_valid_move(start_row, start_col, end_row, end_col)
 
     def highlight_valid_moves(self, moves):
         """高亮显示所有合法移动位置"""
+        if self.renderer == 'painter':
+            self.board_view.set_selection(self.selected_piece, moves)
+            return
         for row, col in moves:
-            button = self.buttons[row][col]
-            if self.board[row][col]:  # 如果目标位置有棋子
-                button.setStyleSheet('''
-                    QPushButton { 
-                        color: %s;
-                        background-color: rgba(255, 200, 200, 180); 
-                        border: 2px solid #8B4513;
-                        border-radius: %dpx;
-                    }
-                    QPushButton:hover { 
-                        background-color: rgba(255, 200, 200, 180); 
-                    }
-                    QPushButton:pressed { 
-                        background-color: rgba(255, 200, 200, 180); 
-                    }
-                ''' % (
-                    'red' if self.board[row][col] in '车马相仕帅炮兵' else 'black',
-                    button.width() // 2
-                ))
-            else:  # 如果目标位置为空
-                button.setStyleSheet('''
-                    QPushButton { 
-                        background-color: rgba(144, 238, 144, 180);
-                        border: 2px solid #8B4513;
-                        border-radius: %dpx;
-                    }
-                    QPushButton:hover { 
-                        background-color: rgba(144, 238, 144, 180);
-                    }
-                    QPushButton:pressed { 
-                        background-color: rgba(144, 238, 144, 180);
-                    }
-                ''' % (button.width() // 2))
+            # 有棋子的目标显示为可吃，空位显示为可走
+            self.set_button(row, col, 'capture' if self.board[row][col] else 'target')
+            self.highlighted.add((row, col))
 
     def clear_highlights(self):
         """清除所有高亮显示"""
-        for row in range(10):
-            for col in range(9):
-                piece = self.board[row][col]
-                if piece in '车马相仕帅炮兵':
-                    self.buttons[row][col].setStyleSheet('color: red;')
-                elif piece in '車馬象士将砲卒':
-                    self.buttons[row][col].setStyleSheet('color: black;')
-                else:
-                    self.buttons[row][col].setStyleSheet('')
+        if self.renderer == 'painter':
+            self.board_view.set_selection(None, ())
+            return
+        for row, col in self.highlighted:
+            self.set_button(row, col)
+        self.highlighted.clear()
 
     def on_click(self, row, col):
-        if self.game_over:
+        """处理点击并记录用时，最近的用时在 click_latencies 里"""
+        start = time.perf_counter()
+        self.handle_click(row, col)
+        self.click_latencies.append(time.perf_counter() - start)
+
+    def handle_click(self, row, col):
+        if (self.game_over or self.replay is not None or self.is_ai_turn()
+                or not self.is_local_turn()):
             return
             
         current_piece = self.board[row][col]
@@ -564,19 +952,14 @@ class ChessBoard(QMainWindow):
             is_red_piece = current_piece in '车马相仕帅炮兵'
             if (self.is_red_turn and is_red_piece) or (not self.is_red_turn and not is_red_piece):
                 self.selected_piece = (row, col)
+                valid_moves = self.get_valid_moves(row, col)
+                if self.renderer == 'painter':
+                    self.board_view.set_selection((row, col), valid_moves)
+                    return
                 # 高亮显示选中的棋子
-                button = self.buttons[row][col]
-                button.setStyleSheet('''
-                    QPushButton { 
-                        color: %s;
-                        background-color: #FFE4B5; 
-                        border: 2px solid #8B4513;
-                        border-radius: %dpx;
-                    }
-                ''' % ('red' if is_red_piece else 'black', button.width() // 2))
-                button.setText(current_piece)
+                self.set_button(row, col, 'selected')
+                self.highlighted.add((row, col))
                 # 显示可移动位置
-                valid_moves = self.get_valid_moves(row, col)
                 self.highlight_valid_moves(valid_moves)
         
         elif self.selected_piece is not None:
@@ -584,31 +967,299 @@ class ChessBoard(QMainWindow):
             
             if (row, col) == self.selected_piece:
                 # 取消选择
-                self.update_button_style(self.buttons[prev_row][prev_col], prev_row, prev_col)
-                self.selected_piece = None
+                self.deselect(prev_row, prev_col)
             
-            elif self.is_valid_move(prev_row, prev_col, row, col):
-                # 移动棋子
-                captured_piece = self.board[row][col]
-                self.move_history.append(((prev_row, prev_col), (row, col), captured_piece))
-                
-                self.board[row][col] = self.board[prev_row][prev_col]
-                self.board[prev_row][prev_col] = ''
-                self.selected_piece = None
-                self.is_red_turn = not self.is_red_turn
-                self.update_board()
-                
-                # 重置当前回合用时
-                self.current_turn_time = 0
-                
-                if captured_piece in '帅将':
-                    self.check_game_over()
+            elif self.is_legal_move(prev_row, prev_col, row, col):
+                if self.server_socket is not None:
+                    self.send_move(prev_row, prev_col, row, col)
+                else:
+                    self.apply_move(prev_row, prev_col, row, col)
             else:
                 # 取消选择
-                self.update_button_style(self.buttons[prev_row][prev_col], prev_row, prev_col)
-                self.selected_piece = None
+                self.deselect(prev_row, prev_col)
+
+    def deselect(self, row, col):
+        """取消选中 (row, col) 上的棋子"""
+        self.selected_piece = None
+        self.clear_highlights()
+
+    def apply_move(self, prev_row, prev_col, row, col):
+        """走一步棋并切换回合，玩家和电脑都通过这里走棋"""
+        self.push_move(prev_row, prev_col, row, col)
+        self.selected_piece = None
+        if self.record is not None:
+            self.record.push(xiangqi_position.make_move(prev_row * 9 + prev_col, row * 9 + col))
+        self.update_board()
+        
+        # 重置当前回合用时
+        self.current_turn_time = 0
+        
+        if not self.check_game_over():
+            self.start_engine_if_needed()
+        self.restart_analysis()
+
+    def push_move(self, prev_row, prev_col, row, col):
+        """只更新棋盘、局面键和走子记录，不刷新界面"""
+        # 先在走子前的局面上判断这步是否将军、捉子
+        position = xiangqi_position.Position.from_board(self.board, self.is_red_turn)
+        check, chase = xiangqi_repetition.move_flags(
+            position, xiangqi_position.make_move(prev_row * 9 + prev_col, row * 9 + col))
+        
+        # 移动棋子
+        captured_piece = self.board[row][col]
+        self.move_history.append(((prev_row, prev_col), (row, col), captured_piece))
+        self.zobrist_key ^= xiangqi_position.move_key_delta(
+            self.board[prev_row][prev_col], (prev_row, prev_col), (row, col), captured_piece)
+        
+        self.board[row][col] = self.board[prev_row][prev_col]
+        self.board[prev_row][prev_col] = ''
+        self.is_red_turn = not self.is_red_turn
+        self.position_history.push(self.zobrist_key, check, chase)
+
+    def is_ai_turn(self):
+        return (self.ai_enabled and self.server_socket is None
+                and self.is_red_turn == self.ai_is_red)
+
+    def is_local_turn(self):
+        """联机时只有轮到自己、且上一步已经确认时才能走"""
+        if self.server_socket is None:
+            return True
+        return (self.online_side is not None and not self.move_pending
+                and self.is_red_turn == (self.online_side == 'red'))
+
+    def connect_server(self, address):
+        """连接 xiangqi_server 并排队等对手，连不上时留在本地对局"""
+        # '主机:端口'、'主机' 或 ':端口'，省略的部分用服务器的默认值
+        host, sep, port = address.rpartition(':')
+        if not sep:
+            host, port = address, ''
+        try:
+            port = int(port or xiangqi_server.DEFAULT_PORT)
+        except ValueError:
+            QMessageBox.warning(self, '无法连接', '服务器地址应为 主机:端口，收到 %r' % address)
+            return
+        socket = QTcpSocket(self)
+        socket.connectToHost(host or xiangqi_server.DEFAULT_HOST, port)
+        if not socket.waitForConnected(3000):
+            QMessageBox.warning(self, '无法连接', '连接服务器失败：' + socket.errorString())
+            socket.deleteLater()
+            return
+        socket.readyRead.connect(self.on_server_data)
+        socket.disconnected.connect(self.on_server_disconnected)
+        self.server_socket = socket
+        self.set_ai_enabled(False)
+        self.send_server('play')
+
+    def send_server(self, line):
+        self.server_socket.write((line + '\n').encode('utf-8'))
+
+    def send_move(self, prev_row, prev_col, row, col):
+        """把走法发给服务器，收到服务器广播的 move 后才真正走子"""
+        self.send_server('move ' + xiangqi_notation.coords_to_iccs((prev_row, prev_col), (row, col)))
+        self.move_pending = True
+        self.deselect(prev_row, prev_col)
+
+    def on_server_data(self):
+        while self.server_socket.canReadLine():
+            tokens = bytes(self.server_socket.readLine()).decode('utf-8', 'replace').split()
+            if tokens:
+                self.handle_server_line(tokens[0], tokens[1:])
+
+    def handle_server_line(self, command, args):
+        if command == 'wait':
+            self.setWindowTitle('中国象棋 - 等待对手')
+        elif command == 'start':
+            self.online_side = args[1]
+            self.move_pending = False
+            self.clocks = [int(args[2]), int(args[2])]
+            self.load_fen(xiangqi_position.START_FEN)
+            self.start_timer()
+            self.setWindowTitle('中国象棋 - 第 %s 局 %s' % (
+                args[0], '执红' if self.online_side == 'red' else '执黑'))
+        elif command == 'move':
+            (prev_row, prev_col), (row, col) = xiangqi_notation.iccs_to_coords(args[0])
+            self.move_pending = False
+            self.clocks = [int(args[1]), int(args[2])]
+            if self.selected_piece is not None:
+                self.deselect(*self.selected_piece)
+            self.apply_move(prev_row, prev_col, row, col)
+        elif command == 'over':
+            # 将死、长将等本地走子时已经判出，超时、认输和断线只有服务器知道
+            self.online_side = None
+            if not self.game_over:
+                self.show_result(args[0], args[1] if len(args) > 1 else '')
+        elif command == 'error':
+            self.move_pending = False
+            self.setWindowTitle('中国象棋 - ' + ' '.join(args))
+
+    def on_server_disconnected(self):
+        self.server_socket.deleteLater()
+        self.server_socket = None
+        self.online_side = None
+        if not self.game_over:
+            self.game_over = True
+            QMessageBox.warning(self, '连接断开', '与服务器的连接已断开')
+
+    def set_ai_enabled(self, enabled):
+        """开启或关闭电脑执黑"""
+        self.ai_enabled = enabled
+        if enabled:
+            self.start_engine_if_needed()
+        else:
+            self.stop_engine()
+
+    def start_engine_if_needed(self):
+        """轮到电脑走棋时在后台线程开始搜索"""
+        if (not self.is_ai_turn() or self.game_over or self.engine_thread is not None
+                or self.replay is not None):
+            return
+        position = xiangqi_position.Position.from_board(self.board, self.is_red_turn)
+        if self.book is not None:
+            move = self.book.choose(position)
+            if move:
+                # 稍等一下再走，让玩家看清上一步
+                key = self.zobrist_key
+                QTimer.singleShot(300, lambda: self.play_book_move(key, move))
+                return
+        # 电脑用时与回合计时共用一个时钟，回合计时到 ai_turn_time 之前走棋
+        time_limit = max(0.5, self.ai_turn_time - self.current_turn_time)
+        if self.engine is None:
+            self.engine = xiangqi_engine.Engine(
+                hash_mb=self.ai_hash_mb, tablebase=xiangqi_tablebase.open_tablebase())
+        self.engine_thread = EngineThread(self.engine, position, time_limit,
+                                          self.position_history.keys, self)
+        self.engine_thread.search_finished.connect(self.on_engine_move)
+        self.engine_thread.finished.connect(self.engine_thread.deleteLater)
+        self.engine_thread.start()
+
+    def play_book_move(self, key, move):
+        # 等待期间悔棋或重新开始，局面变了就重新决定
+        if (self.zobrist_key != key or not self.is_ai_turn() or self.game_over
+                or self.replay is not None):
+            return
+        (prev_row, prev_col), (row, col) = xiangqi_engine.move_to_coords(move)
+        self.setWindowTitle('中国象棋 - 开局库')
+        self.apply_move(prev_row, prev_col, row, col)
+
+    def stop_engine(self):
+        """中止正在进行的搜索，结果作废"""
+        if self.engine_thread is None:
+            return
+        thread = self.engine_thread
+        self.engine_thread = None
+        thread.stop()
+
+    def on_engine_move(self, result):
+        # 悔棋或重新开始后，旧线程的结果直接丢弃
+        if self.sender() is not self.engine_thread:
+            return
+        self.engine_thread = None
+        if not result['move'] or self.game_over:
+            return
+        (prev_row, prev_col), (row, col) = xiangqi_engine.move_to_coords(result['move'])
+        self.setWindowTitle('中国象棋 - 深度 %d  %d 节点/秒' % (result['depth'], result['nps']))
+        self.apply_move(prev_row, prev_col, row, col)
+
+    def set_analysis_enabled(self, enabled):
+        """开启或关闭分析模式，开启时窗口右侧多出分析面板"""
+        self.analysis_enabled = enabled
+        width = 300 + (ANALYSIS_PANEL_WIDTH if enabled else 0)
+        self.setFixedSize(width, self.height())
+        self.analysis_label.setVisible(enabled)
+        if enabled:
+            self.analysis_label.setText('分析中…')
+            self.restart_analysis()
+        else:
+            self.analysis_pending = False
+            if self.analysis_thread is not None:
+                self.analysis_thread.cancel()
+
+    def restart_analysis(self):
+        """局面变化后重新分析；旧线程只请求停止，结束后再开始，界面不等待"""
+        if not self.analysis_enabled:
+            return
+        self.analysis_pending = True
+        if self.analysis_thread is not None:
+            self.analysis_thread.cancel()
+            return
+        self.start_analysis()
+
+    def start_analysis(self):
+        self.analysis_pending = False
+        if self.analysis_engine is None:
+            self.analysis_engine = xiangqi_engine.Engine(hash_mb=self.ai_hash_mb)
+        position = xiangqi_position.Position.from_board(self.board, self.is_red_turn)
+        # 复盘时棋盘上的局面不在本局的历史里，不按重复局面判和
+        history = self.position_history.keys if self.replay is None else ()
+        self.analysis_thread = AnalysisThread(self.analysis_engine, position,
+                                              history, parent=self)
+        self.analysis_thread.info_updated.connect(self.on_analysis_info)
+        self.analysis_thread.finished.connect(self.on_analysis_finished)
+        self.analysis_thread.start()
+
+    def on_analysis_finished(self):
+        thread = self.sender()
+        if thread is self.analysis_thread:
+            self.analysis_thread = None
+        thread.deleteLater()
+        if self.analysis_pending and self.analysis_enabled:
+            self.start_analysis()
+
+    def on_analysis_info(self, info):
+        thread = self.sender()
+        if thread is not self.analysis_thread or thread.cancelled:
+            return
+        # 分数换成红方视角，主要变例用 WXF 纵线记法
+        score = info['score'] if thread.position.side == xiangqi_position.RED else -info['score']
+        if abs(score) >= xiangqi_engine.MATE_BOUND:
+            plies = xiangqi_engine.MATE - abs(score)
+            score_text = ('红' if score > 0 else '黑') + '方 %d 步杀' % plies
+        else:
+            score_text = '%+d（红方视角）' % score
+        position = thread.position.copy()
+        pv = []
+        for move in info['pv']:
+            pv.append(xiangqi_notation.move_to_wxf(position, move))
+            position.do_move(move)
+        self.analysis_label.setText(
+            '深度 %d\n分数 %s\n%.0f 千节点/秒\n\n主要变例：\n%s'
+            % (info['depth'], score_text, info['nps'] / 1000, ' '.join(pv)))
+
+    def closeEvent(self, event):
+        # 退出前停下后台搜索，避免线程还在运行时被销毁
+        self.analysis_enabled = False
+        if self.analysis_thread is not None:
+            self.analysis_thread.cancel()
+            self.analysis_thread.wait()
+        self.stop_engine()
+        super().closeEvent(event)
+
+    def contextMenuEvent(self, event):
+        # 右键菜单：人机对战开关
+        menu = QMenu(self)
+        ai_action = QAction('电脑执黑', menu)
+        ai_action.setCheckable(True)
+        ai_action.setChecked(self.ai_enabled)
+        ai_action.toggled.connect(self.set_ai_enabled)
+        menu.addAction(ai_action)
+        analysis_action = QAction('分析模式', menu)
+        analysis_action.setCheckable(True)
+        analysis_action.setChecked(self.analysis_enabled)
+        analysis_action.toggled.connect(self.set_analysis_enabled)
+        menu.addAction(analysis_action)
+        menu.addSeparator()
+        menu.addAction('复制局面 FEN', self.copy_fen)
+        menu.addAction('粘贴局面 FEN', self.paste_fen)
+        menu.addAction('复制棋谱', self.copy_game)
+        menu.addSeparator()
+        menu.addAction('保存对局…', self.save_game)
+        menu.addAction('打开对局…', self.open_game)
+        menu.exec_(event.globalPos())
 
     def restart_game(self):
+        if self.server_socket is not None:
+            self.restart_online_game()
+            return
         reply = QMessageBox.question(self, '确重新开始', 
                                    '确定要重新开始游戏吗？',
                                    QMessageBox.Yes | QMessageBox.No,
@@ -616,6 +1267,10 @@ class ChessBoard(QMainWindow):
         
         if reply == QMessageBox.Yes:
             # 重置游戏状态
+            self.leave_replay()
+            self.stop_engine()
+            self.close_record()
+            self.move_cache.clear()
             self.selected_piece = None
             self.is_red_turn = True
             self.game_over = False
@@ -637,9 +1292,26 @@ class ChessBoard(QMainWindow):
             self.update_board()
             
             # 清除所有按钮的背景色
-            for row in range(10):
-                for col in range(9):
-                    self.update_button_style(self.buttons[row][col], row, col)
+            if self.renderer == 'buttons':
+                for row in range(10):
+                    for col in range(9):
+                        self.update_button_style(self.buttons[row][col], row, col)
+            
+            self.start_engine_if_needed()
+            self.restart_analysis()
+
+    def restart_online_game(self):
+        """联机时重新开始：对局没结束就先认输，然后重新排队等对手"""
+        text = '确定要重新找对手吗？' if self.game_over else '确定要认输并重新找对手吗？'
+        reply = QMessageBox.question(self, '重新开始', text,
+                                     QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        if reply != QMessageBox.Yes or self.server_socket is None:
+            return
+        self.leave_replay()
+        if self.online_side is not None and not self.game_over:
+            self.send_server('resign')
+        self.online_side = None
+        self.send_server('play')
 
     def start_timer(self):
         """启动计时器"""
@@ -654,6 +1326,12 @@ class ChessBoard(QMainWindow):
             
         self.current_turn_time += 1
         
+        # 联机时显示走棋方的剩余时间，每步由服务器校准
+        if self.online_side is not None:
+            remaining = self.clocks[0 if self.is_red_turn else 1] // 1000 - self.current_turn_time
+            self.turn_time_label.setText(self.format_turn_time(max(0, remaining)))
+            return
+        
         # 只更新当前回合时间
         self.turn_time_label.setText(self.format_turn_time(self.current_turn_time))
 
@@ -676,9 +1354,13 @@ class ChessBoard(QMainWindow):
         self.update_layout()
     
     def update_layout(self):
-        # 重新计算格子大小
-        cell_size = min(self.width() // 9, self.height() // 10)
-        margin_x = (self.width() - cell_size * 8) // 2
+        # 绘制模式下棋子跟着棋盘部件的大小画，不用逐个调整按钮
+        if self.renderer == 'painter':
+            return
+        # 重新计算格子大小（按棋盘区域的宽度，分析面板不占棋盘位置）
+        board_width = self.board_container.width()
+        cell_size = min(board_width // 9, self.height() // 10)
+        margin_x = (board_width - cell_size * 8) // 2
         margin_y = 25
         
         # 更新所有棋子按钮的大小和位置
@@ -697,67 +1379,115 @@ class ChessBoard(QMainWindow):
                 self.update_button_style(button, row, col)
 
     def update_button_style(self, button, row, col):
-        piece = self.board[row][col]
-        button_size = button.width()
-        
-        if piece in '车马相仕帅炮兵':
-            button.setStyleSheet('''
-                QPushButton { 
-                    color: red;
-                    background-color: #F0E4D0; 
-                    border: 2px solid #8B4513;
-                    border-radius: %dpx;
-                }
-                QPushButton:hover { 
-                    background-color: #F0E4D0; 
-                }
-                QPushButton:pressed { 
-                    background-color: #F0E4D0; 
-                }
-            ''' % (button_size // 2))
-            button.setText(piece)
-        elif piece in '車馬象士将砲卒':
-            button.setStyleSheet('''
-                QPushButton { 
-                    color: black;
-                    background-color: #F0E4D0; 
-                    border: 2px solid #8B4513;
-                    border-radius: %dpx;
-                }
-                QPushButton:hover { 
-                    background-color: #F0E4D0; 
-                }
-                QPushButton:pressed { 
-                    background-color: #F0E4D0; 
-                }
-            ''' % (button_size // 2))
-            button.setText(piece)
-        else:  # 空位置完全透明且不显任何内容
-            button.setStyleSheet('''
-                QPushButton { 
-                    background: transparent;
-                    border: none;
-                    color: transparent;
-                    outline: none;
-                }
-                QPushButton:hover { 
-                    background: transparent;
-                    border: none;
-                }
-                QPushButton:pressed { 
-                    background: transparent;
-                    border: none;
-                }
-                QPushButton:focus { 
-                    outline: none;
-                    border: none;
-                }
-            ''')
-            button.setText('')
-            button.setFlat(True)  # 设置按钮为平面样式
+        # 样式表按 (颜色, 状态, 大小) 缓存，按钮显示没变时不重设
+        self.set_button(row, col)
+
+def benchmark_render(plies=80, seed=1):
+    """两种渲染方式复盘同一串随机走法，比较每步刷新和整体重排的用时"""
+    app = QApplication.instance() or QApplication(sys.argv)
+    rng = random.Random(seed)
+    position = xiangqi_position.Position.initial()
+    moves = []
+    for _ in range(plies):
+        legal = position.generate_legal_moves()
+        if not legal:
+            break
+        move = rng.choice(legal)
+        position.do_move(move)
+        moves.append(move)
+
+    for renderer in ('buttons', 'painter'):
+        window = ChessBoard(renderer)
+        window.show()
+        app.processEvents()
+        frames = []
+        for move in moves:
+            (prev_row, prev_col), (row, col) = xiangqi_engine.move_to_coords(move)
+            start = time.perf_counter()
+            captured = window.board[row][col]
+            window.board[row][col] = window.board[prev_row][prev_col]
+            window.board[prev_row][prev_col] = ''
+            window.move_history.append(((prev_row, prev_col), (row, col), captured))
+            window.update_board()
+            app.processEvents()  # 处理积压的重绘，计入这一步
+            frames.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        for _ in range(20):
+            window.update_layout()
+            window.board_view.background = None
+            window.board_container.repaint()
+        relayout = (time.perf_counter() - start) / 20
+        frames.sort()
+        paint = window.board_view.frame_times
+        print(f'{renderer:8s} 每步 平均 {sum(frames) / len(frames) * 1000:6.2f} 毫秒  '
+              f'p95 {frames[int(len(frames) * 0.95)] * 1000:6.2f} 毫秒  '
+              f'重排 {relayout * 1000:6.2f} 毫秒  '
+              f'棋盘 paintEvent 平均 {sum(paint) / max(1, len(paint)) * 1000:.2f} 毫秒')
+        window.timer.stop()
+        window.close()
+
+
+def benchmark_clicks(plies=40, seed=1):
+    """按一盘随机对局模拟点击（选子、取消、再选、走子），统计每次点击的处理用时"""
+    app = QApplication.instance() or QApplication(sys.argv)
+    rng = random.Random(seed)
+    position = xiangqi_position.Position.initial()
+    history = xiangqi_repetition.PositionHistory(position.key, position.side)
+    moves = []
+    for _ in range(plies):
+        legal = position.generate_legal_moves()
+        if not legal:
+            break
+        move = rng.choice(legal)
+        check, chase = xiangqi_repetition.move_flags(position, move)
+        position.do_move(move)
+        history.push(position.key, check, chase)
+        # 不走到终局，避免弹出结束对话框
+        if (xiangqi_rules.game_status(position.to_board(), position.side == xiangqi_position.RED)[0]
+                or history.status()[0]):
+            break
+        moves.append(move)
+
+    for renderer in ('buttons', 'painter'):
+        window = ChessBoard(renderer)
+        window.show()
+        app.processEvents()
+        latencies = {'select': [], 'move': []}
+        for move in moves:
+            (prev_row, prev_col), (row, col) = xiangqi_engine.move_to_coords(move)
+            for kind, square in (('select', (prev_row, prev_col)), ('select', (prev_row, prev_col)),
+                                 ('select', (prev_row, prev_col)), ('move', (row, col))):
+                window.on_click(*square)
+                latencies[kind].append(window.click_latencies[-1])
+                app.processEvents()
+        for kind, values in latencies.items():
+            values.sort()
+            print(f'{renderer:8s} {kind:6s} 点击处理 平均 {sum(values) / len(values) * 1000:6.3f} 毫秒  '
+                  f'p95 {values[int(len(values) * 0.95)] * 1000:6.3f} 毫秒  '
+                  f'最慢 {values[-1] * 1000:6.3f} 毫秒')
+        cache = window.move_cache
+        print(f'{renderer:8s} 走法缓存 命中 {cache.hits} 次，未命中 {cache.misses} 次，'
+              f'命中率 {cache.hit_rate():.0%}')
+        window.timer.stop()
+        window.close()
+
 
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    window = ChessBoard()
+    parser = argparse.ArgumentParser(description='中国象棋')
+    parser.add_argument('--buttons', action='store_true', help='用按钮显示棋子（旧的显示方式）')
+    parser.add_argument('--bench-render', action='store_true',
+                        help='比较按钮和直接绘制两种显示方式的刷新用时')
+    parser.add_argument('--bench-clicks', action='store_true', help='统计每次点击的处理用时')
+    parser.add_argument('--server', default=None,
+                        help='连接 xiangqi_server 联机对战，格式为 主机:端口')
+    args, qt_args = parser.parse_known_args()
+    if args.bench_render:
+        benchmark_render()
+        sys.exit(0)
+    if args.bench_clicks:
+        benchmark_clicks()
+        sys.exit(0)
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = ChessBoard('buttons' if args.buttons else 'painter', args.server)
     window.show()
     sys.exit(app.exec_()) 
\ No newline at end of file
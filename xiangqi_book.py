@@ -0,0 +1,219 @@
+"""开局库
+
+库文件是按 (局面键, 走法) 排好序的定长记录：8 字节 Zobrist 键、2 字节走法、
+2 字节权重，前面是 8 字节的文件头。查询时用 mmap 映射文件，直接在映射上二分，
+不把整个库读进内存，一次查询只碰到 log2(记录数) 条记录。
+
+    python xiangqi_book.py build 棋谱目录 -o xiangqi_book.bin --plies 20
+    python xiangqi_book.py probe --fen "..."      # 列出某个局面的库内走法
+    python xiangqi_book.py bench                  # 查询速度
+
+权重按对局结果累计：走棋方赢了加 2，和棋或结果不明加 1，输了不加。
+"""
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+
+from xiangqi_notation import load_games, move_to_iccs
+from xiangqi_position import Position, START_FEN, RED
+
+MAGIC = b'XQBOOK01'
+RECORD = struct.Struct('<QHH')
+RECORD_SIZE = RECORD.size
+HEADER_SIZE = len(MAGIC)
+MAX_WEIGHT = 0xFFFF
+
+DEFAULT_BOOK = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'xiangqi_book.bin')
+GAME_EXTENSIONS = ('.pgn', '.txt')
+
+# 结果对走棋方的得分：(红方走时, 黑方走时)
+_RESULT_WEIGHTS = {'1-0': (2, 0), '0-1': (0, 2), '1/2-1/2': (1, 1)}
+
+
+class OpeningBook:
+    """只读开局库，用 mmap 在文件上直接二分查找"""
+
+    def __init__(self, path=DEFAULT_BOOK):
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size < HEADER_SIZE or (size - HEADER_SIZE) % RECORD_SIZE:
+            self._file.close()
+            raise ValueError('不是开局库文件: %s' % path)
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError:
+            self._file.close()
+            raise
+        if self._mmap[:HEADER_SIZE] != MAGIC:
+            self.close()
+            raise ValueError('不是开局库文件: %s' % path)
+        self.count = (size - HEADER_SIZE) // RECORD_SIZE
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _key_at(self, index):
+        return RECORD.unpack_from(self._mmap, HEADER_SIZE + index * RECORD_SIZE)[0]
+
+    def probe(self, key):
+        """返回 [(走法, 权重)]，局面不在库中时返回空列表"""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        entries = []
+        offset = HEADER_SIZE + lo * RECORD_SIZE
+        end = HEADER_SIZE + self.count * RECORD_SIZE
+        while offset < end:
+            record_key, move, weight = RECORD.unpack_from(self._mmap, offset)
+            if record_key != key:
+                break
+            entries.append((move, weight))
+            offset += RECORD_SIZE
+        return entries
+
+    def choose(self, pos, rng=random):
+        """按权重随机选一步库内走法，没有时返回 0
+
+        键可能碰撞，返回前检查走法在 pos 中合法。
+        """
+        entries = [(move, weight) for move, weight in self.probe(pos.key)
+                   if weight and move in pos.generate_legal_moves()]
+        if not entries:
+            return 0
+        pick = rng.randrange(sum(weight for _, weight in entries))
+        for move, weight in entries:
+            pick -= weight
+            if pick < 0:
+                return move
+        return entries[-1][0]
+
+
+def open_book(path=DEFAULT_BOOK):
+    """库文件不存在、读不了或者格式不对（比如空文件、生成到一半）时返回 None，
+    调用方当作没有开局库"""
+    try:
+        return OpeningBook(path)
+    except (OSError, ValueError):
+        return None
+
+
+def game_files(paths):
+    """展开目录，依次给出其中的棋谱文件"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    if name.lower().endswith(GAME_EXTENSIONS):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def collect(paths, plies=20):
+    """统计棋谱中前 plies 步的 (局面键, 走法) 权重，返回 (字典, 对局数)"""
+    weights = {}
+    games = 0
+    for path in game_files(paths):
+        for game in load_games(path):
+            games += 1
+            red_weight, black_weight = _RESULT_WEIGHTS.get(
+                game['tags'].get('Result'), (1, 1))
+            pos = Position.from_fen(game['fen'])
+            for move in game['moves'][:plies]:
+                weight = red_weight if pos.side == RED else black_weight
+                entry = (pos.key, move)
+                weights[entry] = weights.get(entry, 0) + weight
+                pos.do_move(move)
+    return weights, games
+
+
+def write_book(weights, path, min_weight=1):
+    """按键排序写出库文件，返回写入的记录数"""
+    records = sorted(entry for entry, weight in weights.items() if weight >= min_weight)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        buffer = bytearray(RECORD_SIZE * len(records))
+        for index, (key, move) in enumerate(records):
+            RECORD.pack_into(buffer, index * RECORD_SIZE, key, move,
+                             min(weights[key, move], MAX_WEIGHT))
+        f.write(buffer)
+    os.replace(tmp_path, path)
+    return len(records)
+
+
+def build(paths, output=DEFAULT_BOOK, plies=20, min_weight=1):
+    start = time.perf_counter()
+    weights, games = collect(paths, plies)
+    count = write_book(weights, output, min_weight)
+    print(f'{games} 盘棋谱，写入 {count} 条记录到 {output}，'
+          f'{os.path.getsize(output) / 1024:.1f} KB，{time.perf_counter() - start:.2f} 秒')
+
+
+def benchmark(path=DEFAULT_BOOK, rounds=100000):
+    """随机查询库内和库外的局面键，打印每次查询的平均用时"""
+    with OpeningBook(path) as book:
+        rng = random.Random(1)
+        keys = [book._key_at(rng.randrange(book.count)) for _ in range(rounds // 2)]
+        keys += [rng.getrandbits(64) for _ in range(rounds - len(keys))]
+        start = time.perf_counter()
+        for key in keys:
+            book.probe(key)
+        elapsed = time.perf_counter() - start
+        print(f'{book.count} 条记录，{rounds} 次查询，'
+              f'平均 {elapsed / rounds * 1e6:.2f} 微秒/次')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='象棋开局库')
+    sub = parser.add_subparsers(dest='command', required=True)
+    build_parser = sub.add_parser('build', help='从棋谱文件或目录生成开局库')
+    build_parser.add_argument('paths', nargs='+')
+    build_parser.add_argument('-o', '--output', default=DEFAULT_BOOK)
+    build_parser.add_argument('--plies', type=int, default=20, help='每盘棋收录的步数')
+    build_parser.add_argument('--min-weight', type=int, default=1,
+                              help='权重低于该值的走法不收录')
+    probe_parser = sub.add_parser('probe', help='列出局面的库内走法')
+    probe_parser.add_argument('--fen', default=START_FEN)
+    probe_parser.add_argument('--book', default=DEFAULT_BOOK)
+    bench_parser = sub.add_parser('bench', help='查询速度测试')
+    bench_parser.add_argument('--book', default=DEFAULT_BOOK)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        build(args.paths, args.output, args.plies, args.min_weight)
+    elif args.command == 'probe':
+        with OpeningBook(args.book) as book:
+            entries = book.probe(Position.from_fen(args.fen).key)
+            for move, weight in sorted(entries, key=lambda entry: -entry[1]):
+                print(f'{move_to_iccs(move)}: {weight}')
+            if not entries:
+                print('不在库中')
+    else:
+        benchmark(args.book)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
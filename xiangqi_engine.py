@@ -0,0 +1,327 @@
+"""象棋搜索引擎
+
+负极大值 Alpha-Beta 搜索 + 迭代加深，带静态搜索（只搜吃子）、置换表和
+走法排序（置换表走法、吃子按 MVV-LVA、杀手走法、历史表）。搜索在
+xiangqi_position.Position 上进行，不依赖 PyQt5，可以在线程或子进程里运行。
+"""
+import time
+
+from xiangqi_eval import evaluate
+from xiangqi_tt import TranspositionTable, EXACT, LOWER, UPPER
+from xiangqi_position import (Position, CHARIOT, HORSE, ELEPHANT, ADVISOR,
+                              GENERAL, CANNON, PAWN)
+
+MATE = 30000
+MATE_BOUND = MATE - 1000  # 超过这个分数的都是杀棋
+MAX_PLY = 64
+
+# 按兵种编码索引的子力价值，用于吃子排序（估值用 xiangqi_eval 的表）
+PIECE_VALUES = [0] * 8
+PIECE_VALUES[CHARIOT] = 900
+PIECE_VALUES[HORSE] = 400
+PIECE_VALUES[ELEPHANT] = 200
+PIECE_VALUES[ADVISOR] = 200
+PIECE_VALUES[GENERAL] = 5000
+PIECE_VALUES[CANNON] = 450
+PIECE_VALUES[PAWN] = 100
+
+# MVV-LVA：先吃价值高的子，同样的目标先用便宜的子去吃
+MVV_LVA = [[0] * 8 for _ in range(8)]
+for _victim in range(1, 8):
+    for _attacker in range(1, 8):
+        MVV_LVA[_victim][_attacker] = (PIECE_VALUES[_victim] * 16
+                                       - PIECE_VALUES[_attacker] // 16)
+
+HASH_MOVE_SCORE = 1 << 30
+CAPTURE_SCORE = 1 << 24
+KILLER_SCORES = (1 << 23, (1 << 23) - 1)
+
+
+class SearchStopped(Exception):
+    """时间用完或收到停止请求"""
+
+
+def score_to_tt(score, ply):
+    """杀棋分数存进置换表时改为相对当前节点的步数"""
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def score_from_tt(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+
+class Engine:
+    def __init__(self, hash_mb=16, tt=None, tablebase=None):
+        """hash_mb 为置换表大小（兆字节），为 0 时不用置换表；也可以直接传入 tt
+
+        tablebase 为 xiangqi_tablebase.Tablebase，子力在库中的局面直接取精确结果。
+        """
+        if tt is None and hash_mb:
+            tt = TranspositionTable(hash_mb)
+        self.tt = tt
+        self.tablebase = tablebase
+        self.stop_event = None  # 多进程搜索时由主进程设置的 multiprocessing.Event
+        self.nodes = 0
+        self.stopped = False
+        # stop() 的请求单独记录，search 开始时不清除，由启动搜索的一方调用
+        # clear_stop()，这样在线程启动和进入 search 之间到达的 stop 不会丢失
+        self.stop_requested = False
+        self.deadline = None
+        self.node_limit = None
+        self.excluded = frozenset()  # 根节点不许走的走法（UCCI 的 banmoves）
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.history = {}
+        self.pv_table = [[] for _ in range(MAX_PLY + 2)]
+        self.path_keys = set()  # 对局历史和当前搜索路径上的局面键
+
+    def stop(self):
+        """请求停止搜索，可以从其他线程调用"""
+        self.stop_requested = True
+        self.stopped = True
+
+    def clear_stop(self):
+        """在启动新的搜索（线程）之前调用，撤销之前的 stop 请求"""
+        self.stop_requested = False
+
+    def search(self, pos, max_depth=MAX_PLY, time_limit=None, info_callback=None,
+               min_depth=1, history=(), node_limit=None, excluded=()):
+        """迭代加深搜索，返回结果字典
+
+        history 为对局中已经出现过的局面键，搜索中走回这些局面按和棋计分；
+        excluded 为根节点不许走的走法，全部被排除时与无子可走一样返回走法 0；
+        time_limit 为秒数，node_limit 为节点数上限；min_depth 为迭代加深的起始深度（并行搜索的辅助进程
+        从不同深度开始，错开搜索顺序）；每完成一层调用一次 info_callback(info)，
+        info 与返回值的字段相同：move、score、depth、nodes、nps、time、pv、
+        tt_hit_rate。
+        """
+        start = time.perf_counter()
+        if self.tt is not None:
+            self.tt.new_search()
+            self.tt.reset_stats()
+        self.nodes = 0
+        self.stopped = False
+        self.deadline = start + time_limit if time_limit else None
+        self.node_limit = node_limit
+        self.excluded = frozenset(excluded)
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.history = {}
+
+        result = {'move': 0, 'score': 0, 'depth': 0, 'nodes': 0, 'nps': 0,
+                  'time': 0.0, 'pv': [], 'tt_hit_rate': 0.0}
+        root_moves = [m for m in pos.generate_moves()
+                      if m not in self.excluded and pos.is_legal(m)]
+        if not root_moves:
+            result['score'] = -MATE
+            return result
+        result['move'] = root_moves[0]
+
+        for depth in range(min(min_depth, max_depth), max_depth + 1):
+            self.path_keys = set(history)
+            try:
+                # 每层在副本上搜索，被中断时不用逐层撤销走法
+                score = self._search_root(pos.copy(), depth, result['move'])
+            except SearchStopped:
+                break
+            elapsed = time.perf_counter() - start
+            pv = list(self.pv_table[0])
+            result.update(move=pv[0] if pv else result['move'], score=score,
+                          depth=depth, pv=pv)
+            self._fill_stats(result, elapsed)
+            if info_callback:
+                info_callback(dict(result))
+            if abs(score) >= MATE_BOUND:
+                break
+            # 剩余时间不够再搜一层时提前结束
+            if self.deadline and time.perf_counter() > start + (self.deadline - start) * 0.5:
+                break
+
+        self._fill_stats(result, time.perf_counter() - start)
+        return result
+
+    def _fill_stats(self, result, elapsed):
+        result['nodes'] = self.nodes
+        result['time'] = elapsed
+        result['nps'] = int(self.nodes / elapsed) if elapsed > 0 else 0
+        if self.tt is not None:
+            result['tt_hit_rate'] = self.tt.hit_rate()
+
+    def _check_time(self):
+        if (self.stopped or self.stop_requested
+                or (self.deadline and time.perf_counter() >= self.deadline)
+                or (self.node_limit and self.nodes >= self.node_limit)
+                or (self.stop_event is not None and self.stop_event.is_set())):
+            self.stopped = True
+            raise SearchStopped()
+
+    def _search_root(self, pos, depth, best_move):
+        return self._negamax(pos, depth, -MATE, MATE, 0, best_move)
+
+    def _order_moves(self, pos, moves, ply, hash_move):
+        squares = pos.squares
+        killers = self.killers[ply]
+        history = self.history
+        scored = []
+        for move in moves:
+            if move == hash_move:
+                score = HASH_MOVE_SCORE
+            else:
+                victim = squares[move & 127]
+                if victim:
+                    score = CAPTURE_SCORE + MVV_LVA[victim & 7][squares[move >> 7] & 7]
+                elif move == killers[0]:
+                    score = KILLER_SCORES[0]
+                elif move == killers[1]:
+                    score = KILLER_SCORES[1]
+                else:
+                    score = history.get(move, 0)
+            scored.append((score, move))
+        scored.sort(reverse=True)
+        return [move for _, move in scored]
+
+    def _negamax(self, pos, depth, alpha, beta, ply, hash_move=0):
+        self.nodes += 1
+        if self.nodes & 255 == 0:
+            self._check_time()
+        self.pv_table[ply] = []
+
+        # 走回对局或搜索路径上出现过的局面按和棋计
+        key = pos.key
+        if ply > 0 and key in self.path_keys:
+            return 0
+
+        if self.tablebase is not None and ply > 0:
+            entry = self.tablebase.probe(pos)
+            if entry is not None:
+                wdl, dtm = entry
+                if wdl > 0:
+                    return MATE - ply - dtm
+                if wdl < 0:
+                    return -MATE + ply + dtm
+                return 0
+
+        in_check = pos.in_check()
+        if in_check and ply < MAX_PLY:
+            depth += 1  # 被将军时延伸一层
+        if depth <= 0 or ply >= MAX_PLY:
+            return self._quiesce(pos, alpha, beta, ply)
+
+        tt = self.tt
+        if tt is not None:
+            entry = tt.probe(key)
+            if entry is not None:
+                tt_move, tt_score, tt_depth, flag = entry
+                if not hash_move:
+                    hash_move = tt_move
+                # 根节点总要完整搜索，保证拿到走法和主要变例
+                if ply > 0 and tt_depth >= depth:
+                    tt_score = score_from_tt(tt_score, ply)
+                    if (flag == EXACT or (flag == LOWER and tt_score >= beta)
+                            or (flag == UPPER and tt_score <= alpha)):
+                        return tt_score
+
+        original_alpha = alpha
+        best = -MATE
+        best_move = 0
+        legal = 0
+        self.path_keys.add(key)
+        for move in self._order_moves(pos, pos.generate_moves(), ply, hash_move):
+            if not pos.is_legal(move, in_check):
+                continue
+            if ply == 0 and move in self.excluded:
+                continue
+            legal += 1
+            captured = pos.do_move(move)
+            score = -self._negamax(pos, depth - 1, -beta, -alpha, ply + 1)
+            pos.undo_move(move, captured)
+            if score > best:
+                best = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    self.pv_table[ply] = [move] + self.pv_table[ply + 1]
+                    if score >= beta:
+                        if not captured:
+                            self._update_quiet_stats(move, depth, ply)
+                        break
+        self.path_keys.discard(key)
+        if not legal:
+            # 将死和困毙都判负，越快被杀分数越低
+            return -MATE + ply
+        # 排除了部分根节点走法时的结果不是这个局面的真实分数，不写入置换表
+        if tt is not None and not (ply == 0 and self.excluded):
+            if best >= beta:
+                flag = LOWER
+            elif best > original_alpha:
+                flag = EXACT
+            else:
+                flag = UPPER
+                best_move = 0
+            tt.store(key, depth, flag, score_to_tt(best, ply), best_move)
+        return best
+
+    def _update_quiet_stats(self, move, depth, ply):
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        self.history[move] = min(self.history.get(move, 0) + depth * depth, KILLER_SCORES[1] - 1)
+
+    def _quiesce(self, pos, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & 255 == 0:
+            self._check_time()
+        self.pv_table[ply] = []
+
+        stand_pat = evaluate(pos)
+        if stand_pat >= beta or ply >= MAX_PLY:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        squares = pos.squares
+        captures = [(MVV_LVA[squares[m & 127] & 7][squares[m >> 7] & 7], m)
+                    for m in pos.generate_moves() if squares[m & 127]]
+        captures.sort(reverse=True)
+        in_check = pos.in_check()
+        for _, move in captures:
+            if not pos.is_legal(move, in_check):
+                continue
+            captured = pos.do_move(move)
+            score = -self._quiesce(pos, -beta, -alpha, ply + 1)
+            pos.undo_move(move, captured)
+            if score > alpha:
+                alpha = score
+                self.pv_table[ply] = [move] + self.pv_table[ply + 1]
+                if score >= beta:
+                    break
+        return alpha
+
+
+def move_to_coords(move):
+    """把走法编码转换为 ((起行, 起列), (终行, 终列))"""
+    from_sq = move >> 7
+    to_sq = move & 127
+    return (from_sq // 9, from_sq % 9), (to_sq // 9, to_sq % 9)
+
+
+def benchmark(time_limit=5.0):
+    """从开局局面搜索一段时间，打印每层的深度、分数和节点速度"""
+    def show(info):
+        print(f"深度 {info['depth']:2d}  分数 {info['score']:6d}  节点 {info['nodes']:8d}  "
+              f"{info['nps']:7d} 节点/秒  置换表命中 {info['tt_hit_rate']:.1%}  "
+              f"{info['time']:.2f} 秒")
+
+    result = Engine().search(Position.initial(), time_limit=time_limit, info_callback=show)
+    print('最佳走法:', move_to_coords(result['move']))
+
+
+if __name__ == '__main__':
+    benchmark()
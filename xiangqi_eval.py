@@ -0,0 +1,270 @@
+"""局面估值：子力 + 位置分，中局和残局两套分数按局面阶段插值
+
+每种棋子有中局、残局两个子力分和两张 10x9 的位置分表（按红方视角，第 0 行是
+黑方底线），黑方棋子用上下翻转的表。导入时把表展开写进
+xiangqi_position.EVAL，Position 在走子和悔棋时增量维护分数之和，估值时
+不用扫描棋盘：
+
+    阶段 = min(剩余车马炮的阶段权重之和, MAX_PHASE)
+    分数 = (中局分 * 阶段 + 残局分 * (MAX_PHASE - 阶段)) / MAX_PHASE
+
+表可以保存成 JSON 离线调整：程序旁边有 xiangqi_eval.json 时导入时自动读取，
+也可以调用 load_tables 换表（之后新建的 Position 才会用新表）。
+
+    python xiangqi_eval.py                 # 每秒估值次数
+    python xiangqi_eval.py --dump out.json # 导出当前的表
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+import xiangqi_position
+from xiangqi_position import Position, FEN_TO_CODE, BLACK, RED
+
+DEFAULT_TABLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   'xiangqi_eval.json')
+PIECE_LETTERS = 'RNBAKCP'
+
+# 中局分和残局分压在一个整数里：中局分 << 20 加上残局分，加减法可以直接合并
+SCORE_SHIFT = 20
+_EG_OFFSET = 1 << (SCORE_SHIFT - 1)
+_EG_MASK = (1 << SCORE_SHIFT) - 1
+
+
+def pack_score(mg, eg):
+    return (mg << SCORE_SHIFT) + eg
+
+
+def unpack_score(score):
+    """返回 (中局分, 残局分)"""
+    eg = ((score + _EG_OFFSET) & _EG_MASK) - _EG_OFFSET
+    return (score - eg) >> SCORE_SHIFT, eg
+
+
+def _zero_table():
+    return [[0] * 9 for _ in range(10)]
+
+
+def _table(rows):
+    return [list(row) for row in rows]
+
+
+_CHARIOT = _table([
+    [14, 14, 12, 18, 16, 18, 12, 14, 14],
+    [16, 20, 18, 24, 26, 24, 18, 20, 16],
+    [12, 12, 12, 18, 18, 18, 12, 12, 12],
+    [12, 18, 16, 22, 22, 22, 16, 18, 12],
+    [12, 14, 12, 18, 18, 18, 12, 14, 12],
+    [12, 16, 14, 20, 20, 20, 14, 16, 12],
+    [6, 10, 8, 14, 14, 14, 8, 10, 6],
+    [4, 8, 6, 14, 12, 14, 6, 8, 4],
+    [8, 4, 8, 16, 8, 16, 8, 4, 8],
+    [-2, 10, 6, 14, 12, 14, 6, 10, -2],
+])
+_HORSE = _table([
+    [4, 8, 16, 12, 4, 12, 16, 8, 4],
+    [4, 10, 28, 16, 8, 16, 28, 10, 4],
+    [12, 14, 16, 20, 18, 20, 16, 14, 12],
+    [8, 24, 18, 24, 20, 24, 18, 24, 8],
+    [6, 16, 14, 18, 16, 18, 14, 16, 6],
+    [4, 12, 16, 14, 12, 14, 16, 12, 4],
+    [2, 6, 8, 6, 10, 6, 8, 6, 2],
+    [4, 2, 8, 8, 4, 8, 8, 2, 4],
+    [0, 2, 4, 4, -2, 4, 4, 2, 0],
+    [0, -4, 0, 0, 0, 0, 0, -4, 0],
+])
+_CANNON = _table([
+    [6, 4, 0, -10, -12, -10, 0, 4, 6],
+    [2, 2, 0, -4, -14, -4, 0, 2, 2],
+    [2, 2, 0, -10, -8, -10, 0, 2, 2],
+    [0, 0, -2, 4, 10, 4, -2, 0, 0],
+    [0, 0, 0, 2, 8, 2, 0, 0, 0],
+    [-2, 0, 4, 2, 6, 2, 4, 0, -2],
+    [0, 0, 0, 2, 4, 2, 0, 0, 0],
+    [4, 0, 8, 6, 10, 6, 8, 0, 4],
+    [0, 2, 4, 6, 6, 6, 4, 2, 0],
+    [0, 0, 2, 6, 6, 6, 2, 0, 0],
+])
+_PAWN_MG = _table([
+    [0, 3, 6, 9, 12, 9, 6, 3, 0],
+    [18, 36, 56, 80, 120, 80, 56, 36, 18],
+    [14, 26, 42, 60, 80, 60, 42, 26, 14],
+    [10, 20, 30, 34, 40, 34, 30, 20, 10],
+    [6, 12, 18, 18, 20, 18, 18, 12, 6],
+    [2, 0, 8, 0, 8, 0, 8, 0, 2],
+    [0, 0, -2, 0, 4, 0, -2, 0, 0],
+    [0, 0, 0, 0, 0, 0, 0, 0, 0],
+    [0, 0, 0, 0, 0, 0, 0, 0, 0],
+    [0, 0, 0, 0, 0, 0, 0, 0, 0],
+])
+# 残局的兵越接近九宫越好，但沉底的老兵作用不大
+_PAWN_EG = _table([
+    [10, 10, 10, 15, 15, 15, 10, 10, 10],
+    [50, 55, 60, 85, 100, 85, 60, 55, 50],
+    [65, 70, 70, 75, 75, 75, 70, 70, 65],
+    [75, 80, 80, 80, 80, 80, 80, 80, 75],
+    [70, 70, 65, 70, 70, 70, 65, 70, 70],
+    [45, 0, 40, 0, 45, 0, 40, 0, 45],
+    [40, 0, 35, 0, 40, 0, 35, 0, 40],
+    [0, 0, 0, 0, 0, 0, 0, 0, 0],
+    [0, 0, 0, 0, 0, 0, 0, 0, 0],
+    [0, 0, 0, 0, 0, 0, 0, 0, 0],
+])
+_ADVISOR = _zero_table()
+_ADVISOR[8][4] = 3
+_ELEPHANT = _zero_table()
+_ELEPHANT[7][4] = 3
+_ELEPHANT[7][0] = _ELEPHANT[7][8] = _ELEPHANT[5][2] = _ELEPHANT[5][6] = -2
+_GENERAL_MG = _zero_table()
+_GENERAL_MG[9][3] = _GENERAL_MG[9][5] = -2
+_GENERAL_MG[8][3] = _GENERAL_MG[8][5] = -10
+_GENERAL_MG[8][4] = -8
+_GENERAL_MG[7][3] = _GENERAL_MG[7][5] = -20
+_GENERAL_MG[7][4] = -18
+# 残局帅可以出来助攻，居中更好
+_GENERAL_EG = _zero_table()
+_GENERAL_EG[9][3] = _GENERAL_EG[9][5] = -4
+_GENERAL_EG[8][4] = 6
+_GENERAL_EG[8][3] = _GENERAL_EG[8][5] = 2
+_GENERAL_EG[7][4] = 4
+_GENERAL_EG[7][3] = _GENERAL_EG[7][5] = 0
+
+DEFAULT_TABLES = {
+    # 子力分：[中局, 残局]；帅将双方都有，不计子力
+    'material': {'R': [900, 1000], 'N': [400, 450], 'B': [200, 200], 'A': [200, 200],
+                 'K': [0, 0], 'C': [450, 400], 'P': [100, 100]},
+    # 阶段权重：车马炮都在时为中局，逐渐兑掉后向残局过渡
+    'phase': {'R': 6, 'N': 3, 'B': 0, 'A': 0, 'K': 0, 'C': 3, 'P': 0},
+    'mg': {'R': _CHARIOT, 'N': _HORSE, 'B': _ELEPHANT, 'A': _ADVISOR,
+           'K': _GENERAL_MG, 'C': _CANNON, 'P': _PAWN_MG},
+    'eg': {'R': _table(_CHARIOT), 'N': _table(_HORSE), 'B': _table(_ELEPHANT),
+           'A': _table(_ADVISOR), 'K': _GENERAL_EG, 'C': _table(_CANNON), 'P': _PAWN_EG},
+}
+
+MAX_PHASE = 48
+tables = DEFAULT_TABLES
+
+
+def install(new_tables):
+    """把表展开写进 xiangqi_position.EVAL / EVAL_PHASE"""
+    global tables, MAX_PHASE
+    flat = [0] * (16 * 90)
+    phases = [0] * 16
+    for letter in PIECE_LETTERS:
+        red_code = FEN_TO_CODE[letter]
+        mg_material, eg_material = new_tables['material'][letter]
+        mg_table = new_tables['mg'][letter]
+        eg_table = new_tables['eg'][letter]
+        for row in range(10):
+            for col in range(9):
+                value = pack_score(mg_material + mg_table[row][col],
+                                   eg_material + eg_table[row][col])
+                flat[red_code * 90 + row * 9 + col] = value
+                flat[(red_code | BLACK) * 90 + (9 - row) * 9 + col] = -value
+        phases[red_code] = phases[red_code | BLACK] = new_tables['phase'][letter]
+    xiangqi_position.EVAL[:] = flat
+    xiangqi_position.EVAL_PHASE[:] = phases
+    tables = new_tables
+    MAX_PHASE = max(1, sum(phases[code] for code in Position.initial().squares if code))
+
+
+def load_tables(path=DEFAULT_TABLES_PATH):
+    with open(path, encoding='utf-8') as f:
+        install(json.load(f))
+
+
+def save_tables(path, table_data=None):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(table_data or tables, f, indent=1)
+
+
+def taper(score, phase):
+    """按阶段把打包的分数插值成一个分数（红方视角）"""
+    mg, eg = unpack_score(score)
+    if phase > MAX_PHASE:
+        phase = MAX_PHASE
+    return (mg * phase + eg * (MAX_PHASE - phase)) // MAX_PHASE
+
+
+def evaluate(pos):
+    """走棋方视角的估值，直接使用 Position 增量维护的分数"""
+    score = taper(pos.score, pos.phase)
+    return score if pos.side == RED else -score
+
+
+def evaluate_full(pos):
+    """扫描全部格子重新计算，用于核对增量结果和测速"""
+    eval_table = xiangqi_position.EVAL
+    eval_phase = xiangqi_position.EVAL_PHASE
+    score = 0
+    phase = 0
+    for sq, code in enumerate(pos.squares):
+        if code:
+            score += eval_table[code * 90 + sq]
+            phase += eval_phase[code]
+    score = taper(score, phase)
+    return score if pos.side == RED else -score
+
+
+if os.path.exists(DEFAULT_TABLES_PATH):
+    load_tables(DEFAULT_TABLES_PATH)
+else:
+    install(DEFAULT_TABLES)
+
+
+def benchmark(rounds=200000):
+    """比较增量估值、整盘扫描估值以及走子撤销的速度"""
+    rng = random.Random(1)
+    positions = []
+    pos = Position.initial()
+    for _ in range(40):
+        moves = pos.generate_legal_moves()
+        if not moves:
+            break
+        pos.do_move(rng.choice(moves))
+        positions.append(pos.copy())
+    for pos in positions:
+        assert evaluate(pos) == evaluate_full(pos)
+
+    count = len(positions)
+    start = time.perf_counter()
+    for i in range(rounds):
+        evaluate(positions[i % count])
+    incremental = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(rounds // 10):
+        evaluate_full(positions[i % count])
+    full = time.perf_counter() - start
+
+    pos = positions[count // 2]
+    moves = pos.generate_legal_moves()
+    start = time.perf_counter()
+    for i in range(rounds):
+        move = moves[i % len(moves)]
+        captured = pos.do_move(move)
+        pos.undo_move(move, captured)
+    make_unmake = time.perf_counter() - start
+
+    print(f'增量估值: {rounds / incremental:10.0f} 次/秒')
+    print(f'扫描估值: {rounds // 10 / full:10.0f} 次/秒')
+    print(f'走子+撤销: {rounds / make_unmake:10.0f} 次/秒')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='估值表与估值速度测试')
+    parser.add_argument('--tables', default=None, help='读取 JSON 格式的估值表')
+    parser.add_argument('--dump', default=None, help='把当前估值表导出为 JSON')
+    args = parser.parse_args(argv)
+    if args.tables:
+        load_tables(args.tables)
+    if args.dump:
+        save_tables(args.dump)
+        return
+    benchmark()
+
+
+if __name__ == '__main__':
+    main()
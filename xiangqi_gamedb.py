@@ -0,0 +1,422 @@
+"""棋谱数据库：按局面检索对局
+
+把大量棋谱逐盘复盘，记下每个局面的 Zobrist 键、对局编号、第几步和这一步
+实际走的着法，按键排序写成定长记录。查询时和开局库一样用 mmap 在文件上
+二分，查 "哪些对局走到过这个局面"、"这个局面下大家都怎么走" 只读相关的
+那一段记录，与库的大小基本无关。开局局面这样的热门局面有上百万条记录，它们
+的着法统计在生成时就汇总好，查询只读几条汇总。
+
+    python xiangqi_gamedb.py build 棋谱目录 -o games.xqdb
+    python xiangqi_gamedb.py query games.xqdb --moves h2e2 h9g7   # 从开局走几步后的局面
+    python xiangqi_gamedb.py query games.xqdb --fen "..."
+    python xiangqi_gamedb.py bench games.xqdb
+
+文件格式：文件头（标识、记录数、汇总数、对局数、文件名表长度），随后是按
+(局面键, 对局, 步数) 排序的记录 <QIHH>（键、对局编号、步数、这一步的走法，
+最后一个局面为 0），记录不少于 AGGREGATE_MIN 条的局面按 (局面键, 走法)
+排序的汇总 <QHIIII>（键、走法、次数、红胜、和、黑胜），再是每盘一条的对局表 <II>（棋谱文件序号、文件中的第几盘）
+和每盘一个字节的结果，最后是 JSON 格式的棋谱文件名列表。
+
+生成时记录先攒在内存里，每满 chunk_records 条排序后写成一个临时段，最后
+多路归并，归并时顺带汇总热门局面的着法，内存占用与棋谱总量无关。复盘用 Position
+走子，默认逐步检查走法合法性（与界面相同的规则），有不合法走法的棋谱整盘
+跳过；确定棋谱可靠时可以用 --no-validate 跳过检查以加快生成。
+"""
+import argparse
+import heapq
+from collections import Counter
+import json
+import mmap
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+from xiangqi_book import game_files
+from xiangqi_notation import (load_games, parse_game, split_games, move_to_iccs,
+                              iccs_to_move, move_to_wxf)
+from xiangqi_position import Position, START_FEN, RED
+
+MAGIC = b'XQGDB003'
+HEADER = struct.Struct('<8sQQQQ')
+KEY = struct.Struct('<Q')
+RECORD = struct.Struct('<QIHH')
+RECORD_SIZE = RECORD.size
+REPLY = struct.Struct('<QHIIII')
+REPLY_SIZE = REPLY.size
+GAME = struct.Struct('<II')
+GAME_SIZE = GAME.size
+MAX_PLY = 0xFFFF
+# 记录数不少于这么多的局面在生成时汇总着法；更少的查询时直接数记录更省空间，
+# 大部分局面只出现一次，全部汇总会让文件大一倍多
+AGGREGATE_MIN = 64
+
+# 结果按红方记：1 红胜，0 和，-1 黑胜，UNKNOWN_RESULT 为没有结果
+UNKNOWN_RESULT = -2
+_RESULTS = {'1-0': 1, '0-1': -1, '1/2-1/2': 0}
+_RESULT_TEXT = {1: '1-0', -1: '0-1', 0: '1/2-1/2', UNKNOWN_RESULT: '*'}
+
+
+class GameDatabase:
+    """只读的棋谱数据库"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < HEADER.size or self._mmap[:len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            self._file.close()
+            raise ValueError('不是棋谱数据库文件: %s' % path)
+        (_, self.record_count, self.reply_count, self.game_count,
+         names_size) = HEADER.unpack_from(self._mmap)
+        self._replies_offset = HEADER.size + self.record_count * RECORD_SIZE
+        self._games_offset = self._replies_offset + self.reply_count * REPLY_SIZE
+        results_offset = self._games_offset + self.game_count * GAME_SIZE
+        names_offset = results_offset + self.game_count
+        self.results = memoryview(self._mmap)[results_offset:names_offset].cast('b')
+        self.files = json.loads(self._mmap[names_offset:names_offset + names_size])
+        self._loaded = {}
+
+    def close(self):
+        if self._mmap is not None:
+            self.results.release()
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _key_at(self, index, offset=HEADER.size, size=RECORD_SIZE):
+        return KEY.unpack_from(self._mmap, offset + index * size)[0]
+
+    def _range(self, key, offset=HEADER.size, size=RECORD_SIZE, count=None):
+        """key 在从 offset 开始、每条 size 字节的表里所在的下标区间 [lo, hi)
+
+        默认是记录表，汇总表传入它的位置、条目大小和条数。
+        """
+        if count is None:
+            count = self.record_count
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid, offset, size) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        first = lo
+        hi = count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid, offset, size) <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return first, lo
+
+    def _records(self, key):
+        # 在 memoryview 上解包，热门局面的上百万条记录也不用先复制一份
+        first, end = self._range(key)
+        return RECORD.iter_unpack(memoryview(self._mmap)[HEADER.size + first * RECORD_SIZE:
+                                                         HEADER.size + end * RECORD_SIZE])
+
+    def occurrences(self, key):
+        """依次给出 (对局编号, 步数, 下一步走法)，按对局编号排序"""
+        for _, game_id, ply, move in self._records(key):
+            yield game_id, ply, move
+
+    def count(self, key):
+        """局面出现的次数（同一盘棋里重复出现的也算）"""
+        first, end = self._range(key)
+        return end - first
+
+    def games(self, key, limit=None):
+        """走到过该局面的对局，返回 [(对局编号, 第一次走到时的步数)]"""
+        result = []
+        last = None
+        for game_id, ply, _ in self.occurrences(key):
+            if game_id != last:
+                result.append((game_id, ply))
+                last = game_id
+                if limit is not None and len(result) >= limit:
+                    break
+        return result
+
+    def replies(self, key, side=RED):
+        """该局面下实际走过的着法，返回 [(走法, 次数, 胜, 和, 负)]，按次数从多到少
+
+        胜和负按 side（该局面的走棋方）计，没有结果的对局只计次数。
+        """
+        first, end = self._range(key, self._replies_offset, REPLY_SIZE, self.reply_count)
+        if first < end:
+            stats = [entry[1:] for entry in REPLY.iter_unpack(
+                memoryview(self._mmap)[self._replies_offset + first * REPLY_SIZE:
+                                       self._replies_offset + end * REPLY_SIZE])]
+        else:
+            # 没有汇总的局面记录不多，直接数
+            counts = Counter((move, game_id)
+                             for _, game_id, _, move in self._records(key) if move)
+            stats = _reply_stats(counts, self.results)
+        replies = []
+        for move, count, red_wins, draws, black_wins in stats:
+            if side == RED:
+                replies.append((move, count, red_wins, draws, black_wins))
+            else:
+                replies.append((move, count, black_wins, draws, red_wins))
+        replies.sort(key=lambda item: -item[1])
+        return replies
+
+    def game_info(self, game_id):
+        """返回 (棋谱文件, 文件中的第几盘, 结果)"""
+        file_index, number = GAME.unpack_from(self._mmap,
+                                              self._games_offset + game_id * GAME_SIZE)
+        return self.files[file_index], number, self.results[game_id]
+
+    def load_game(self, game_id):
+        """重新读取棋谱文件，返回 parse_game 格式的对局"""
+        path, number, _ = self.game_info(game_id)
+        if path not in self._loaded:
+            self._loaded = {path: load_games(path)}
+        return self._loaded[path][number]
+
+
+def _write_run(records, directory):
+    """把排好序的打包记录写成临时段，返回文件名"""
+    records.sort()
+    buffer = bytearray(RECORD_SIZE * len(records))
+    for index, packed in enumerate(records):
+        RECORD.pack_into(buffer, index * RECORD_SIZE, packed >> 64, (packed >> 32) & 0xFFFFFFFF,
+                         (packed >> 16) & 0xFFFF, packed & 0xFFFF)
+    fd, path = tempfile.mkstemp(suffix='.run', dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(buffer)
+    return path
+
+
+def _read_run(path, block_records=65536):
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(block_records * RECORD_SIZE)
+            if not data:
+                break
+            yield from RECORD.iter_unpack(data)
+
+
+def build(paths, output, chunk_records=2000000, validate=True, verbose=True):
+    """复盘棋谱写出数据库，返回 (对局数, 记录数)"""
+    start = time.perf_counter()
+    files = []
+    games = bytearray()
+    results = bytearray()
+    game_count = 0
+    skipped = 0
+    records = []
+    runs = []
+    directory = os.path.dirname(os.path.abspath(output))
+    try:
+        for path in game_files(paths):
+            file_index = len(files)
+            files.append(path)
+            for number, game in enumerate(_parse_file(path, validate)):
+                if game is None or len(game['moves']) >= MAX_PLY:
+                    skipped += 1
+                    continue
+                game_id = game_count
+                game_count += 1
+                games += GAME.pack(file_index, number)
+                results.append(_RESULTS.get(game['tags'].get('Result'), UNKNOWN_RESULT) & 0xFF)
+                pos = Position.from_fen(game['fen'])
+                head = game_id << 32
+                ply = 0
+                for move in game['moves']:
+                    records.append((pos.key << 64) | head | (ply << 16) | move)
+                    pos.do_move(move)
+                    ply += 1
+                records.append((pos.key << 64) | head | (ply << 16))
+                if len(records) >= chunk_records:
+                    runs.append(_write_run(records, directory))
+                    records = []
+        if records or not runs:
+            runs.append(_write_run(records, directory))
+            records = []
+        record_count = _merge(runs, output, files, games, results)
+    finally:
+        for path in runs:
+            os.remove(path)
+    if verbose:
+        elapsed = time.perf_counter() - start
+        print(f'{game_count} 盘棋（跳过 {skipped} 盘），{record_count} 个局面，'
+              f'{os.path.getsize(output) / 1048576:.1f} MB，{elapsed:.2f} 秒，'
+              f'{game_count / elapsed:.0f} 盘/秒，{record_count / elapsed:.0f} 局面/秒')
+    return game_count, record_count
+
+
+def _parse_file(path, validate):
+    """逐盘解析，解析不了的棋谱给出 None，编号仍与 load_games 一致"""
+    with open(path, encoding='utf-8') as f:
+        texts = split_games(f.read())
+    for text in texts:
+        try:
+            yield parse_game(text, validate)
+        except ValueError:
+            yield None
+
+
+def _reply_stats(counts, results):
+    """把一个局面的 Counter((走法, 对局编号)) 汇总成按走法排序的
+    [(走法, 次数, 红胜, 和, 黑胜)]；results 为有符号的结果数组"""
+    stats = {}
+    for (move, game_id), count in counts.items():
+        entry = stats.get(move)
+        if entry is None:
+            entry = stats[move] = [0, 0, 0, 0]
+        entry[0] += count
+        result = results[game_id]
+        if result != UNKNOWN_RESULT:
+            entry[2 - result] += count
+    return [(move, *stats[move]) for move in sorted(stats)]
+
+
+def _merge(runs, output, files, games, results):
+    """多路归并各段写出最终文件，返回记录数
+
+    记录按局面键有序到达，热门局面的着法在这里汇总，先写到旁边的临时文件，
+    记录写完后再接在后面。
+    """
+    names = json.dumps(files, ensure_ascii=False).encode('utf-8')
+    signed_results = memoryview(results).cast('b')
+    tmp_path = output + '.tmp'
+    replies_path = output + '.replies'
+    record_count = 0
+    reply_count = 0
+    try:
+        with open(tmp_path, 'wb') as f, open(replies_path, 'w+b') as replies:
+            f.write(HEADER.pack(MAGIC, 0, 0, len(results), len(names)))
+            streams = [_read_run(path) for path in runs]
+            merged = streams[0] if len(streams) == 1 else heapq.merge(*streams)
+            buffer = bytearray()
+            reply_buffer = bytearray()
+            current = None
+            group = 0
+            counts = Counter()
+            for record in merged:
+                buffer += RECORD.pack(*record)
+                record_count += 1
+                key, game_id, _, move = record
+                if key != current:
+                    if group >= AGGREGATE_MIN:
+                        for stats in _reply_stats(counts, signed_results):
+                            reply_buffer += REPLY.pack(current, *stats)
+                    counts = Counter()
+                    current = key
+                    group = 0
+                group += 1
+                if move:
+                    counts[move, game_id] += 1
+                if len(buffer) >= 1 << 20:
+                    f.write(buffer)
+                    buffer = bytearray()
+                if len(reply_buffer) >= 1 << 20:
+                    replies.write(reply_buffer)
+                    reply_buffer = bytearray()
+            if group >= AGGREGATE_MIN:
+                for stats in _reply_stats(counts, signed_results):
+                    reply_buffer += REPLY.pack(current, *stats)
+            f.write(buffer)
+            replies.write(reply_buffer)
+            reply_count = replies.tell() // REPLY_SIZE
+            replies.seek(0)
+            shutil.copyfileobj(replies, f, 1 << 20)
+            f.write(games)
+            f.write(results)
+            f.write(names)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, record_count, reply_count, len(results), len(names)))
+    finally:
+        os.remove(replies_path)
+    os.replace(tmp_path, output)
+    return record_count
+
+
+def benchmark(path, rounds=2000):
+    """随机查询库内局面和不存在的局面，打印平均和最慢的查询时间"""
+    with GameDatabase(path) as db:
+        rng = random.Random(1)
+        keys = [db._key_at(rng.randrange(db.record_count)) for _ in range(rounds // 2)]
+        keys += [rng.getrandbits(64) for _ in range(rounds - len(keys))]
+        keys.append(Position.from_fen(START_FEN).key)
+        for name, query in (('count', db.count), ('games', db.games),
+                            ('replies', db.replies)):
+            times = []
+            for key in keys:
+                start = time.perf_counter()
+                query(key)
+                times.append(time.perf_counter() - start)
+            print(f'{name:8s} 平均 {sum(times) / len(times) * 1e6:9.1f} 微秒  '
+                  f'最慢 {max(times) * 1000:8.2f} 毫秒')
+        print(f'{db.game_count} 盘棋，{db.record_count} 个局面，'
+              f'开局局面出现 {db.count(keys[-1])} 次')
+
+
+def query(path, fen=START_FEN, moves=(), limit=10):
+    pos = Position.from_fen(fen)
+    for text in moves:
+        pos.do_move(iccs_to_move(text))
+    with GameDatabase(path) as db:
+        start = time.perf_counter()
+        games = db.games(pos.key)
+        replies = db.replies(pos.key, pos.side)
+        elapsed = time.perf_counter() - start
+        print(f'{len(games)} 盘棋走到过这个局面（查询 {elapsed * 1000:.1f} 毫秒）')
+        for move, count, wins, draws, losses in replies[:limit]:
+            decided = wins + draws + losses
+            rate = f'{(wins + draws / 2) / decided:.0%}' if decided else '-'
+            try:
+                wxf = move_to_wxf(pos, move)
+            except (ValueError, KeyError):
+                # 不检查合法性生成的库里可能有不合规则的走法
+                wxf = '?'
+            print(f'  {move_to_iccs(move)} {wxf}: {count} 次，'
+                  f'胜 {wins} 和 {draws} 负 {losses}，得分 {rate}')
+        for game_id, ply in games[:limit]:
+            file, number, result = db.game_info(game_id)
+            print(f'  #{game_id} {file} 第 {number + 1} 盘 第 {ply} 步 {_RESULT_TEXT[result]}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='棋谱数据库')
+    sub = parser.add_subparsers(dest='command', required=True)
+    build_parser = sub.add_parser('build', help='从棋谱文件或目录生成数据库')
+    build_parser.add_argument('paths', nargs='+')
+    build_parser.add_argument('-o', '--output', required=True)
+    build_parser.add_argument('--chunk', type=int, default=2000000,
+                              help='每个临时段的记录数，决定生成时的内存占用')
+    build_parser.add_argument('--no-validate', dest='validate', action='store_false',
+                              help='不检查走法合法性（更快，只用于可靠的棋谱）')
+    query_parser = sub.add_parser('query', help='查询局面')
+    query_parser.add_argument('database')
+    query_parser.add_argument('--fen', default=START_FEN)
+    query_parser.add_argument('--moves', nargs='*', default=(), help='从 FEN 开始的 ICCS 走法')
+    query_parser.add_argument('--limit', type=int, default=10)
+    bench_parser = sub.add_parser('bench', help='查询速度测试')
+    bench_parser.add_argument('database')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        build(args.paths, args.output, args.chunk, args.validate)
+    elif args.command == 'query':
+        query(args.database, args.fen, args.moves, args.limit)
+    else:
+        benchmark(args.database)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
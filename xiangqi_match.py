@@ -0,0 +1,261 @@
+"""引擎自对弈比赛
+
+两种引擎配置在多个进程里并行对下，每个开局各执红黑下一盘，最后给出
+Elo 差（95% 置信区间）、每小时对局数和双方平均每秒节点数。
+胜负按 xiangqi_rules.game_status（与界面相同的将死、困毙规则）和
+xiangqi_repetition（长将、长捉、重复局面）判定，超过步数上限判和。
+
+引擎配置写成 "模块[,参数=值...]"，模块可以是模块名或 .py 文件路径，
+模块里的 Engine 类用同样的 search 接口；depth 是每步的深度上限，
+其余参数传给 Engine，例如比较置换表大小或把旧版 xiangqi_engine.py 另存一份对比：
+
+    python xiangqi_match.py xiangqi_engine,hash_mb=16 old_engine.py --games 200 --tc 10+0.1
+    python xiangqi_match.py xiangqi_engine xiangqi_engine,hash_mb=1 --movetime 0.2 --openings fens.txt
+
+时间控制 --tc 基本时间+每步加秒，或者 --movetime 每步固定秒数。
+开局从 --openings 文件（每行一个 FEN）轮流选取，再随机走 --random-plies 步，
+同一个开局的两盘棋用完全相同的随机开局。
+"""
+import argparse
+import importlib
+import importlib.util
+import math
+import os
+import random
+import sys
+import time
+from multiprocessing import Pool
+
+import xiangqi_rules
+from xiangqi_position import Position, START_FEN, RED, BLACK_SIDE
+from xiangqi_repetition import PositionHistory, move_flags
+
+MAX_PLIES = 300
+
+_engine_modules = {}
+
+
+def parse_engine_spec(spec):
+    """'模块,参数=值' 转换为 (模块, 参数字典)，数字参数转换为 int/float"""
+    parts = spec.split(',')
+    options = {}
+    for part in parts[1:]:
+        name, _, value = part.partition('=')
+        for convert in (int, float):
+            try:
+                value = convert(value)
+                break
+            except ValueError:
+                pass
+        options[name.strip()] = value
+    return parts[0].strip(), options
+
+
+def _load_module(name):
+    if name not in _engine_modules:
+        if name.endswith('.py'):
+            module_name = '_match_engine_%d' % len(_engine_modules)
+            spec = importlib.util.spec_from_file_location(module_name, name)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        else:
+            module = importlib.import_module(name)
+        _engine_modules[name] = module
+    return _engine_modules[name]
+
+
+def make_engine(spec):
+    """按配置创建引擎，返回 (引擎, 每步深度上限)"""
+    module_name, options = parse_engine_spec(spec)
+    options = dict(options)
+    depth = options.pop('depth', None)
+    return _load_module(module_name).Engine(**options), depth
+
+
+def parse_time_control(text):
+    """'10+0.1' 转换为 (基本秒数, 每步加秒)"""
+    base, _, increment = text.partition('+')
+    return float(base), float(increment or 0)
+
+
+def random_opening(fen, plies, seed):
+    """从 fen 开始随机走 plies 步，返回走法列表；走到无子可走时提前停止"""
+    rng = random.Random(seed)
+    pos = Position.from_fen(fen)
+    moves = []
+    for _ in range(plies):
+        legal = pos.generate_legal_moves()
+        if not legal:
+            break
+        move = rng.choice(legal)
+        pos.do_move(move)
+        moves.append(move)
+    return moves
+
+
+def play_game(task):
+    """下一盘棋，返回对引擎 A 而言的结果字典
+
+    task 为 (对局编号, 引擎 A 配置, 引擎 B 配置, A 是否执红, 开局 FEN,
+    开局走法, 时间控制, 每步固定时间)。
+    """
+    (number, spec_a, spec_b, a_is_red, fen, opening, time_control, movetime) = task
+    engine_a, depth_a = make_engine(spec_a)
+    engine_b, depth_b = make_engine(spec_b)
+    players = {RED: (engine_a, depth_a), BLACK_SIDE: (engine_b, depth_b)}
+    if not a_is_red:
+        players = {RED: (engine_b, depth_b), BLACK_SIDE: (engine_a, depth_a)}
+
+    pos = Position.from_fen(fen)
+    history = PositionHistory(pos.key, pos.side)
+    for move in opening:
+        check, chase = move_flags(pos, move)
+        pos.do_move(move)
+        history.push(pos.key, check, chase)
+
+    base, increment = time_control or (0, 0)
+    clocks = [base, base]
+    nodes = {'a': 0, 'b': 0}
+    search_time = {'a': 0.0, 'b': 0.0}
+    winner, reason = None, None
+    while winner is None:
+        winner, reason = xiangqi_rules.game_status(pos.to_board(), pos.side == RED)
+        if winner is None:
+            winner, reason = history.status()
+        if winner is not None:
+            break
+        if len(history) >= MAX_PLIES:
+            winner, reason = 'draw', '步数上限'
+            break
+
+        side = pos.side
+        engine, depth = players[side]
+        if movetime:
+            limit = movetime
+        else:
+            limit = max(0.01, clocks[side] / 30 + increment * 0.8)
+        start = time.perf_counter()
+        result = engine.search(pos, max_depth=depth or 64, time_limit=limit,
+                               history=history.keys)
+        elapsed = time.perf_counter() - start
+        who = 'a' if (side == RED) == a_is_red else 'b'
+        nodes[who] += result['nodes']
+        search_time[who] += elapsed
+        if not movetime:
+            clocks[side] -= elapsed
+            if clocks[side] < 0:
+                winner = 'black' if side == RED else 'red'
+                reason = '超时'
+                break
+            clocks[side] += increment
+
+        move = result['move']
+        check, chase = move_flags(pos, move)
+        pos.do_move(move)
+        history.push(pos.key, check, chase)
+
+    if winner == 'draw':
+        score = 0.5
+    else:
+        score = 1.0 if (winner == 'red') == a_is_red else 0.0
+    return {'number': number, 'score': score, 'reason': reason, 'plies': len(history),
+            'nodes': nodes, 'time': search_time}
+
+
+def elo_difference(score):
+    """得分率换算为 Elo 差"""
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+def elo_interval(wins, draws, losses):
+    """返回 (Elo 差, 95% 置信区间半宽)，按每盘得分的样本方差估计"""
+    games = wins + draws + losses
+    if not games:
+        return 0.0, float('inf')
+    score = (wins + 0.5 * draws) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2
+                + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+    low = elo_difference(score - margin)
+    high = elo_difference(score + margin)
+    return elo_difference(score), (high - low) / 2
+
+
+def load_openings(path):
+    if not path:
+        return [START_FEN]
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def make_tasks(spec_a, spec_b, games, openings, random_plies, time_control, movetime, seed):
+    """每两盘一组：同一个开局，引擎 A 先执红再执黑"""
+    tasks = []
+    for number in range(games):
+        pair = number // 2
+        fen = openings[pair % len(openings)]
+        opening = random_opening(fen, random_plies, seed * 1000003 + pair)
+        tasks.append((number, spec_a, spec_b, number % 2 == 0, fen, opening,
+                      time_control, movetime))
+    return tasks
+
+
+def report(results, spec_a, spec_b, wall):
+    wins = sum(1 for r in results if r['score'] == 1)
+    draws = sum(1 for r in results if r['score'] == 0.5)
+    losses = len(results) - wins - draws
+    elo, margin = elo_interval(wins, draws, losses)
+    print(f'{spec_a} 对 {spec_b}: {len(results)} 盘  '
+          f'胜 {wins} 和 {draws} 负 {losses}  Elo {elo:+.1f} ± {margin:.1f}')
+    for who, spec in (('a', spec_a), ('b', spec_b)):
+        nodes = sum(r['nodes'][who] for r in results)
+        seconds = sum(r['time'][who] for r in results)
+        print(f'  {spec}: 平均 {nodes / seconds if seconds else 0:.0f} 节点/秒')
+    reasons = {}
+    for r in results:
+        reasons[r['reason']] = reasons.get(r['reason'], 0) + 1
+    print('  结束原因: ' + '，'.join(f'{reason} {count}' for reason, count in
+                                   sorted(reasons.items(), key=lambda item: -item[1])))
+    print(f'  每小时 {len(results) / wall * 3600:.0f} 盘，'
+          f'平均 {sum(r["plies"] for r in results) / len(results):.0f} 步')
+
+
+def run_match(spec_a, spec_b, games=100, concurrency=None, openings=(START_FEN,),
+              random_plies=4, time_control=None, movetime=None, seed=1, progress=10):
+    tasks = make_tasks(spec_a, spec_b, games, list(openings), random_plies,
+                       time_control, movetime, seed)
+    start = time.perf_counter()
+    results = []
+    with Pool(concurrency or os.cpu_count() or 1) as pool:
+        for result in pool.imap_unordered(play_game, tasks):
+            results.append(result)
+            if progress and len(results) % progress == 0 and len(results) < games:
+                report(results, spec_a, spec_b, time.perf_counter() - start)
+    report(results, spec_a, spec_b, time.perf_counter() - start)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='引擎自对弈比赛')
+    parser.add_argument('engine_a', help='引擎 A 配置，如 xiangqi_engine,hash_mb=16')
+    parser.add_argument('engine_b', help='引擎 B 配置')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=None, help='并行进程数')
+    parser.add_argument('--tc', default='10+0.1', help='时间控制：基本秒数+每步加秒')
+    parser.add_argument('--movetime', type=float, default=None, help='每步固定秒数')
+    parser.add_argument('--openings', default=None, help='开局 FEN 文件，每行一个')
+    parser.add_argument('--random-plies', type=int, default=4, help='开局后随机走的步数')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--progress', type=int, default=10, help='每下完多少盘打印一次')
+    args = parser.parse_args(argv)
+
+    time_control = None if args.movetime else parse_time_control(args.tc)
+    run_match(args.engine_a, args.engine_b, args.games, args.concurrency,
+              load_openings(args.openings), args.random_plies, time_control,
+              args.movetime, args.seed, args.progress)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
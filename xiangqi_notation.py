@@ -0,0 +1,365 @@
+"""FEN 与棋谱记法（ICCS / WXF）的读写
+
+ICCS 是坐标记法，如 h2e2：列 a-i 从红方左手数起，行 0-9 从红方底线数起。
+WXF 是纵线记法，如 C2.5、H8+7、C+.5（前炮平五）：
+棋子字母 + 纵线号 + 动作（+ 进、- 退、. 平）+ 纵线号或步数，
+纵线号按各自一方从右往左数 1-9。两条纵线上都有叠兵时写成 +7+1（前兵在 7 路）。
+
+棋谱文本格式与 PGN 类似：先是若干 [标签 "值"]，[FEN "..."] 给出起始局面，
+后面是走法，ICCS 和 WXF 都可以，步数编号 "1." 和 {注释} 会被忽略。
+"""
+import re
+import time
+
+from xiangqi_position import (Position, START_FEN, CODE_TO_FEN, CHAR_TO_CODE, RED,
+                              ROW, COL, CHARIOT, HORSE, ELEPHANT, ADVISOR, GENERAL,
+                              CANNON, PAWN)
+
+FILES = 'abcdefghi'
+
+# 走法编码与 ICCS 字符串互查的表，导入时生成一次
+MOVE_TO_ICCS = {}
+ICCS_TO_MOVE = {}
+for _from in range(90):
+    for _to in range(90):
+        if _from != _to:
+            _text = '%s%d%s%d' % (FILES[COL[_from]], 9 - ROW[_from],
+                                  FILES[COL[_to]], 9 - ROW[_to])
+            MOVE_TO_ICCS[(_from << 7) | _to] = _text
+            ICCS_TO_MOVE[_text] = (_from << 7) | _to
+
+WXF_LETTERS = {CHARIOT: 'R', HORSE: 'H', ELEPHANT: 'E', ADVISOR: 'A',
+               GENERAL: 'K', CANNON: 'C', PAWN: 'P'}
+WXF_TO_TYPE = {letter: kind for kind, letter in WXF_LETTERS.items()}
+WXF_TO_TYPE.update({'N': HORSE, 'B': ELEPHANT})
+STRAIGHT_PIECES = (CHARIOT, CANNON, PAWN, GENERAL)
+
+ICCS_PATTERN = re.compile(r'^[a-i][0-9]-?[a-i][0-9]$')
+
+
+# ---------- FEN ----------
+
+def board_to_fen(board, is_red_turn=True):
+    """把 ChessBoard.board 样式的二维汉字列表写成 FEN"""
+    rows = []
+    for board_row in board:
+        text = ''
+        empty = 0
+        for piece in board_row:
+            if piece:
+                if empty:
+                    text += str(empty)
+                    empty = 0
+                text += CODE_TO_FEN[CHAR_TO_CODE[piece]]
+            else:
+                empty += 1
+        if empty:
+            text += str(empty)
+        rows.append(text)
+    return '/'.join(rows) + (' w' if is_red_turn else ' b') + ' - - 0 1'
+
+
+def fen_to_board(fen):
+    """解析 FEN，返回 (二维汉字列表, 是否红方走)"""
+    pos = Position.from_fen(fen)
+    return pos.to_board(), pos.side == RED
+
+
+# ---------- ICCS ----------
+
+def move_to_iccs(move):
+    return MOVE_TO_ICCS[move]
+
+
+def iccs_to_move(text):
+    text = text.strip().lower().replace('-', '')
+    try:
+        return ICCS_TO_MOVE[text]
+    except KeyError:
+        raise ValueError('不是 ICCS 走法: %r' % text) from None
+
+
+def coords_to_iccs(start, end):
+    """ChessBoard.move_history 里的 (行, 列) 坐标转 ICCS"""
+    return MOVE_TO_ICCS[((start[0] * 9 + start[1]) << 7) | (end[0] * 9 + end[1])]
+
+
+def iccs_to_coords(text):
+    move = iccs_to_move(text)
+    return (ROW[move >> 7], COL[move >> 7]), (ROW[move & 127], COL[move & 127])
+
+
+def history_to_moves(move_history):
+    """把 ChessBoard.move_history 的记录转成走法编码列表"""
+    return [((start[0] * 9 + start[1]) << 7) | (end[0] * 9 + end[1])
+            for start, end, _ in move_history]
+
+
+def history_to_iccs(move_history):
+    """把 ChessBoard.move_history 的 ((行, 列), (行, 列), 被吃子) 记录转成 ICCS 列表"""
+    return [coords_to_iccs(start, end) for start, end, _ in move_history]
+
+
+# ---------- WXF ----------
+
+def _file_number(side, col):
+    return 9 - col if side == RED else col + 1
+
+
+def _file_col(side, number):
+    return 9 - number if side == RED else number - 1
+
+
+def _tandem_files(squares, code):
+    """有两个以上 code 棋子的纵线数"""
+    return sum(1 for col in range(9)
+               if sum(1 for sq in range(col, 90, 9) if squares[sq] == code) > 1)
+
+
+def move_to_wxf(pos, move):
+    """按走子前的局面 pos 把走法写成 WXF"""
+    squares = pos.squares
+    from_sq = move >> 7
+    to_sq = move & 127
+    code = squares[from_sq]
+    side = code >> 3
+    kind = code & 7
+    col = COL[from_sq]
+
+    # 同一纵线上有两个以上同类棋子时，用前后代替纵线号
+    same_file = [sq for sq in range(col, 90, 9) if squares[sq] == code]
+    if len(same_file) > 1:
+        # 红方前面是行号小的一端
+        same_file.sort(reverse=side != RED)
+        index = same_file.index(from_sq)
+        if len(same_file) == 2:
+            tag = '+' if index == 0 else '-'
+        elif len(same_file) == 3:
+            tag = '+=-'[index]
+        else:
+            raise ValueError('同一纵线上同类棋子太多，WXF 无法表示')
+        if _tandem_files(squares, code) > 1:
+            # 多条纵线都有叠兵，用纵线号代替棋子字母
+            prefix = tag + str(_file_number(side, col))
+        else:
+            prefix = WXF_LETTERS[kind] + tag
+    else:
+        prefix = WXF_LETTERS[kind] + str(_file_number(side, col))
+
+    rows = ROW[to_sq] - ROW[from_sq]
+    forward = -rows if side == RED else rows
+    if forward == 0:
+        return prefix + '.' + str(_file_number(side, COL[to_sq]))
+    action = '+' if forward > 0 else '-'
+    if kind in STRAIGHT_PIECES:
+        return prefix + action + str(abs(forward))
+    return prefix + action + str(_file_number(side, COL[to_sq]))
+
+
+def wxf_to_move(pos, text):
+    """按当前局面 pos 解析 WXF 走法，找不到合法走法时抛出 ValueError"""
+    text = text.strip().replace('=', '.')
+    if len(text) != 4:
+        raise ValueError('不是 WXF 走法: %r' % text)
+    tandem_col = None
+    if text[0] in '+-.' and text[1].isdigit():
+        # +7+1：多条纵线叠兵时按纵线号找兵
+        tandem_col = _file_col(pos.side, int(text[1]))
+        text = 'P' + text[0] + text[2:]
+    elif text[0] in '+-.':
+        # +C.5 与 C+.5 两种前后写法都接受
+        text = text[1] + text[0] + text[2:]
+    letter, where, action, number = text[0].upper(), text[1], text[2], text[3]
+    if letter not in WXF_TO_TYPE or action not in '+-.' or not number.isdigit():
+        raise ValueError('不是 WXF 走法: %r' % text)
+    side = pos.side
+    code = (side << 3) | WXF_TO_TYPE[letter]
+    kind = code & 7
+    squares = pos.squares
+
+    candidates = [sq for sq in range(90) if squares[sq] == code]
+    if where.isdigit():
+        col = _file_col(side, int(where))
+        candidates = [sq for sq in candidates if COL[sq] == col]
+    else:
+        by_file = {}
+        for sq in candidates:
+            by_file.setdefault(COL[sq], []).append(sq)
+        files = [sqs for col, sqs in by_file.items()
+                 if len(sqs) > 1 and tandem_col in (None, col)]
+        if len(files) != 1:
+            raise ValueError('无法确定前后棋子: %r' % text)
+        same_file = sorted(files[0], reverse=side != RED)
+        index = {'+': 0, '-': len(same_file) - 1, '.': 1}[where]
+        candidates = [same_file[index]]
+
+    number = int(number)
+    for from_sq in candidates:
+        piece_moves = pos.generate_piece_moves(from_sq)
+        row = ROW[from_sq]
+        col = COL[from_sq]
+        step = -1 if side == RED else 1
+        if action == '.':
+            targets = [row * 9 + _file_col(side, number)]
+        elif kind in STRAIGHT_PIECES:
+            distance = number if action == '+' else -number
+            targets = [(row + step * distance) * 9 + col]
+        else:
+            to_col = _file_col(side, number)
+            targets = []
+            for to_sq in range(to_col, 90, 9):
+                forward = (ROW[to_sq] - row) * step
+                if (forward > 0) == (action == '+') and forward != 0:
+                    targets.append(to_sq)
+        for to_sq in targets:
+            move = (from_sq << 7) | to_sq
+            if 0 <= to_sq < 90 and move in piece_moves and pos.is_legal(move):
+                return move
+    raise ValueError('当前局面没有这步棋: %r' % text)
+
+
+# ---------- 棋谱 ----------
+
+_TAG_PATTERN = re.compile(r'^\[(\w+)\s+"(.*)"\]\s*$')
+_COMMENT_PATTERN = re.compile(r'\{[^}]*\}|;[^\n]*')
+_MOVE_NUMBER_PATTERN = re.compile(r'^\d+\.+$|^\d+\.+')
+_RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+
+
+def parse_game(text, validate=False):
+    """解析一盘棋谱，返回 {'tags': {...}, 'fen': 起始 FEN, 'moves': [走法编码]}
+
+    ICCS 走法只查表不验证，速度最快；validate=True 时逐步检查合法性。
+    含 WXF 走法时必须跟着局面走，会自动按局面解析。
+    """
+    tags = {}
+    body = []
+    for line in text.splitlines():
+        match = _TAG_PATTERN.match(line.strip())
+        if match:
+            tags[match.group(1)] = match.group(2)
+        else:
+            body.append(line)
+    fen = tags.get('FEN', START_FEN)
+    tokens = _COMMENT_PATTERN.sub(' ', '\n'.join(body)).split()
+
+    moves = []
+    pos = None
+    for token in tokens:
+        token = _MOVE_NUMBER_PATTERN.sub('', token)
+        if not token or token in _RESULTS:
+            continue
+        iccs = token.lower().replace('-', '')
+        move = ICCS_TO_MOVE.get(iccs) if ICCS_PATTERN.match(token.lower()) else None
+        if move is None or validate:
+            if pos is None:
+                pos = Position.from_fen(fen)
+                for earlier in moves:
+                    pos.do_move(earlier)
+            if move is None:
+                move = wxf_to_move(pos, token)
+            elif move not in pos.generate_legal_moves():
+                raise ValueError('第 %d 步不合法: %s' % (len(moves) + 1, token))
+            pos.do_move(move)
+        elif pos is not None:
+            pos.do_move(move)
+        moves.append(move)
+    return {'tags': tags, 'fen': fen, 'moves': moves}
+
+
+def split_games(text):
+    """把含多盘棋的文本按标签块切开"""
+    games = []
+    current = []
+    in_moves = False
+    for line in text.splitlines():
+        is_tag = line.startswith('[')
+        if is_tag and in_moves:
+            games.append('\n'.join(current))
+            current = []
+            in_moves = False
+        if not is_tag and line.strip():
+            in_moves = True
+        current.append(line)
+    if any(line.strip() for line in current):
+        games.append('\n'.join(current))
+    return games
+
+
+def load_games(path, validate=False):
+    """读取棋谱文件中的所有对局"""
+    with open(path, encoding='utf-8') as f:
+        return [parse_game(text, validate) for text in split_games(f.read())]
+
+
+def write_game(moves, fen=START_FEN, tags=None, notation='iccs'):
+    """把走法列表写成棋谱文本，notation 为 'iccs' 或 'wxf'"""
+    lines = []
+    tags = dict(tags or {})
+    if fen != START_FEN:
+        tags['FEN'] = fen
+    for name, value in tags.items():
+        lines.append('[%s "%s"]' % (name, value))
+    if lines:
+        lines.append('')
+
+    start_pos = Position.from_fen(fen)
+    pos = start_pos if notation == 'wxf' else None
+    black_first = 1 if start_pos.side != RED else 0
+    tokens = []
+    for ply, move in enumerate(moves):
+        number = (ply + black_first) // 2 + 1
+        if (ply + black_first) % 2 == 0:
+            tokens.append('%d.' % number)
+        elif ply == 0:
+            tokens.append('%d...' % number)
+        if pos is not None:
+            tokens.append(move_to_wxf(pos, move))
+            pos.do_move(move)
+        else:
+            tokens.append(MOVE_TO_ICCS[move])
+    lines.append(' '.join(tokens) + ' ' + tags.get('Result', '*'))
+    return '\n'.join(lines) + '\n'
+
+
+def replay(game):
+    """按棋谱走到最后，返回最终局面"""
+    pos = Position.from_fen(game['fen'])
+    for move in game['moves']:
+        pos.do_move(move)
+    return pos
+
+
+def benchmark(rounds=2000):
+    """测量 FEN 和棋谱读写速度（微秒/次）"""
+    fen = START_FEN
+    start = time.perf_counter()
+    for _ in range(rounds):
+        Position.from_fen(fen)
+    print(f'Position.from_fen: {(time.perf_counter() - start) / rounds * 1e6:.1f} 微秒')
+
+    pos = Position.initial()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        pos.to_fen()
+    print(f'Position.to_fen: {(time.perf_counter() - start) / rounds * 1e6:.1f} 微秒')
+
+    # 构造一盘 80 步的棋谱：双方车马来回走
+    moves = [iccs_to_move(text) for text in ('h0g2', 'h9g7', 'g2h0', 'g7h9') * 20]
+    text = write_game(moves, tags={'Event': 'benchmark'})
+    start = time.perf_counter()
+    for _ in range(rounds):
+        parse_game(text)
+    print(f'parse_game（{len(moves)} 步 ICCS）: '
+          f'{(time.perf_counter() - start) / rounds * 1e6:.1f} 微秒')
+
+    wxf_text = write_game(moves, notation='wxf')
+    start = time.perf_counter()
+    for _ in range(rounds // 20):
+        parse_game(wxf_text)
+    print(f'parse_game（{len(moves)} 步 WXF）: '
+          f'{(time.perf_counter() - start) / (rounds // 20) * 1e6:.1f} 微秒')
+
+
+if __name__ == '__main__':
+    benchmark()
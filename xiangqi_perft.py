@@ -0,0 +1,147 @@
+"""perft / divide：统计走法生成器在给定深度的叶子节点数
+
+    python xiangqi_perft.py 3                 # 开局局面 perft 3
+    python xiangqi_perft.py 2 --fen "..."     # 指定 FEN 局面
+    python xiangqi_perft.py 2 --divide        # 按第一步分别统计
+    python xiangqi_perft.py --suite           # 跑参考节点数，不一致时返回 1
+    python xiangqi_perft.py --suite --impl rules   # 用 xiangqi_rules 的二维列表规则核对
+
+--impl position 使用 xiangqi_position.Position，rules 使用 chinese_chess.py 界面
+同款的 xiangqi_rules 规则，两套实现对同一组参考数必须给出相同结果。
+"""
+import argparse
+import sys
+import time
+
+import xiangqi_rules
+from xiangqi_notation import move_to_iccs
+from xiangqi_position import Position, START_FEN
+
+# (FEN, 深度, 节点数)；开局的数字是公认的象棋 perft 结果，
+# 其余局面由 Position 与 xiangqi_rules 两套独立实现算出并互相印证
+REFERENCE_SUITE = [
+    (START_FEN, 1, 44),
+    (START_FEN, 2, 1920),
+    (START_FEN, 3, 79666),
+    (START_FEN, 4, 3290240),
+    ('r1ba1a3/4kn3/2n1b4/pNp1p1p1p/4c4/6P2/P1P2R2P/1CcC5/9/2BAKAB2 w - - 0 1', 3, 43929),
+    ('r1ba1a3/4kn3/2n1b4/pNp1p1p1p/4c4/6P2/P1P2R2P/1CcC5/9/2BAKAB2 w - - 0 1', 4, 1339047),
+    ('1cbak4/9/n2a5/2p1p3p/5cp2/2n2N3/6PCP/3AB4/2C6/3A1K1N1 w - - 0 1', 4, 326201),
+    ('5a3/3k5/3aR4/9/5r3/5n3/9/3A1A3/5K3/2BC2B2 w - - 0 1', 4, 202884),
+    ('CRN1k1b2/3ca4/4ba3/9/2nr5/9/9/4B4/4A4/4KA3 w - - 0 1', 4, 395483),
+    ('R1N1k1b2/9/3aba3/9/2nr5/2B6/9/4B4/4A4/4KA3 w - - 0 1', 4, 162837),
+    ('C1nNk4/9/9/9/9/9/n1pp5/B3C4/9/3A1K3 w - - 0 1', 4, 64971),
+    ('4ka3/4a4/9/9/4N4/p8/9/4C3c/7n1/2BK5 w - - 0 1', 4, 149272),
+    ('2b1ka3/9/b3N4/4n4/9/9/9/4C4/2p6/2BK5 w - - 0 1', 4, 48060),
+]
+
+
+def perft(pos, depth):
+    if depth == 0:
+        return 1
+    moves = pos.generate_legal_moves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        captured = pos.do_move(move)
+        nodes += perft(pos, depth - 1)
+        pos.undo_move(move, captured)
+    return nodes
+
+
+def divide(pos, depth):
+    """返回 {走法: 节点数}"""
+    result = {}
+    for move in pos.generate_legal_moves():
+        captured = pos.do_move(move)
+        result[move] = perft(pos, depth - 1)
+        pos.undo_move(move, captured)
+    return result
+
+
+def perft_rules(board, red, depth):
+    """用 xiangqi_rules 的二维列表规则计算 perft"""
+    if depth == 0:
+        return 1
+    moves = xiangqi_rules.generate_legal_moves(board, red)
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for (sr, sc), (er, ec) in moves:
+        piece = board[sr][sc]
+        captured = board[er][ec]
+        board[er][ec] = piece
+        board[sr][sc] = ''
+        nodes += perft_rules(board, not red, depth - 1)
+        board[sr][sc] = piece
+        board[er][ec] = captured
+    return nodes
+
+
+def count_nodes(fen, depth, impl='position'):
+    pos = Position.from_fen(fen)
+    if impl == 'rules':
+        return perft_rules(pos.to_board(), pos.side == 0, depth)
+    return perft(pos, depth)
+
+
+def run_suite(impl, max_nodes):
+    """跑参考局面，返回不一致的数量"""
+    failures = 0
+    total_nodes = 0
+    total_time = 0.0
+    for fen, depth, expected in REFERENCE_SUITE:
+        if expected > max_nodes:
+            print(f'跳过  {fen}  深度 {depth}（{expected} 个节点，超过 --max-nodes）')
+            continue
+        start = time.perf_counter()
+        nodes = count_nodes(fen, depth, impl)
+        elapsed = time.perf_counter() - start
+        total_nodes += nodes
+        total_time += elapsed
+        status = '通过' if nodes == expected else '失败'
+        if nodes != expected:
+            failures += 1
+        print(f'{status}  {fen}  深度 {depth}: {nodes}（应为 {expected}）  '
+              f'{nodes / elapsed if elapsed else 0:.0f} 节点/秒')
+    if total_time:
+        print(f'合计 {total_nodes} 个节点，{total_time:.2f} 秒，'
+              f'{total_nodes / total_time:.0f} 节点/秒')
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='象棋走法生成 perft 工具')
+    parser.add_argument('depth', type=int, nargs='?', default=3, help='搜索深度')
+    parser.add_argument('--fen', default=START_FEN, help='起始局面，默认开局')
+    parser.add_argument('--divide', action='store_true', help='按第一步分别统计')
+    parser.add_argument('--suite', action='store_true', help='运行参考节点数测试')
+    parser.add_argument('--impl', choices=('position', 'rules'), default='position',
+                        help='使用的规则实现')
+    parser.add_argument('--max-nodes', type=int, default=1000000,
+                        help='--suite 时跳过节点数超过该值的条目')
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        return 1 if run_suite(args.impl, args.max_nodes) else 0
+
+    start = time.perf_counter()
+    if args.divide:
+        if args.impl != 'position':
+            parser.error('--divide 只支持 --impl position')
+        result = divide(Position.from_fen(args.fen), args.depth)
+        for move, nodes in sorted(result.items(), key=lambda item: move_to_iccs(item[0])):
+            print(f'{move_to_iccs(move)}: {nodes}')
+        nodes = sum(result.values())
+        print(f'走法数: {len(result)}')
+    else:
+        nodes = count_nodes(args.fen, args.depth, args.impl)
+    elapsed = time.perf_counter() - start
+    print(f'节点数: {nodes}')
+    print(f'用时: {elapsed:.3f} 秒，{nodes / elapsed if elapsed else 0:.0f} 节点/秒')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
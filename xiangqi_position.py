@@ -0,0 +1,492 @@
+"""紧凑的象棋局面表示
+
+90 个格子放在一个 bytearray 里，每格一个整数棋子编码：
+低 3 位是兵种，第 4 位表示黑方，0 表示空位。
+格子编号 sq = 行 * 9 + 列，行号与 ChessBoard.board 相同（第 0 行是黑方底线）。
+走法编码为 (起点 << 7) | 终点，16 位以内，方便放进置换表和开局库。
+每个局面带一个 64 位 Zobrist 键（含走棋方），走子时增量更新。
+"""
+import random
+import sys
+import time
+
+import xiangqi_rules
+from xiangqi_rules import (HORSE_MOVES, HORSE_ATTACKS, ELEPHANT_MOVES, ADVISOR_MOVES,
+                           GENERAL_MOVES, PAWN_MOVES, PAWN_ATTACKS)
+
+EMPTY = 0
+CHARIOT, HORSE, ELEPHANT, ADVISOR, GENERAL, CANNON, PAWN = range(1, 8)
+BLACK = 8
+RED, BLACK_SIDE = 0, 1
+
+# 棋子编码与汉字之间的对应关系
+PIECE_CHARS = {
+    CHARIOT: '车', HORSE: '马', ELEPHANT: '相', ADVISOR: '仕',
+    GENERAL: '帅', CANNON: '炮', PAWN: '兵',
+    BLACK | CHARIOT: '車', BLACK | HORSE: '馬', BLACK | ELEPHANT: '象',
+    BLACK | ADVISOR: '士', BLACK | GENERAL: '将', BLACK | CANNON: '砲',
+    BLACK | PAWN: '卒',
+}
+CHAR_TO_CODE = {char: code for code, char in PIECE_CHARS.items()}
+
+# FEN 字母：大写红方、小写黑方，兼容 H/E 的写法
+FEN_LETTERS = {
+    CHARIOT: 'R', HORSE: 'N', ELEPHANT: 'B', ADVISOR: 'A',
+    GENERAL: 'K', CANNON: 'C', PAWN: 'P',
+}
+FEN_TO_CODE = {}
+for _code, _letter in FEN_LETTERS.items():
+    FEN_TO_CODE[_letter] = _code
+    FEN_TO_CODE[_letter.lower()] = BLACK | _code
+FEN_TO_CODE.update({'H': HORSE, 'E': ELEPHANT, 'h': BLACK | HORSE, 'e': BLACK | ELEPHANT})
+CODE_TO_FEN = {code: letter for letter, code in FEN_TO_CODE.items()
+               if letter.upper() not in 'HE'}
+START_FEN = 'rnbakabnr/9/1c5c1/p1p1p1p1p/9/9/P1P1P1P1P/1C5C1/9/RNBAKABNR w - - 0 1'
+
+ROW = tuple(sq // 9 for sq in range(90))
+COL = tuple(sq % 9 for sq in range(90))
+
+# 每个格子向上、下、左、右四个方向依次经过的格子，车炮走子和将军检测都沿用它
+RAYS = tuple(
+    tuple(tuple((ROW[sq] + dr * i) * 9 + COL[sq] + dc * i
+                for i in range(1, 10)
+                if 0 <= ROW[sq] + dr * i < 10 and 0 <= COL[sq] + dc * i < 9)
+          for dr, dc in ((-1, 0), (1, 0), (0, -1), (0, 1)))
+    for sq in range(90))
+
+# DIRECTION[a][b]：b 在 a 的哪条射线上（下标同 RAYS），不在同一直线时为 -1
+def _directions(sq):
+    lines = [-1] * 90
+    for d, ray in enumerate(RAYS[sq]):
+        for to in ray:
+            lines[to] = d
+    return tuple(lines)
+
+
+DIRECTION = tuple(_directions(sq) for sq in range(90))
+
+
+def side_of(code):
+    """棋子属于哪一方：0 红，1 黑"""
+    return code >> 3
+
+
+def type_of(code):
+    return code & 7
+
+
+def make_move(from_sq, to_sq):
+    return (from_sq << 7) | to_sq
+
+
+def move_from(move):
+    return move >> 7
+
+
+def move_to(move):
+    return move & 127
+
+
+# Zobrist 随机数：ZOBRIST[编码 * 90 + 格子]，固定种子保证不同进程、不同次运行的键一致
+_zobrist_rng = random.Random(0x5A0B)
+ZOBRIST = [_zobrist_rng.getrandbits(64) if code in PIECE_CHARS else 0
+           for code in range(16) for _ in range(90)]
+ZOBRIST_SIDE = _zobrist_rng.getrandbits(64)  # 轮到黑方走时异或进键值
+del _zobrist_rng
+
+# 估值表：EVAL[编码 * 90 + 格子] 为子力加位置分（红正黑负），中局分和残局分
+# 压在一个整数里（见 xiangqi_eval.pack_score）；EVAL_PHASE[编码] 为局面阶段权重。
+# 本模块末尾导入 xiangqi_eval 时填入，Position 在走子和悔棋时增量更新 score 和 phase
+EVAL = [0] * (16 * 90)
+EVAL_PHASE = [0] * 16
+
+
+def board_key(board, is_red_turn=True):
+    """计算 ChessBoard.board 样式棋盘的 64 位 Zobrist 键"""
+    key = 0 if is_red_turn else ZOBRIST_SIDE
+    for row in range(10):
+        for col in range(9):
+            piece = board[row][col]
+            if piece:
+                key ^= ZOBRIST[CHAR_TO_CODE[piece] * 90 + row * 9 + col]
+    return key
+
+
+def move_key_delta(piece, start, end, captured=''):
+    """一步棋带来的键值变化（汉字棋子与 (行, 列) 坐标），走子和悔棋都异或同一个值"""
+    code = CHAR_TO_CODE[piece]
+    delta = (ZOBRIST[code * 90 + start[0] * 9 + start[1]]
+             ^ ZOBRIST[code * 90 + end[0] * 9 + end[1]] ^ ZOBRIST_SIDE)
+    if captured:
+        delta ^= ZOBRIST[CHAR_TO_CODE[captured] * 90 + end[0] * 9 + end[1]]
+    return delta
+
+
+class Position:
+    """紧凑局面：squares 为 90 字节的棋子编码，side 为轮到走棋的一方"""
+
+    __slots__ = ('squares', 'side', 'generals', 'key', 'score', 'phase')
+
+    def __init__(self, squares=None, side=RED):
+        self.squares = bytearray(90) if squares is None else bytearray(squares)
+        self.side = side
+        # 缓存双方帅/将位置，-1 表示不在棋盘上
+        self.generals = [-1, -1]
+        # 64 位 Zobrist 键，走子和悔棋时增量更新
+        self.key = ZOBRIST_SIDE if side else 0
+        # 估值表分数之和与阶段权重之和，同样增量更新
+        self.score = 0
+        self.phase = 0
+        for sq, code in enumerate(self.squares):
+            if code:
+                self.key ^= ZOBRIST[code * 90 + sq]
+                self.score += EVAL[code * 90 + sq]
+                self.phase += EVAL_PHASE[code]
+            if code & 7 == GENERAL:
+                self.generals[code >> 3] = sq
+
+    @classmethod
+    def initial(cls):
+        return cls.from_board(xiangqi_rules.init_board(), True)
+
+    @classmethod
+    def from_board(cls, board, is_red_turn=True):
+        """由 ChessBoard.board 样式的二维汉字列表创建局面"""
+        squares = bytearray(90)
+        for row in range(10):
+            for col in range(9):
+                piece = board[row][col]
+                if piece:
+                    squares[row * 9 + col] = CHAR_TO_CODE[piece]
+        return cls(squares, RED if is_red_turn else BLACK_SIDE)
+
+    @classmethod
+    def from_fen(cls, fen):
+        """解析 FEN，第一段从黑方底线（第 0 行）写起，第二段 w/r 表示红方走"""
+        fields = fen.split()
+        rows = fields[0].split('/')
+        if len(rows) != 10:
+            raise ValueError('FEN 必须有 10 行: %r' % fen)
+        squares = bytearray(90)
+        for row, text in enumerate(rows):
+            col = 0
+            for char in text:
+                if char.isdigit():
+                    col += int(char)
+                else:
+                    if char not in FEN_TO_CODE or col >= 9:
+                        raise ValueError('FEN 第 %d 行有误: %r' % (row, text))
+                    squares[row * 9 + col] = FEN_TO_CODE[char]
+                    col += 1
+            if col != 9:
+                raise ValueError('FEN 第 %d 行不是 9 列: %r' % (row, text))
+        side = BLACK_SIDE if len(fields) > 1 and fields[1] == 'b' else RED
+        return cls(squares, side)
+
+    def to_fen(self):
+        rows = []
+        squares = self.squares
+        for row in range(10):
+            text = ''
+            empty = 0
+            for col in range(9):
+                code = squares[row * 9 + col]
+                if code:
+                    if empty:
+                        text += str(empty)
+                        empty = 0
+                    text += CODE_TO_FEN[code]
+                else:
+                    empty += 1
+            if empty:
+                text += str(empty)
+            rows.append(text)
+        return '/'.join(rows) + (' b' if self.side else ' w') + ' - - 0 1'
+
+    def to_board(self):
+        """转换回二维汉字列表"""
+        return [[PIECE_CHARS.get(self.squares[row * 9 + col], '') for col in range(9)]
+                for row in range(10)]
+
+    def copy(self):
+        pos = Position.__new__(Position)
+        pos.squares = self.squares[:]
+        pos.side = self.side
+        pos.generals = self.generals[:]
+        pos.key = self.key
+        pos.score = self.score
+        pos.phase = self.phase
+        return pos
+
+    def pack(self):
+        """压缩成 46 字节：每格 4 位，最后一个字节是走棋方"""
+        sq = self.squares
+        data = bytearray(46)
+        for i in range(45):
+            data[i] = (sq[2 * i] << 4) | sq[2 * i + 1]
+        data[45] = self.side
+        return bytes(data)
+
+    @classmethod
+    def unpack(cls, data):
+        squares = bytearray(90)
+        for i in range(45):
+            squares[2 * i] = data[i] >> 4
+            squares[2 * i + 1] = data[i] & 15
+        return cls(squares, data[45])
+
+    def __eq__(self, other):
+        return (isinstance(other, Position) and self.side == other.side
+                and self.squares == other.squares)
+
+    def __hash__(self):
+        return self.key
+
+    def piece_at(self, row, col):
+        return self.squares[row * 9 + col]
+
+    def is_occupied(self, sq):
+        return self.squares[sq] != EMPTY
+
+    def do_move(self, move):
+        """走一步棋，返回被吃掉的棋子编码，供 undo_move 使用"""
+        squares = self.squares
+        from_sq = move >> 7
+        to_sq = move & 127
+        piece = squares[from_sq]
+        captured = squares[to_sq]
+        squares[to_sq] = piece
+        squares[from_sq] = EMPTY
+        key = self.key ^ ZOBRIST[piece * 90 + from_sq] ^ ZOBRIST[piece * 90 + to_sq] ^ ZOBRIST_SIDE
+        score = self.score + EVAL[piece * 90 + to_sq] - EVAL[piece * 90 + from_sq]
+        if captured:
+            key ^= ZOBRIST[captured * 90 + to_sq]
+            score -= EVAL[captured * 90 + to_sq]
+            self.phase -= EVAL_PHASE[captured]
+            if captured & 7 == GENERAL:
+                self.generals[captured >> 3] = -1
+        self.key = key
+        self.score = score
+        if piece & 7 == GENERAL:
+            self.generals[piece >> 3] = to_sq
+        self.side ^= 1
+        return captured
+
+    def undo_move(self, move, captured):
+        squares = self.squares
+        from_sq = move >> 7
+        to_sq = move & 127
+        piece = squares[to_sq]
+        squares[from_sq] = piece
+        squares[to_sq] = captured
+        key = self.key ^ ZOBRIST[piece * 90 + from_sq] ^ ZOBRIST[piece * 90 + to_sq] ^ ZOBRIST_SIDE
+        score = self.score - EVAL[piece * 90 + to_sq] + EVAL[piece * 90 + from_sq]
+        if captured:
+            key ^= ZOBRIST[captured * 90 + to_sq]
+            score += EVAL[captured * 90 + to_sq]
+            self.phase += EVAL_PHASE[captured]
+            if captured & 7 == GENERAL:
+                self.generals[captured >> 3] = to_sq
+        self.key = key
+        self.score = score
+        if piece & 7 == GENERAL:
+            self.generals[piece >> 3] = from_sq
+        self.side ^= 1
+
+    def generate_moves(self):
+        """生成走棋方的全部伪合法走法（规则与 xiangqi_rules 相同）"""
+        squares = self.squares
+        side = self.side
+        moves = []
+        for sq in range(90):
+            code = squares[sq]
+            if code and code >> 3 == side:
+                self._gen_piece(sq, code, moves)
+        return moves
+
+    def generate_piece_moves(self, sq):
+        """生成 sq 上棋子的伪合法走法"""
+        moves = []
+        code = self.squares[sq]
+        if code:
+            self._gen_piece(sq, code, moves)
+        return moves
+
+    def _gen_piece(self, sq, code, moves):
+        squares = self.squares
+        side = code >> 3
+        kind = code & 7
+        base = sq << 7
+        append = moves.append
+
+        if kind == CHARIOT:
+            for ray in RAYS[sq]:
+                for to in ray:
+                    target = squares[to]
+                    if target:
+                        if target >> 3 != side:
+                            append(base | to)
+                        break
+                    append(base | to)
+            return
+
+        if kind == CANNON:
+            for ray in RAYS[sq]:
+                screen = False
+                for to in ray:
+                    target = squares[to]
+                    if not screen:
+                        if target:
+                            screen = True  # 翻过炮架后只能吃子
+                        else:
+                            append(base | to)
+                    elif target:
+                        if target >> 3 != side:
+                            append(base | to)
+                        break
+            return
+
+        if kind == HORSE or kind == ELEPHANT:
+            # 落点和马脚/象眼都来自 xiangqi_rules 的走法表
+            table = HORSE_MOVES[sq] if kind == HORSE else ELEPHANT_MOVES[side][sq]
+            for to, block in table:
+                if not squares[block]:
+                    target = squares[to]
+                    if not target or target >> 3 != side:
+                        append(base | to)
+            return
+
+        if kind == ADVISOR:
+            targets = ADVISOR_MOVES[side][sq]
+        elif kind == GENERAL:
+            targets = GENERAL_MOVES[side][sq]
+        else:
+            targets = PAWN_MOVES[side][sq]
+        for to in targets:
+            target = squares[to]
+            if not target or target >> 3 != side:
+                append(base | to)
+
+    def _ray_attacked(self, sq, side, direction):
+        """沿一个方向检查车、炮和帅将照面"""
+        squares = self.squares
+        enemy = (side ^ 1) << 3
+        screen = False
+        for to in RAYS[sq][direction]:
+            piece = squares[to]
+            if not piece:
+                continue
+            if screen:
+                return piece == enemy | CANNON
+            # 前两个方向是竖线，帅将照面只会发生在竖线上
+            if piece == enemy | CHARIOT or (piece == enemy | GENERAL and direction < 2):
+                return True
+            screen = True
+        return False
+
+    def _horse_attacked(self, sq, side):
+        squares = self.squares
+        horse = ((side ^ 1) << 3) | HORSE
+        # 马脚在马一侧、与帅/将斜向相邻的格子上
+        for origin, leg in HORSE_ATTACKS[sq]:
+            if squares[origin] == horse and not squares[leg]:
+                return True
+        return False
+
+    def _pawn_attacked(self, sq, side):
+        squares = self.squares
+        pawn = ((side ^ 1) << 3) | PAWN
+        for origin in PAWN_ATTACKS[side][sq]:
+            if squares[origin] == pawn:
+                return True
+        return False
+
+    def is_attacked(self, sq, side):
+        """判断 side 一方在 sq 上的帅/将是否被对方攻击（含帅将照面）"""
+        return (self._ray_attacked(sq, side, 0) or self._ray_attacked(sq, side, 1)
+                or self._ray_attacked(sq, side, 2) or self._ray_attacked(sq, side, 3)
+                or self._horse_attacked(sq, side) or self._pawn_attacked(sq, side))
+
+    def in_check(self, side=None):
+        if side is None:
+            side = self.side
+        general = self.generals[side]
+        return general >= 0 and self.is_attacked(general, side)
+
+    def is_legal(self, move, in_check=None):
+        """伪合法走法走完后己方帅/将是否安全
+
+        没被将军时，只有起点或终点在帅/将直线上、或起点是马脚的走法
+        才可能暴露帅/将，这时只复查受影响的那条线或马的攻击。
+        """
+        side = self.side
+        general = self.generals[side]
+        if general < 0:
+            return True
+        from_sq = move >> 7
+        to_sq = move & 127
+        if in_check is None:
+            in_check = self.is_attacked(general, side)
+        if in_check or from_sq == general:
+            captured = self.do_move(move)
+            safe = not self.is_attacked(self.generals[side], side)
+            self.undo_move(move, captured)
+            return safe
+
+        lines = DIRECTION[general]
+        from_dir = lines[from_sq]
+        to_dir = lines[to_sq]
+        leg = abs(ROW[from_sq] - ROW[general]) == 1 and abs(COL[from_sq] - COL[general]) == 1
+        if from_dir < 0 and to_dir < 0 and not leg:
+            return True
+        captured = self.do_move(move)
+        safe = not ((from_dir >= 0 and self._ray_attacked(general, side, from_dir))
+                    or (to_dir >= 0 and to_dir != from_dir
+                        and self._ray_attacked(general, side, to_dir))
+                    or (leg and self._horse_attacked(general, side)))
+        self.undo_move(move, captured)
+        return safe
+
+    def generate_legal_moves(self):
+        in_check = self.in_check()
+        return [move for move in self.generate_moves() if self.is_legal(move, in_check)]
+
+
+# 估值表由 xiangqi_eval 填入 EVAL / EVAL_PHASE。放在 Position 定义之后导入：
+# xiangqi_eval 反过来要用这里的 Position，只导入本模块的调用方也能拿到非零的估值
+import xiangqi_eval  # noqa: E402,F401
+
+
+def benchmark(rounds=200):
+    """比较二维汉字列表与紧凑局面的内存占用和走法生成速度"""
+    board = xiangqi_rules.init_board()
+    pos = Position.initial()
+
+    list_bytes = sys.getsizeof(board) + sum(
+        sys.getsizeof(row) for row in board)
+    print(f'二维列表: {list_bytes} 字节')
+    print(f'Position: {sys.getsizeof(pos) + sys.getsizeof(pos.squares) + sys.getsizeof(pos.generals)} 字节')
+    print(f'Position.pack(): {len(pos.pack())} 字节')
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        xiangqi_rules.generate_legal_moves(board, True)
+    list_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        pos.generate_legal_moves()
+    pos_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(rounds * 10):
+        pos.copy()
+    copy_time = time.perf_counter() - start
+
+    print(f'二维列表合法走法生成: {rounds / list_time:.0f} 次/秒')
+    print(f'Position 合法走法生成: {rounds / pos_time:.0f} 次/秒')
+    print(f'Position.copy(): {rounds * 10 / copy_time:.0f} 次/秒')
+
+
+if __name__ == '__main__':
+    benchmark()
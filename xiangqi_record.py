@@ -0,0 +1,273 @@
+"""对局记录文件：只追加写入，任意一步 O(1) 定位
+
+文件开头是 8 字节魔数和 46 字节的起始局面（Position.pack），后面是一条条
+只追加的记录，每条以 1 字节类型开头：
+
+    M 走法(2)                  走一步，每步只占 3 字节
+    T 步数(4)                  截断到第几步（悔棋、从中途接着下）
+    S 步数(4) 局面(46)         第几步走完后的局面快照，每 SNAPSHOT_INTERVAL 步一个
+    C 步数(4) 长度(2) 文本     第几步走完后的注释（UTF-8）
+
+写入只在文件末尾追加并立即 flush，程序中途退出最多丢掉最后一条。读入时
+只解析记录、不走子；定位到第 n 步时从不晚于它的最近快照解开局面，再走
+至多 SNAPSHOT_INTERVAL - 1 步，与棋局长短无关。
+
+    python xiangqi_record.py import 棋谱.txt -o game.xqr   # 从 ICCS/WXF 棋谱转换
+    python xiangqi_record.py export game.xqr               # 输出棋谱文本
+    python xiangqi_record.py show game.xqr --ply 40        # 第 40 步后的 FEN 和注释
+    python xiangqi_record.py bench                         # 定位速度和文件大小
+"""
+import argparse
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+
+from xiangqi_notation import load_games, write_game
+from xiangqi_position import Position, START_FEN
+
+MAGIC = b'XQREC001'
+PACKED_SIZE = 46
+HEADER_SIZE = len(MAGIC) + PACKED_SIZE
+SNAPSHOT_INTERVAL = 16
+
+MOVE = struct.Struct('<cH')
+TRUNCATE = struct.Struct('<cI')
+SNAPSHOT = struct.Struct('<cI%ds' % PACKED_SIZE)
+COMMENT = struct.Struct('<cIH')
+
+
+class GameRecord:
+    """一盘棋的走法、快照和注释；path 不为 None 时每次修改都追加到文件"""
+
+    def __init__(self, start=None, path=None):
+        start = start or Position.from_fen(START_FEN)
+        self.start_fen = start.to_fen()
+        self.moves = []
+        self.snapshots = {0: start.pack()}
+        self.comments = {}
+        self.current = start.copy()  # 最后一步走完后的局面，用来写快照
+        self.path = path
+        self._file = None
+
+    @classmethod
+    def create(cls, path, start=None):
+        """新建记录文件（已存在时覆盖）"""
+        record = cls(start, path)
+        record._file = open(path, 'wb')
+        record._file.write(MAGIC + record.snapshots[0])
+        record._file.flush()
+        return record
+
+    @classmethod
+    def load(cls, path, append=False):
+        """读入记录文件；append=True 时之后的修改接着追加到这个文件"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < HEADER_SIZE or data[:len(MAGIC)] != MAGIC:
+            raise ValueError('不是对局记录文件: %s' % path)
+        record = cls(Position.unpack(data[len(MAGIC):HEADER_SIZE]), path)
+        moves = record.moves
+        snapshots = record.snapshots
+        offset = HEADER_SIZE
+        end = len(data)
+        while offset < end:
+            kind = data[offset:offset + 1]
+            if kind == b'M' and offset + MOVE.size <= end:
+                moves.append(MOVE.unpack_from(data, offset)[1])
+                offset += MOVE.size
+            elif kind == b'S' and offset + SNAPSHOT.size <= end:
+                _, ply, packed = SNAPSHOT.unpack_from(data, offset)
+                snapshots[ply] = packed
+                offset += SNAPSHOT.size
+            elif kind == b'T' and offset + TRUNCATE.size <= end:
+                record._forget(TRUNCATE.unpack_from(data, offset)[1])
+                offset += TRUNCATE.size
+            elif kind == b'C' and offset + COMMENT.size <= end:
+                _, ply, length = COMMENT.unpack_from(data, offset)
+                offset += COMMENT.size
+                if offset + length > end:
+                    break
+                record.comments[ply] = data[offset:offset + length].decode('utf-8', 'replace')
+                offset += length
+            else:
+                # 最后一条没写完整（写到一半退出），后面的内容丢弃
+                break
+        record.current = record.position(len(moves))
+        if append:
+            record._file = open(path, 'r+b')
+            # 截掉不完整的尾巴，之后的记录接在最后一条完整记录后面
+            record._file.truncate(offset)
+            record._file.seek(offset)
+        return record
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __len__(self):
+        return len(self.moves)
+
+    def _write(self, data):
+        if self._file is not None:
+            self._file.write(data)
+            self._file.flush()
+
+    def _forget(self, ply):
+        """丢掉 ply 之后的走法，以及已经不在这条线上的快照和注释"""
+        del self.moves[ply:]
+        for stale in [p for p in self.snapshots if p > ply]:
+            del self.snapshots[stale]
+        for stale in [p for p in self.comments if p > ply]:
+            del self.comments[stale]
+
+    def push(self, move):
+        """记录一步棋，每 SNAPSHOT_INTERVAL 步顺带写一个快照"""
+        self.moves.append(move)
+        self.current.do_move(move)
+        data = MOVE.pack(b'M', move)
+        ply = len(self.moves)
+        if ply % SNAPSHOT_INTERVAL == 0:
+            packed = self.current.pack()
+            self.snapshots[ply] = packed
+            data += SNAPSHOT.pack(b'S', ply, packed)
+        self._write(data)
+
+    def truncate(self, ply):
+        """回到第 ply 步，之后的走法作废"""
+        if ply >= len(self.moves):
+            return
+        self._forget(ply)
+        self.current = self.position(ply)
+        self._write(TRUNCATE.pack(b'T', ply))
+
+    def set_comment(self, ply, text):
+        # 超长时按字节截断，再去掉被截断的半个字符，写入的总是完整的 UTF-8
+        text = text.encode('utf-8')[:0xFFFF].decode('utf-8', 'ignore')
+        encoded = text.encode('utf-8')
+        self.comments[ply] = text
+        self._write(COMMENT.pack(b'C', ply, len(encoded)) + encoded)
+
+    def position(self, ply):
+        """第 ply 步走完后的局面：从最近的快照开始走，最多走 SNAPSHOT_INTERVAL - 1 步"""
+        ply = max(0, min(ply, len(self.moves)))
+        base = ply - ply % SNAPSHOT_INTERVAL
+        # 快照缺失（比如文件末尾被截断）时继续往前找
+        while base not in self.snapshots:
+            base -= SNAPSHOT_INTERVAL
+        pos = Position.unpack(self.snapshots[base])
+        for move in self.moves[base:ply]:
+            pos.do_move(move)
+        return pos
+
+
+def import_game(source, output):
+    """把棋谱文件里的第一盘棋转换为记录文件"""
+    games = load_games(source)
+    if not games:
+        raise ValueError('没有找到对局: %s' % source)
+    game = games[0]
+    record = GameRecord.create(output, Position.from_fen(game['fen']))
+    for move in game['moves']:
+        record.push(move)
+    record.close()
+    print(f'{len(game["moves"])} 步，写入 {output}，{os.path.getsize(output)} 字节')
+
+
+def random_game(plies, seed=1):
+    """随机走 plies 步，走到无子可走时从头再来，只用于测试"""
+    rng = random.Random(seed)
+    moves = []
+    pos = Position.from_fen(START_FEN)
+    while len(moves) < plies:
+        legal = pos.generate_legal_moves()
+        if not legal:
+            moves = []
+            pos = Position.from_fen(START_FEN)
+            continue
+        move = rng.choice(legal)
+        pos.do_move(move)
+        moves.append(move)
+    return moves
+
+
+def benchmark(plies=2000, rounds=2000):
+    """长对局里随机定位，比较快照定位和从头重走的用时"""
+    moves = random_game(plies)
+    path = os.path.join(tempfile.mkdtemp(), 'bench.xqr')
+    start = time.perf_counter()
+    record = GameRecord.create(path)
+    for ply, move in enumerate(moves, 1):
+        record.push(move)
+        if ply % 10 == 0:
+            record.set_comment(ply, '第 %d 步的注释' % ply)
+    record.close()
+    write_time = time.perf_counter() - start
+    size = os.path.getsize(path)
+
+    start = time.perf_counter()
+    record = GameRecord.load(path)
+    load_time = time.perf_counter() - start
+
+    rng = random.Random(2)
+    targets = [rng.randrange(plies + 1) for _ in range(rounds)]
+    start = time.perf_counter()
+    for ply in targets:
+        record.position(ply)
+    seek = (time.perf_counter() - start) / rounds
+
+    start = time.perf_counter()
+    for ply in targets[:rounds // 20]:
+        pos = Position.from_fen(START_FEN)
+        for move in moves[:ply]:
+            pos.do_move(move)
+    full = (time.perf_counter() - start) / (rounds // 20)
+
+    for ply in targets[:50]:
+        pos = Position.from_fen(START_FEN)
+        for move in moves[:ply]:
+            pos.do_move(move)
+        assert record.position(ply) == pos
+    os.remove(path)
+    print(f'{plies} 步、{plies // 10} 条注释：{size} 字节（{size / plies:.1f} 字节/步），'
+          f'写入 {write_time * 1000:.1f} 毫秒，读入 {load_time * 1000:.1f} 毫秒')
+    print(f'定位: 快照 {seek * 1e6:.1f} 微秒/次，从头重走 {full * 1e6:.1f} 微秒/次')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='对局记录文件')
+    sub = parser.add_subparsers(dest='command', required=True)
+    import_parser = sub.add_parser('import', help='把棋谱转换为记录文件')
+    import_parser.add_argument('source')
+    import_parser.add_argument('-o', '--output', required=True)
+    export_parser = sub.add_parser('export', help='把记录文件输出为棋谱文本')
+    export_parser.add_argument('path')
+    export_parser.add_argument('--notation', choices=('iccs', 'wxf'), default='iccs')
+    show_parser = sub.add_parser('show', help='显示某一步后的局面')
+    show_parser.add_argument('path')
+    show_parser.add_argument('--ply', type=int, default=None, help='默认最后一步')
+    bench_parser = sub.add_parser('bench', help='定位速度测试')
+    bench_parser.add_argument('--plies', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    if args.command == 'import':
+        import_game(args.source, args.output)
+    elif args.command == 'export':
+        record = GameRecord.load(args.path)
+        sys.stdout.write(write_game(record.moves, record.start_fen, notation=args.notation))
+    elif args.command == 'show':
+        record = GameRecord.load(args.path)
+        ply = len(record) if args.ply is None else args.ply
+        print(f'第 {ply}/{len(record)} 步: {record.position(ply).to_fen()}')
+        if ply in record.comments:
+            print(record.comments[ply])
+    else:
+        benchmark(args.plies)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""重复局面与长将、长捉判定
+
+PositionHistory 按局面键记录每个局面出现在第几步，每走一步只做一次字典
+更新，走到同一局面第三次时才回头检查这段循环里双方的走法：
+
+- 一方每步都将军（长将）、每步都捉子（长捉）或每步非将即捉（一将一捉），
+  另一方不是，则这一方判负；
+- 双方都是或都不是，判和。
+
+捉子按亚洲规则简化：走动的棋子走完后新攻击到对方的车马炮仕相或过河兵，
+且被攻击的子没有保护，或者价值高于攻击它的子（如马捉车），就算捉；
+帅将和兵卒攻击别的子不算捉。
+"""
+from xiangqi_engine import PIECE_VALUES
+from xiangqi_position import RED, BLACK_SIDE, ROW, GENERAL, PAWN, make_move
+
+REPETITION_LIMIT = 3
+
+
+def _targets(pos, sq):
+    """sq 上的棋子能吃到的、可以被捉的对方棋子所在格子"""
+    squares = pos.squares
+    targets = set()
+    for move in pos.generate_piece_moves(sq):
+        to = move & 127
+        code = squares[to]
+        if not code or code & 7 == GENERAL:
+            continue
+        # 没过河的兵卒不算被捉
+        if code & 7 == PAWN and (ROW[to] >= 5 if code >> 3 == RED else ROW[to] <= 4):
+            continue
+        targets.add(to)
+    return targets
+
+
+def _is_chase(pos, attacker, target):
+    """pos 轮到被攻击方走，attacker 吃 target 是否构成捉"""
+    squares = pos.squares
+    move = make_move(attacker, target)
+    pos.side ^= 1
+    try:
+        if not pos.is_legal(move):
+            return False
+        if PIECE_VALUES[squares[target] & 7] > PIECE_VALUES[squares[attacker] & 7]:
+            return True
+        captured = pos.do_move(move)
+        protected = any(m & 127 == target for m in pos.generate_legal_moves())
+        pos.undo_move(move, captured)
+        return not protected
+    finally:
+        pos.side ^= 1
+
+
+def move_flags(pos, move):
+    """pos 为走 move 之前的局面，返回 (是否将军, 是否捉子)"""
+    from_sq = move >> 7
+    to_sq = move & 127
+    kind = pos.squares[from_sq] & 7
+    before = set() if kind in (GENERAL, PAWN) else _targets(pos, from_sq)
+    captured = pos.do_move(move)
+    try:
+        if pos.in_check():
+            return True, False
+        if kind in (GENERAL, PAWN):
+            return False, False
+        for target in _targets(pos, to_sq) - before:
+            if _is_chase(pos, to_sq, target):
+                return False, True
+        return False, False
+    finally:
+        pos.undo_move(move, captured)
+
+
+class PositionHistory:
+    """对局中出现过的局面，keys[i] 为第 i 步走完后的局面键（keys[0] 为起始局面）"""
+
+    def __init__(self, key=0, side=RED):
+        self.reset(key, side)
+
+    def reset(self, key, side=RED):
+        """从新的起始局面开始记录，side 为起始局面的走棋方"""
+        self.first_side = side
+        self.keys = [key]
+        self.flags = [(False, False)]  # 第 i 步是否将军、是否捉子
+        self.occurrences = {key: [0]}
+
+    def __len__(self):
+        return len(self.keys) - 1
+
+    def push(self, key, check=False, chase=False):
+        """记录走完一步后的局面"""
+        self.occurrences.setdefault(key, []).append(len(self.keys))
+        self.keys.append(key)
+        self.flags.append((check, chase))
+
+    def pop(self):
+        """悔棋时撤销最后一步"""
+        if len(self.keys) == 1:
+            raise IndexError('没有可以撤销的走法')
+        key = self.keys.pop()
+        self.flags.pop()
+        plies = self.occurrences[key]
+        plies.pop()
+        if not plies:
+            del self.occurrences[key]
+
+    def count(self, key=None):
+        """key（默认当前局面）出现过的次数"""
+        return len(self.occurrences.get(self.keys[-1] if key is None else key, ()))
+
+    def mover(self, ply):
+        """第 ply 步是哪一方走的"""
+        return self.first_side ^ ((ply - 1) & 1)
+
+    def status(self, limit=REPETITION_LIMIT):
+        """返回 (胜方, 原因)，没有出现 limit 次重复时返回 (None, None)
+
+        胜方为 'red' / 'black'，判和时为 'draw'；原因为 '长将'、'长捉'、
+        '一将一捉' 或 '重复局面'。
+        """
+        plies = self.occurrences[self.keys[-1]]
+        if len(plies) < limit:
+            return None, None
+        all_check = [True, True]
+        all_attack = [True, True]
+        for ply in range(plies[-limit] + 1, len(self.keys)):
+            check, chase = self.flags[ply]
+            side = self.mover(ply)
+            all_check[side] = all_check[side] and check
+            all_attack[side] = all_attack[side] and (check or chase)
+        if all_attack[RED] == all_attack[BLACK_SIDE]:
+            return 'draw', '重复局面'
+        loser = RED if all_attack[RED] else BLACK_SIDE
+        if all_check[loser]:
+            reason = '长将'
+        elif any(self.flags[ply][0] for ply in range(plies[-limit] + 1, len(self.keys))
+                 if self.mover(ply) == loser):
+            reason = '一将一捉'
+        else:
+            reason = '长捉'
+        return ('black' if loser == RED else 'red'), reason
@@ -0,0 +1,582 @@
+"""中国象棋走子规则（不依赖 PyQt5）
+
+棋盘用 10x9 的二维列表表示，格子里是棋子汉字，空位为 ''，
+和 chinese_chess.py 里 ChessBoard.board 完全一样，规则也完全一致。
+"""
+import time
+
+RED_PIECES = '车马相仕帅炮兵'
+BLACK_PIECES = '車馬象士将砲卒'
+
+
+def is_red(piece):
+    """判断棋子是否属于红方"""
+    return piece in RED_PIECES
+
+
+def empty_board():
+    """创建空棋盘"""
+    return [['' for _ in range(9)] for _ in range(10)]
+
+
+def init_board(board=None):
+    """摆放开局棋子，不传入棋盘时新建一个"""
+    if board is None:
+        board = empty_board()
+
+    # 红方(下方)
+    red_pieces = {
+        9: ['车', '马', '相', '仕', '帅', '仕', '相', '马', '车'],
+        7: ['', '炮', '', '', '', '', '', '炮', ''],  # 红炮在第7行第2列和第8列
+        6: ['兵', '', '兵', '', '兵', '', '兵', '', '兵'],  # 红兵在第6行
+    }
+
+    # 黑方(上方)
+    black_pieces = {
+        0: ['車', '馬', '象', '士', '将', '士', '象', '馬', '車'],
+        2: ['', '砲', '', '', '', '', '', '砲', ''],  # 黑炮在第2行第2列和第8列
+        3: ['卒', '', '卒', '', '卒', '', '卒', '', '卒']  # 黑卒的位置
+    }
+
+    for pieces_by_row in (red_pieces, black_pieces):
+        for row, pieces in pieces_by_row.items():
+            for col, piece in enumerate(pieces):
+                if piece:
+                    board[row][col] = piece
+    return board
+
+
+def is_valid_move(board, start_row, start_col, end_row, end_col):
+    piece = board[start_row][start_col]
+    target = board[end_row][end_col]
+
+    # 检查否吃自己的子
+    if target:
+        is_red_target = target in RED_PIECES
+        is_red_piece = piece in RED_PIECES
+        if is_red_target == is_red_piece:
+            return False
+
+    # 根据不同的棋子类型检查移动是否合法
+    if piece in '车車':
+        return is_valid_chariot_move(board, start_row, start_col, end_row, end_col)
+    elif piece in '马馬':
+        return is_valid_horse_move(board, start_row, start_col, end_row, end_col)
+    elif piece in '相象':
+        return is_valid_elephant_move(board, start_row, start_col, end_row, end_col)
+    elif piece in '仕士':
+        return is_valid_advisor_move(board, start_row, start_col, end_row, end_col)
+    elif piece in '帅将':
+        return is_valid_general_move(board, start_row, start_col, end_row, end_col)
+    elif piece in '炮砲':
+        return is_valid_cannon_move(board, start_row, start_col, end_row, end_col)
+    elif piece in '兵卒':
+        return is_valid_pawn_move(board, start_row, start_col, end_row, end_col)
+    return False
+
+
+def is_valid_chariot_move(board, start_row, start_col, end_row, end_col):
+    # 只能直移动
+    if start_row != end_row and start_col != end_col:
+        return False
+
+    # 检查路径上是否有其他棋子
+    if start_row == end_row:  # 横向移动
+        min_col = min(start_col, end_col)
+        max_col = max(start_col, end_col)
+        for col in range(min_col + 1, max_col):
+            if board[start_row][col]:
+                return False
+    else:  # 纵向移动
+        min_row = min(start_row, end_row)
+        max_row = max(start_row, end_row)
+        for row in range(min_row + 1, max_row):
+            if board[row][start_col]:
+                return False
+    return True
+
+
+def is_valid_horse_move(board, start_row, start_col, end_row, end_col):
+    # 马走"日"字，查表得到马脚
+    leg = HORSE_LEGS[start_row * 9 + start_col].get(end_row * 9 + end_col)
+    return leg is not None and not board[leg[0]][leg[1]]
+
+
+def is_valid_elephant_move(board, start_row, start_col, end_row, end_col):
+    # 相/象走田字，不能过河；表里只有本方一侧的落点，再检查象心是否被塞
+    side = 0 if board[start_row][start_col] == '相' else 1
+    eye = ELEPHANT_EYES[side][start_row * 9 + start_col].get(end_row * 9 + end_col)
+    return eye is not None and not board[eye[0]][eye[1]]
+
+
+def is_valid_advisor_move(board, start_row, start_col, end_row, end_col):
+    # 仕/士走斜线一步，限制在本方九宫格内
+    side = 0 if board[start_row][start_col] == '仕' else 1
+    return end_row * 9 + end_col in ADVISOR_TARGETS[side][start_row * 9 + start_col]
+
+
+def is_valid_general_move(board, start_row, start_col, end_row, end_col):
+    # 帅/将走直线一步，限制在本方九宫格内
+    side = 0 if board[start_row][start_col] == '帅' else 1
+    return end_row * 9 + end_col in GENERAL_TARGETS[side][start_row * 9 + start_col]
+
+
+def is_valid_cannon_move(board, start_row, start_col, end_row, end_col):
+    # 炮的移动规则：直线移动，吃子时必须隔一个棋子
+    if start_row != end_row and start_col != end_col:
+        return False
+
+    # 计算路径上的棋子数量
+    pieces_in_path = 0
+    if start_row == end_row:  # 横向移动
+        min_col = min(start_col, end_col)
+        max_col = max(start_col, end_col)
+        for col in range(min_col + 1, max_col):
+            if board[start_row][col]:
+                pieces_in_path += 1
+    else:  # 纵向移动
+        min_row = min(start_row, end_row)
+        max_row = max(start_row, end_row)
+        for row in range(min_row + 1, max_row):
+            if board[row][start_col]:
+                pieces_in_path += 1
+
+    # 判断移动是否合法
+    target = board[end_row][end_col]
+    if target:  # 吃子时必须跳过一个棋子
+        return pieces_in_path == 1
+    else:  # 移动时不能有棋子阻挡
+        return pieces_in_path == 0
+
+
+def is_valid_pawn_move(board, start_row, start_col, end_row, end_col):
+    # 兵/卒只能向前走，过河后可以横走
+    side = 0 if board[start_row][start_col] == '兵' else 1
+    return end_row * 9 + end_col in PAWN_TARGETS[side][start_row * 9 + start_col]
+
+
+# 各类棋子的走法方向
+ORTHOGONAL = ((-1, 0), (1, 0), (0, -1), (0, 1))
+DIAGONAL = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+# 马的八个落点及对应的马脚偏移
+HORSE_STEPS = (
+    (-2, -1, -1, 0), (-2, 1, -1, 0), (2, -1, 1, 0), (2, 1, 1, 0),
+    (-1, -2, 0, -1), (1, -2, 0, -1), (-1, 2, 0, 1), (1, 2, 0, 1),
+)
+
+# ---------- 走法表 ----------
+# 导入时把马、相、仕、帅、兵的几何关系按格子编号 sq = 行 * 9 + 列 算好，
+# 走法检查、走法生成和将军检测都只查表，不再临时算行列差、马脚和河界。
+# 按红黑区分的表用 [0] 红方、[1] 黑方（与 xiangqi_position 的 RED / BLACK_SIDE 相同）。
+#
+# HORSE_MOVES[sq]          马的 (落点, 马脚)
+# HORSE_ATTACKS[sq]        能吃到 sq 的马所在的 (格子, 马脚)
+# ELEPHANT_MOVES[side][sq] 相/象的 (落点, 象眼)，不过河
+# ADVISOR_MOVES[side][sq]  仕/士在九宫内的落点
+# GENERAL_MOVES[side][sq]  帅/将在九宫内的落点
+# PAWN_MOVES[side][sq]     兵/卒的落点，过河后含左右
+# PAWN_ATTACKS[side][sq]   能吃到 side 一方 sq 上棋子的对方兵/卒所在格子
+# 查表检查用的 HORSE_LEGS、ELEPHANT_EYES 是 {落点: 马脚/象眼} 的字典，
+# ADVISOR_TARGETS、GENERAL_TARGETS、PAWN_TARGETS 是落点集合。
+
+SQUARE_COORDS = tuple(divmod(sq, 9) for sq in range(90))
+
+
+def _in_palace(side, row, col):
+    return 3 <= col <= 5 and (row >= 7 if side == 0 else row <= 2)
+
+
+def build_move_tables():
+    """按几何规则计算全部走法表，按下面解包的顺序返回"""
+    squares = range(90)
+    horse_moves = []
+    elephant_moves = ([], [])
+    advisor_moves = ([], [])
+    general_moves = ([], [])
+    pawn_moves = ([], [])
+    for sq in squares:
+        row, col = SQUARE_COORDS[sq]
+        horse_moves.append(tuple(
+            ((row + dr) * 9 + col + dc, (row + leg_r) * 9 + col + leg_c)
+            for dr, dc, leg_r, leg_c in HORSE_STEPS
+            if 0 <= row + dr < 10 and 0 <= col + dc < 9))
+        for side in (0, 1):
+            elephant_moves[side].append(tuple(
+                ((row + 2 * dr) * 9 + col + 2 * dc, (row + dr) * 9 + col + dc)
+                for dr, dc in DIAGONAL
+                if 0 <= col + 2 * dc < 9
+                and (5 <= row + 2 * dr <= 9 if side == 0 else 0 <= row + 2 * dr <= 4)))
+            advisor_moves[side].append(tuple(
+                (row + dr) * 9 + col + dc for dr, dc in DIAGONAL
+                if _in_palace(side, row + dr, col + dc) and 0 <= row + dr < 10))
+            general_moves[side].append(tuple(
+                (row + dr) * 9 + col + dc for dr, dc in ORTHOGONAL
+                if _in_palace(side, row + dr, col + dc) and 0 <= row + dr < 10))
+            forward = row - 1 if side == 0 else row + 1
+            targets = [forward * 9 + col] if 0 <= forward < 10 else []
+            # 过河后可以横走
+            if (side == 0 and row <= 4) or (side == 1 and row >= 5):
+                targets += [sq + dc for dc in (-1, 1) if 0 <= col + dc < 9]
+            pawn_moves[side].append(tuple(targets))
+
+    # 攻击表是走法表反过来：从被攻击的格子查攻击者
+    horse_attacks = [[] for _ in squares]
+    for sq in squares:
+        for to, leg in horse_moves[sq]:
+            horse_attacks[to].append((sq, leg))
+    pawn_attacks = ([[] for _ in squares], [[] for _ in squares])
+    for side in (0, 1):
+        for sq in squares:
+            for to in pawn_moves[side ^ 1][sq]:
+                pawn_attacks[side][to].append(sq)
+
+    def by_side(tables):
+        return tuple(tuple(table) for table in tables)
+
+    return (tuple(horse_moves),
+            tuple(tuple(entries) for entries in horse_attacks),
+            by_side(elephant_moves),
+            by_side(advisor_moves),
+            by_side(general_moves),
+            by_side(pawn_moves),
+            tuple(by_side(table) for table in pawn_attacks),
+            # 检查单步走法用的字典和集合
+            tuple({to: SQUARE_COORDS[leg] for to, leg in moves} for moves in horse_moves),
+            tuple(tuple({to: SQUARE_COORDS[eye] for to, eye in moves} for moves in table)
+                  for table in elephant_moves),
+            tuple(tuple(frozenset(moves) for moves in table) for table in advisor_moves),
+            tuple(tuple(frozenset(moves) for moves in table) for table in general_moves),
+            tuple(tuple(frozenset(moves) for moves in table) for table in pawn_moves))
+
+
+(HORSE_MOVES, HORSE_ATTACKS, ELEPHANT_MOVES, ADVISOR_MOVES, GENERAL_MOVES, PAWN_MOVES,
+ PAWN_ATTACKS, HORSE_LEGS, ELEPHANT_EYES, ADVISOR_TARGETS, GENERAL_TARGETS,
+ PAWN_TARGETS) = build_move_tables()
+
+
+def _can_land(board, red, row, col):
+    """目标格为空或是对方棋子"""
+    target = board[row][col]
+    return not target or (target in RED_PIECES) != red
+
+
+def _gen_ray_moves(board, red, row, col, moves):
+    # 车：四个方向一直走到第一个棋子为止
+    for dr, dc in ORTHOGONAL:
+        r, c = row + dr, col + dc
+        while 0 <= r < 10 and 0 <= c < 9:
+            target = board[r][c]
+            if target:
+                if (target in RED_PIECES) != red:
+                    moves.append((r, c))
+                break
+            moves.append((r, c))
+            r += dr
+            c += dc
+
+
+def _gen_cannon_moves(board, red, row, col, moves):
+    # 炮：没遇到炮架前只能走空位，翻过炮架后只能吃子
+    for dr, dc in ORTHOGONAL:
+        r, c = row + dr, col + dc
+        while 0 <= r < 10 and 0 <= c < 9:
+            if board[r][c]:
+                break
+            moves.append((r, c))
+            r += dr
+            c += dc
+        r += dr
+        c += dc
+        while 0 <= r < 10 and 0 <= c < 9:
+            target = board[r][c]
+            if target:
+                if (target in RED_PIECES) != red:
+                    moves.append((r, c))
+                break
+            r += dr
+            c += dc
+
+
+def _gen_blocked_moves(board, red, table, moves):
+    """马、相：落点和马脚/象眼都从表里取"""
+    for to, block in table:
+        block_row, block_col = SQUARE_COORDS[block]
+        if not board[block_row][block_col]:
+            r, c = SQUARE_COORDS[to]
+            if _can_land(board, red, r, c):
+                moves.append((r, c))
+
+
+def _gen_step_moves(board, red, targets, moves):
+    """仕、帅、兵：表里的落点只要不是己方棋子就能走"""
+    for to in targets:
+        r, c = SQUARE_COORDS[to]
+        if _can_land(board, red, r, c):
+            moves.append((r, c))
+
+
+def generate_piece_moves(board, row, col):
+    """直接按棋子几何规则生成指定位置棋子的全部走法，结果与逐格检查相同"""
+    moves = []
+    piece = board[row][col]
+    if not piece:
+        return moves
+    red = piece in RED_PIECES
+    side = 0 if red else 1
+    sq = row * 9 + col
+    if piece in '车車':
+        _gen_ray_moves(board, red, row, col, moves)
+    elif piece in '马馬':
+        _gen_blocked_moves(board, red, HORSE_MOVES[sq], moves)
+    elif piece in '相象':
+        _gen_blocked_moves(board, red, ELEPHANT_MOVES[side][sq], moves)
+    elif piece in '仕士':
+        _gen_step_moves(board, red, ADVISOR_MOVES[side][sq], moves)
+    elif piece in '帅将':
+        _gen_step_moves(board, red, GENERAL_MOVES[side][sq], moves)
+    elif piece in '炮砲':
+        _gen_cannon_moves(board, red, row, col, moves)
+    elif piece in '兵卒':
+        _gen_step_moves(board, red, PAWN_MOVES[side][sq], moves)
+    return moves
+
+
+def generate_moves(board, red):
+    """生成一方所有棋子的走法，返回 ((起行, 起列), (终行, 终列)) 列表"""
+    moves = []
+    for row in range(10):
+        board_row = board[row]
+        for col in range(9):
+            piece = board_row[col]
+            if piece and (piece in RED_PIECES) == red:
+                start = (row, col)
+                for end in generate_piece_moves(board, row, col):
+                    moves.append((start, end))
+    return moves
+
+
+def get_valid_moves(board, row, col):
+    """获取指定位置棋子的所有合法移动位置"""
+    return generate_piece_moves(board, row, col)
+
+
+def scan_valid_moves(board, row, col):
+    """逐个检查 90 个格子的旧算法，保留用于对照和基准测试"""
+    valid_moves = []
+    piece = board[row][col]
+    if not piece:
+        return valid_moves
+
+    # 检查所有可能的位置
+    for end_row in range(10):
+        for end_col in range(9):
+            if is_valid_move(board, row, col, end_row, end_col):
+                valid_moves.append((end_row, end_col))
+
+    return valid_moves
+
+
+def find_general(board, red):
+    """返回一方帅/将所在位置，不在棋盘上时返回 None"""
+    general = '帅' if red else '将'
+    rows = range(7, 10) if red else range(0, 3)
+    for row in rows:
+        for col in range(3, 6):
+            if board[row][col] == general:
+                return row, col
+    # 非标准局面下帅/将可能不在九宫内
+    for row in range(10):
+        for col in range(9):
+            if board[row][col] == general:
+                return row, col
+    return None
+
+
+def _is_attacked(board, red, row, col):
+    """从被攻击的帅/将出发反向检查对方能否吃到 (row, col)"""
+    if red:
+        chariot, cannon, horse, pawn, general = '車', '砲', '馬', '卒', '将'
+    else:
+        chariot, cannon, horse, pawn, general = '车', '炮', '马', '兵', '帅'
+
+    # 直线：车、对面的将帅（白脸将）、隔一子的炮
+    for dr, dc in ORTHOGONAL:
+        r, c = row + dr, col + dc
+        while 0 <= r < 10 and 0 <= c < 9 and not board[r][c]:
+            r += dr
+            c += dc
+        if not (0 <= r < 10 and 0 <= c < 9):
+            continue
+        piece = board[r][c]
+        if piece == chariot or (piece == general and dc == 0):
+            return True
+        r += dr
+        c += dc
+        while 0 <= r < 10 and 0 <= c < 9 and not board[r][c]:
+            r += dr
+            c += dc
+        if 0 <= r < 10 and 0 <= c < 9 and board[r][c] == cannon:
+            return True
+
+    # 马：马脚在马与帅之间的斜角上
+    sq = row * 9 + col
+    for origin, leg in HORSE_ATTACKS[sq]:
+        r, c = SQUARE_COORDS[origin]
+        if board[r][c] == horse:
+            leg_row, leg_col = SQUARE_COORDS[leg]
+            if not board[leg_row][leg_col]:
+                return True
+
+    # 兵/卒：正面一步，过河后还有左右两侧
+    for origin in PAWN_ATTACKS[0 if red else 1][sq]:
+        r, c = SQUARE_COORDS[origin]
+        if board[r][c] == pawn:
+            return True
+    return False
+
+
+def is_in_check(board, red):
+    """判断一方是否被将军（包括帅将照面）"""
+    pos = find_general(board, red)
+    if pos is None:
+        return False
+    return _is_attacked(board, red, pos[0], pos[1])
+
+
+def _leaves_general_safe(board, red, start, end, general_pos, in_check):
+    """走完这一步后己方帅/将是否安全"""
+    sr, sc = start
+    er, ec = end
+    piece = board[sr][sc]
+    moving_general = piece in '帅将'
+    if not in_check and not moving_general and general_pos is not None:
+        gr, gc = general_pos
+        # 不在帅/将直线和马脚位置上的子走动不会暴露己方帅/将
+        if (sr != gr and sc != gc and not (abs(sr - gr) == 1 and abs(sc - gc) == 1)
+                and er != gr and ec != gc):
+            return True
+    captured = board[er][ec]
+    board[er][ec] = piece
+    board[sr][sc] = ''
+    if moving_general:
+        safe = not _is_attacked(board, red, er, ec)
+    elif general_pos is None:
+        safe = True
+    else:
+        safe = not _is_attacked(board, red, general_pos[0], general_pos[1])
+    board[sr][sc] = piece
+    board[er][ec] = captured
+    return safe
+
+
+def get_legal_moves(board, row, col):
+    """获取指定棋子走完后不让己方被将军、不造成白脸将的走法"""
+    piece = board[row][col]
+    if not piece:
+        return []
+    red = piece in RED_PIECES
+    general_pos = find_general(board, red)
+    in_check = general_pos is not None and _is_attacked(board, red, *general_pos)
+    return [end for end in generate_piece_moves(board, row, col)
+            if _leaves_general_safe(board, red, (row, col), end, general_pos, in_check)]
+
+
+def is_legal_move(board, start_row, start_col, end_row, end_col):
+    """在 is_valid_move 的基础上排除送将和白脸将"""
+    if not is_valid_move(board, start_row, start_col, end_row, end_col):
+        return False
+    piece = board[start_row][start_col]
+    red = piece in RED_PIECES
+    general_pos = find_general(board, red)
+    in_check = general_pos is not None and _is_attacked(board, red, *general_pos)
+    return _leaves_general_safe(board, red, (start_row, start_col), (end_row, end_col),
+                                general_pos, in_check)
+
+
+def generate_legal_moves(board, red):
+    """生成一方所有合法走法"""
+    general_pos = find_general(board, red)
+    in_check = general_pos is not None and _is_attacked(board, red, *general_pos)
+    return [(start, end) for start, end in generate_moves(board, red)
+            if _leaves_general_safe(board, red, start, end, general_pos, in_check)]
+
+
+def has_legal_move(board, red):
+    """一方是否还有合法走法，找到一步就返回"""
+    general_pos = find_general(board, red)
+    in_check = general_pos is not None and _is_attacked(board, red, *general_pos)
+    for start, end in generate_moves(board, red):
+        if _leaves_general_safe(board, red, start, end, general_pos, in_check):
+            return True
+    return False
+
+
+def game_status(board, red_to_move):
+    """返回 (胜方, 原因)，对局未结束时返回 (None, None)
+
+    胜方为 'red' / 'black'，原因为 '吃将'、'将死' 或 '困毙'。
+    象棋中无子可走（困毙）同样判负。
+    """
+    winner = find_winner(board)
+    if winner:
+        return winner, '吃将'
+    if not has_legal_move(board, red_to_move):
+        winner = 'black' if red_to_move else 'red'
+        return winner, '将死' if is_in_check(board, red_to_move) else '困毙'
+    return None, None
+
+
+def find_winner(board):
+    """将帅被吃掉时返回胜方 'red' / 'black'，否则返回 None"""
+    red_general_exists = False
+    black_general_exists = False
+
+    for row in range(10):
+        for col in range(9):
+            piece = board[row][col]
+            if piece == '帅':
+                red_general_exists = True
+            elif piece == '将':
+                black_general_exists = True
+
+    if not red_general_exists:
+        return 'black'
+    elif not black_general_exists:
+        return 'red'
+    return None
+
+
+def _time_side(board, red, func, rounds):
+    squares = [(r, c) for r in range(10) for c in range(9)
+               if board[r][c] and (board[r][c] in RED_PIECES) == red]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for row, col in squares:
+            func(board, row, col)
+    return time.perf_counter() - start
+
+
+def benchmark(rounds=200):
+    """比较逐格扫描和几何生成两种方法生成一方全部走法的速度"""
+    board = init_board()
+    scan = _time_side(board, True, scan_valid_moves, rounds)
+    gen = _time_side(board, True, generate_piece_moves, rounds)
+    print(f'逐格扫描: {rounds / scan:.0f} 次/秒')
+    print(f'几何生成: {rounds / gen:.0f} 次/秒')
+    print(f'加速比: {scan / gen:.1f}x')
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        generate_legal_moves(board, True)
+    legal = time.perf_counter() - start
+    print(f'合法走法生成: {rounds / legal:.0f} 次/秒')
+
+    # 走法表在导入时生成，这里单独计时
+    start = time.perf_counter()
+    for _ in range(20):
+        build_move_tables()
+    print(f'走法表生成（导入时一次）: {(time.perf_counter() - start) / 20 * 1000:.2f} 毫秒')
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,417 @@
+"""联机对战服务器
+
+asyncio 的 TCP 服务器，一个进程同时进行上千盘对局，不需要 PyQt5。局面、
+走法是否合法、胜负（将死、困毙，以及 xiangqi_repetition 的长将、长捉、
+重复局面）和双方的棋钟都以服务器为准，客户端只把走法发过来。每盘棋只在
+内存里保存一个 Position，超时用事件循环的定时器判定，不为每盘棋开任务。
+
+协议是按行的文本，走法用 4 个字符的 ICCS 记法，时间单位为毫秒：
+
+    客户端 -> 服务器
+    play [基本秒数 [每步加秒]]     排队等对手，时限相同的先后两人配成一盘，先来的执红
+    move h2e2                      走棋
+    resign                         认输
+    quit                           断开
+
+    服务器 -> 客户端
+    wait                           正在等对手
+    start 对局号 red|black 基本时间 每步加时
+    move h2e2 红方剩余 黑方剩余     双方都会收到，走棋方以此确认走法
+    over red|black|draw 原因        原因为 将死、困毙、长将、长捉、一将一捉、
+                                   重复局面、超时、认输 或 断线
+    error 说明
+
+    python xiangqi_server.py serve --port 9527 --tc 600+5
+    python xiangqi_server.py bench --games 200    # 启动服务器并用随机走子压测
+
+界面用 python chinese_chess.py --server 主机:端口 连接。
+"""
+import argparse
+import asyncio
+import random
+import subprocess
+import sys
+import time
+
+from xiangqi_notation import move_to_iccs, iccs_to_move
+from xiangqi_position import Position, START_FEN, RED
+from xiangqi_repetition import PositionHistory, move_flags
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 9527
+DEFAULT_BASE = 600
+DEFAULT_INCREMENT = 5
+MAX_BASE = 3 * 3600
+SIDE_NAMES = ('red', 'black')
+
+
+def parse_time_control(text):
+    """'基本秒数+每步加秒' 转换为 (基本秒数, 每步加秒)"""
+    base, _, increment = text.partition('+')
+    return float(base), float(increment or 0)
+
+
+def has_legal_move(pos):
+    """走棋方是否还有合法走法，找到一步就返回"""
+    in_check = pos.in_check()
+    return any(pos.is_legal(move, in_check) for move in pos.generate_moves())
+
+
+class Player:
+    """一个连接；game 和 side 在配对后设置"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.game = None
+        self.side = None
+        self.queue = None  # 排队时为 (基本时间, 加秒)
+
+    def send(self, line):
+        if not self.writer.is_closing():
+            self.writer.write(line.encode() + b'\n')
+
+
+class Game:
+    """一盘对局，局面和棋钟以这里为准"""
+
+    def __init__(self, server, game_id, players, base, increment, turn_limit):
+        self.server = server
+        self.id = game_id
+        self.players = players  # [红方, 黑方]
+        self.base = base
+        self.increment = increment
+        self.turn_limit = turn_limit
+        self.position = Position.from_fen(START_FEN)
+        self.history = PositionHistory(self.position.key, RED)
+        self.moves = []
+        self.clocks = [float(base), float(base)]
+        self.loop = asyncio.get_running_loop()
+        self.turn_start = self.loop.time()
+        self.flag_timer = None
+        self.result = None
+
+    def start(self):
+        for side, player in enumerate(self.players):
+            player.game = self
+            player.side = side
+            player.send(f'start {self.id} {SIDE_NAMES[side]} '
+                        f'{int(self.base * 1000)} {int(self.increment * 1000)}')
+        self.schedule_flag()
+
+    def broadcast(self, line):
+        for player in self.players:
+            player.send(line)
+
+    def time_left(self):
+        """走棋方本步最多还能用的秒数"""
+        limit = self.clocks[self.position.side]
+        if self.turn_limit:
+            limit = min(limit, self.turn_limit)
+        return limit
+
+    def schedule_flag(self):
+        self.flag_timer = self.loop.call_later(self.time_left(), self.on_flag)
+
+    def on_flag(self):
+        self.flag_timer = None
+        if self.result is None:
+            self.finish(SIDE_NAMES[self.position.side ^ 1], '超时')
+
+    def play(self, side, text):
+        """side 一方走 text，成功时返回 None，否则返回错误说明"""
+        if self.result is not None:
+            return 'game over'
+        pos = self.position
+        if side != pos.side:
+            return 'not your turn'
+        try:
+            move = iccs_to_move(text)
+        except ValueError:
+            return 'bad move ' + text
+        from_sq = move >> 7
+        code = pos.squares[from_sq]
+        if (not code or code >> 3 != side or move not in pos.generate_piece_moves(from_sq)
+                or not pos.is_legal(move)):
+            return 'illegal ' + text
+        now = self.loop.time()
+        elapsed = now - self.turn_start
+        if elapsed >= self.time_left():
+            # 定时器还没来得及触发
+            self.on_flag()
+            return 'game over'
+        self.flag_timer.cancel()
+        self.clocks[side] += self.increment - elapsed
+        self.turn_start = now
+
+        check, chase = move_flags(pos, move)
+        pos.do_move(move)
+        self.history.push(pos.key, check, chase)
+        self.moves.append(move)
+        self.server.move_count += 1
+        self.broadcast(f'move {move_to_iccs(move)} '
+                       f'{int(self.clocks[0] * 1000)} {int(self.clocks[1] * 1000)}')
+
+        if not has_legal_move(pos):
+            self.finish(SIDE_NAMES[side], '将死' if pos.in_check() else '困毙')
+            return None
+        winner, reason = self.history.status()
+        if winner is not None:
+            self.finish(winner, reason)
+        else:
+            self.schedule_flag()
+        return None
+
+    def finish(self, winner, reason):
+        if self.result is not None:
+            return
+        self.result = (winner, reason)
+        if self.flag_timer is not None:
+            self.flag_timer.cancel()
+            self.flag_timer = None
+        self.broadcast(f'over {winner} {reason}')
+        for player in self.players:
+            player.game = None
+            player.side = None
+        self.server.games.pop(self.id, None)
+        self.server.finished_count += 1
+
+
+class GameServer:
+    """配对、转发走法；所有对局都在同一个事件循环里"""
+
+    def __init__(self, base=DEFAULT_BASE, increment=DEFAULT_INCREMENT, turn_limit=0):
+        self.base = base
+        self.increment = increment
+        self.turn_limit = turn_limit  # 单步用时上限（秒），和界面上的回合计时对应，0 为不限
+        self.games = {}
+        self.waiting = {}  # (基本时间, 加秒) -> 等待中的 Player
+        self.next_id = 1
+        self.move_count = 0
+        self.finished_count = 0
+
+    async def handle_connection(self, reader, writer):
+        player = Player(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not self.handle(player, line.decode('utf-8', 'replace').split()):
+                    break
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            # 对方断开，或者一行长得不像这个协议
+            pass
+        finally:
+            self.disconnect(player)
+            writer.close()
+
+    def handle(self, player, tokens):
+        """处理一行命令，收到 quit 时返回 False"""
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == 'move' and args:
+            if player.game is None:
+                player.send('error no game')
+            else:
+                error = player.game.play(player.side, args[0])
+                if error:
+                    player.send('error ' + error)
+        elif command == 'play':
+            self.enqueue(player, args)
+        elif command == 'resign':
+            if player.game is not None:
+                player.game.finish(SIDE_NAMES[player.side ^ 1], '认输')
+        elif command == 'quit':
+            return False
+        else:
+            player.send('error unknown command ' + command)
+        return True
+
+    def enqueue(self, player, args):
+        if player.game is not None:
+            player.send('error already playing')
+            return
+        # 每人只排一个队，换时限时先离开原来的队
+        self.leave_queue(player)
+        try:
+            base = float(args[0]) if args else self.base
+            increment = float(args[1]) if len(args) > 1 else (self.increment if not args else 0)
+        except ValueError:
+            player.send('error bad time control')
+            return
+        if not 0 < base <= MAX_BASE or not 0 <= increment <= MAX_BASE:
+            player.send('error bad time control')
+            return
+        key = (base, increment)
+        opponent = self.waiting.pop(key, None)
+        if opponent is not None and opponent.game is not None:
+            # 不该出现：已经在下棋的人还留在队里，丢掉
+            opponent.queue = None
+            opponent = None
+        if opponent is None:
+            self.waiting[key] = player
+            player.queue = key
+            player.send('wait')
+            return
+        opponent.queue = None
+        game = Game(self, self.next_id, [opponent, player], base, increment, self.turn_limit)
+        self.next_id += 1
+        self.games[game.id] = game
+        game.start()
+
+    def leave_queue(self, player):
+        if player.queue is not None and self.waiting.get(player.queue) is player:
+            del self.waiting[player.queue]
+        player.queue = None
+
+    def disconnect(self, player):
+        self.leave_queue(player)
+        if player.game is not None:
+            player.game.finish(SIDE_NAMES[player.side ^ 1], '断线')
+
+
+async def report(server, interval):
+    """每隔 interval 秒打印对局数和走子速度"""
+    last = server.move_count
+    while True:
+        await asyncio.sleep(interval)
+        print(f'进行中 {len(server.games)} 盘，已结束 {server.finished_count} 盘，'
+              f'{(server.move_count - last) / interval:.0f} 步/秒', flush=True)
+        last = server.move_count
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, base=DEFAULT_BASE,
+                increment=DEFAULT_INCREMENT, turn_limit=0, stats=0):
+    server = GameServer(base, increment, turn_limit)
+    tcp = await asyncio.start_server(server.handle_connection, host, port)
+    port = tcp.sockets[0].getsockname()[1]
+    # 压测脚本读这一行得到实际端口（--port 0 时由系统分配）
+    print(f'服务器已启动 {host}:{port}', flush=True)
+    if stats:
+        asyncio.get_running_loop().create_task(report(server, stats))
+    async with tcp:
+        await tcp.serve_forever()
+
+
+async def bot(host, port, plies, rng, latencies):
+    """随机走子的客户端：每步记录从发出走法到收到服务器确认的用时"""
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b'play\n')
+    pos = None
+    side = None
+    sent_at = None
+    played = 0
+
+    def send_move():
+        nonlocal sent_at
+        if played >= plies:
+            writer.write(b'resign\n')
+            return
+        moves = pos.generate_legal_moves()
+        if moves:
+            sent_at = time.perf_counter()
+            writer.write(b'move ' + move_to_iccs(rng.choice(moves)).encode() + b'\n')
+
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        tokens = line.decode('utf-8').split()
+        if tokens[0] == 'start':
+            side = SIDE_NAMES.index(tokens[2])
+            pos = Position.from_fen(START_FEN)
+            if side == pos.side:
+                send_move()
+        elif tokens[0] == 'move':
+            if pos.side == side:
+                latencies.append(time.perf_counter() - sent_at)
+            pos.do_move(iccs_to_move(tokens[1]))
+            played += 1
+            if pos.side == side:
+                send_move()
+        elif tokens[0] in ('over', 'error'):
+            break
+        await writer.drain()
+    writer.write(b'quit\n')
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except ConnectionError:
+        pass
+
+
+async def run_bots(host, port, games, plies, seed):
+    latencies = []
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    await asyncio.gather(*(bot(host, port, plies, random.Random(rng.random()), latencies)
+                           for _ in range(games * 2)))
+    return latencies, time.perf_counter() - start
+
+
+def benchmark(games=200, plies=60, host=DEFAULT_HOST, port=None, seed=1):
+    """games 盘随机对局同时进行，打印每秒走子数和走子确认延迟的分位数
+
+    不指定 port 时启动一个服务器子进程（端口由系统分配），压完后关掉。
+    每盘棋大约占两个文件描述符，盘数很多时注意系统的打开文件数上限。
+    """
+    process = None
+    if port is None:
+        process = subprocess.Popen([sys.executable, __file__, 'serve', '--host', host,
+                                    '--port', '0'], stdout=subprocess.PIPE, text=True)
+        port = int(process.stdout.readline().rsplit(':', 1)[1])
+    try:
+        latencies, elapsed = asyncio.run(run_bots(host, port, games, plies, seed))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    latencies.sort()
+    count = len(latencies)
+    if not count:
+        print('没有走出任何一步')
+        return
+
+    def percentile(p):
+        return latencies[min(count - 1, int(count * p))] * 1000
+
+    print(f'{games} 盘同时进行，共 {count} 步，{elapsed:.2f} 秒，{count / elapsed:.0f} 步/秒')
+    print(f'走子确认延迟: 中位数 {percentile(0.5):.2f} 毫秒，p99 {percentile(0.99):.2f} 毫秒，'
+          f'最长 {latencies[-1] * 1000:.2f} 毫秒')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='象棋联机对战服务器')
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve_parser = sub.add_parser('serve', help='启动服务器')
+    serve_parser.add_argument('--host', default=DEFAULT_HOST)
+    serve_parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='0 表示由系统分配')
+    serve_parser.add_argument('--tc', default=f'{DEFAULT_BASE}+{DEFAULT_INCREMENT}',
+                              help='客户端不指定时的时限：基本秒数+每步加秒')
+    serve_parser.add_argument('--turn-limit', type=float, default=0,
+                              help='单步用时上限（秒），0 为不限')
+    serve_parser.add_argument('--stats', type=float, default=0,
+                              help='每隔多少秒打印一次对局数和走子速度')
+    bench_parser = sub.add_parser('bench', help='随机走子压测')
+    bench_parser.add_argument('--games', type=int, default=200, help='同时进行的对局数')
+    bench_parser.add_argument('--plies', type=int, default=60, help='每盘最多走多少步')
+    bench_parser.add_argument('--host', default=DEFAULT_HOST)
+    bench_parser.add_argument('--port', type=int, default=None,
+                              help='连接已经在运行的服务器，不指定时自动启动一个')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        base, increment = parse_time_control(args.tc)
+        try:
+            asyncio.run(serve(args.host, args.port, base, increment, args.turn_limit, args.stats))
+        except KeyboardInterrupt:
+            pass
+    else:
+        benchmark(args.games, args.plies, args.host, args.port)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
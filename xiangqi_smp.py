@@ -0,0 +1,153 @@
+"""多进程并行搜索（Lazy SMP）
+
+几个工作进程同时从根局面开始搜索，通过共享内存里的同一张置换表互相借用结果。
+0 号进程是主搜索，按时间和深度限制结束，其余进程从不同深度开始迭代加深，
+主搜索结束后通知它们停下。工作进程常驻，多次搜索共用同一张置换表。
+
+    python xiangqi_smp.py --depth 6 --workers 1 2 4 8   # 比较不同进程数搜到指定深度的用时
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+
+from xiangqi_engine import Engine
+from xiangqi_position import Position, START_FEN
+from xiangqi_tt import TranspositionTable, table_bytes
+
+
+def _worker_main(index, shm_name, tasks, results, stop_event):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    tt = TranspositionTable(buffer=shm.buf)
+    engine = Engine(tt=tt)
+    engine.stop_event = stop_event
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            packed, max_depth, time_limit = task
+            pos = Position.unpack(packed)
+            if index == 0:
+                result = engine.search(pos, max_depth=max_depth, time_limit=time_limit)
+            else:
+                # 辅助进程没有时间限制，奇数号从深一层开始，由主进程通知停止
+                result = engine.search(pos, max_depth=max_depth, min_depth=1 + index % 2)
+            results.put((index, result))
+    finally:
+        tt.close()
+        shm.close()
+
+
+class LazySMP:
+    """常驻工作进程组，用法与 Engine.search 相同
+
+        with LazySMP(workers=8, hash_mb=64) as smp:
+            result = smp.search(pos, time_limit=5)
+    """
+
+    def __init__(self, workers=None, hash_mb=64):
+        self.workers = workers or os.cpu_count() or 1
+        self.shm = shared_memory.SharedMemory(create=True, size=table_bytes(hash_mb))
+        self.shm.buf[:] = bytes(self.shm.size)
+        context = multiprocessing.get_context()
+        self.stop_event = context.Event()
+        self.results = context.Queue()
+        self.task_queues = []
+        self.processes = []
+        for index in range(self.workers):
+            tasks = context.Queue()
+            process = context.Process(
+                target=_worker_main,
+                args=(index, self.shm.name, tasks, self.results, self.stop_event),
+                daemon=True)
+            process.start()
+            self.task_queues.append(tasks)
+            self.processes.append(process)
+
+    def search(self, pos, max_depth=64, time_limit=None):
+        """并行搜索，返回深度最深的结果；nodes、nps 为所有进程之和"""
+        start = time.perf_counter()
+        self.stop_event.clear()
+        packed = pos.pack()
+        for tasks in self.task_queues:
+            tasks.put((packed, max_depth, time_limit))
+
+        collected = {}
+        while 0 not in collected:
+            index, result = self.results.get()
+            collected[index] = result
+        # 主搜索结束，通知辅助进程停下并收齐结果，保证下一次搜索开始时队列为空
+        self.stop_event.set()
+        while len(collected) < self.workers:
+            index, result = self.results.get()
+            collected[index] = result
+        elapsed = time.perf_counter() - start
+
+        best = collected[0]
+        for index in sorted(collected):
+            result = collected[index]
+            if result['depth'] > best['depth'] and result['move']:
+                best = result
+        best = dict(best)
+        best['nodes'] = sum(result['nodes'] for result in collected.values())
+        best['time'] = elapsed
+        best['nps'] = int(best['nodes'] / elapsed) if elapsed > 0 else 0
+        best['workers'] = self.workers
+        return best
+
+    def close(self):
+        for tasks in self.task_queues:
+            tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+BENCH_FENS = [
+    START_FEN,
+    'r1ba1a3/4kn3/2n1b4/pNp1p1p1p/4c4/6P2/P1P2R2P/1CcC5/9/2BAKAB2 w - - 0 1',
+    '1cbak4/9/n2a5/2p1p3p/5cp2/2n2N3/6PCP/3AB4/2C6/3A1K1N1 w - - 0 1',
+]
+
+
+def benchmark(depth, worker_counts, hash_mb, fens=BENCH_FENS):
+    """各进程数下搜到 depth 的总用时，以及相对单进程的加速比"""
+    baseline = None
+    for workers in worker_counts:
+        total = 0.0
+        nodes = 0
+        with LazySMP(workers=workers, hash_mb=hash_mb) as smp:
+            for fen in fens:
+                # 每个局面前清空置换表，避免上一个局面的结果影响计时
+                smp.shm.buf[:] = bytes(smp.shm.size)
+                result = smp.search(Position.from_fen(fen), max_depth=depth)
+                total += result['time']
+                nodes += result['nodes']
+        if baseline is None:
+            baseline = total
+        print(f'{workers:3d} 进程: 到达深度 {depth} 共 {total:7.2f} 秒  '
+              f'加速比 {baseline / total:5.2f}x  {nodes / total:9.0f} 节点/秒')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Lazy SMP 并行搜索基准测试')
+    parser.add_argument('--depth', type=int, default=5)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--hash', type=int, default=64, help='共享置换表大小（MB）')
+    args = parser.parse_args(argv)
+    benchmark(args.depth, args.workers, args.hash)
+
+
+if __name__ == '__main__':
+    main()
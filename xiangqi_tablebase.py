@@ -0,0 +1,523 @@
+"""残局库：用逆推分析生成小子力残局的杀棋步数表
+
+子力用 FEN 字母表示，红方大写在前、黑方小写在后，帅将必须有，例如
+KRkaa（车对双士）、KNPk（马兵对单将）。每种子力一个文件，记录红方走
+和黑方走两张表，每个局面一个字节：
+
+    0          和棋（包括长将等循环，残局库不判长将）
+    奇数 n     走棋方 n 步（半回合）内杀棋
+    偶数 n     走棋方 n - 2 步后被杀，2 表示已经被将死或困毙
+
+局面下标按每个棋子能到的格子混合进制编号，帅将只在九宫、仕象只在
+规定的格子、兵不会出现在没过河时走不到的格子，所以查表只需要扫一遍
+棋盘算出下标再读一个字节。文件用 mmap 打开，只读用到的页。
+
+生成过程：先递归生成吃掉一个子以后的子残局，再用多进程扫描全部局面，
+统计每个局面留在本表内的走法数，吃子走法直接查子残局；然后从被将死的
+局面开始一层层倒推：对方被杀的局面的上一步是赢棋，所有走法都通向对方
+赢棋的局面是输棋。倒推时“上一步”同样用多进程并行计算。
+
+走法与 xiangqi_position 一致，后者与 xiangqi_rules 的 is_valid_*_move 规则
+由 xiangqi_perft.py --suite 互相印证。
+
+    python xiangqi_tablebase.py generate KRkaa KNPk --processes 4
+    python xiangqi_tablebase.py probe --fen "3k5/4a4/3a5/9/9/9/9/9/4R4/4K4 w - - 0 1"
+    python xiangqi_tablebase.py bench KRkaa
+"""
+import argparse
+import mmap
+import os
+import random
+import sys
+import time
+from array import array
+from multiprocessing import Pool
+
+import xiangqi_rules
+from xiangqi_position import (Position, FEN_TO_CODE, CODE_TO_FEN, RAYS, ROW, COL,
+                              RED, BLACK, CHARIOT, HORSE, ELEPHANT, ADVISOR, GENERAL,
+                              CANNON, PAWN, make_move)
+
+MAGIC = b'XQTB0001'
+HEADER_SIZE = len(MAGIC)
+EXTENSION = '.xtb'
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tablebases')
+
+WIN, DRAW, LOSS = 1, 0, -1
+MAX_DTM = 253
+INVALID = 255  # 生成过程中标记不可能出现的局面，写文件时存成 0
+
+# 名称中棋子的排列顺序
+_LETTER_ORDER = 'KRNCBAP'
+
+
+def _allowed_squares(code):
+    """code 棋子在合法局面里可能出现的格子（红方坐标，黑方上下翻转）"""
+    kind = code & 7
+    if kind == GENERAL:
+        cells = [(r, c) for r in (7, 8, 9) for c in (3, 4, 5)]
+    elif kind == ADVISOR:
+        cells = [(9, 3), (9, 5), (8, 4), (7, 3), (7, 5)]
+    elif kind == ELEPHANT:
+        cells = [(9, 2), (9, 6), (7, 0), (7, 4), (7, 8), (5, 2), (5, 6)]
+    elif kind == PAWN:
+        cells = ([(r, c) for r in range(5) for c in range(9)]
+                 + [(r, c) for r in (5, 6) for c in range(0, 9, 2)])
+    else:
+        cells = [(r, c) for r in range(10) for c in range(9)]
+    if code & BLACK:
+        cells = [(9 - r, c) for r, c in cells]
+    return tuple(sorted(r * 9 + c for r, c in cells))
+
+
+# 倒推时可能的出发格（不考虑阻挡，最后用正向走法核对）
+_UNMOVE_CANDIDATES = {}
+for _kind, _steps in ((HORSE, [(dr, dc) for dr, dc, _, _ in xiangqi_rules.HORSE_STEPS]),
+                      (ELEPHANT, [(2 * dr, 2 * dc) for dr, dc in xiangqi_rules.DIAGONAL]),
+                      (ADVISOR, xiangqi_rules.DIAGONAL),
+                      (GENERAL, xiangqi_rules.ORTHOGONAL),
+                      (PAWN, xiangqi_rules.ORTHOGONAL)):
+    _UNMOVE_CANDIDATES[_kind] = tuple(
+        tuple((ROW[sq] + dr) * 9 + COL[sq] + dc for dr, dc in _steps
+              if 0 <= ROW[sq] + dr < 10 and 0 <= COL[sq] + dc < 9)
+        for sq in range(90))
+_UNMOVE_CANDIDATES[CHARIOT] = _UNMOVE_CANDIDATES[CANNON] = tuple(
+    tuple(to for ray in RAYS[sq] for to in ray) for sq in range(90))
+
+
+def normalize_name(name):
+    """整理成标准写法：红方在前、黑方在后，各自按 KRNCBAP 排序"""
+    codes = [FEN_TO_CODE.get(letter) for letter in name]
+    if None in codes:
+        raise ValueError('子力名称有误: %r' % name)
+    letters = [CODE_TO_FEN[code] for code in codes]
+    red = sorted((letter for letter in letters if letter.isupper()), key=_LETTER_ORDER.index)
+    black = sorted((letter.upper() for letter in letters if letter.islower()),
+                   key=_LETTER_ORDER.index)
+    if red.count('K') != 1 or black.count('K') != 1:
+        raise ValueError('双方都必须有且只有一个帅/将: %r' % name)
+    return ''.join(red) + ''.join(black).lower()
+
+
+def mirror_name(name):
+    """红黑互换后的子力名称"""
+    return normalize_name(name.swapcase())
+
+
+def material_name(squares):
+    """按棋盘上的棋子得出标准子力名称"""
+    return normalize_name(''.join(CODE_TO_FEN[code] for code in squares if code))
+
+
+def mirror_squares(squares):
+    """上下翻转并交换红黑"""
+    mirrored = bytearray(90)
+    for sq, code in enumerate(squares):
+        if code:
+            mirrored[(9 - ROW[sq]) * 9 + COL[sq]] = code ^ BLACK
+    return mirrored
+
+
+def encode_value(wdl, dtm):
+    if wdl == DRAW:
+        return 0
+    value = dtm if wdl == WIN else dtm + 2
+    if value > MAX_DTM:
+        raise ValueError('杀棋步数 %d 超出一个字节' % dtm)
+    return value
+
+
+def decode_value(value):
+    """表中字节转换为 (胜负, 步数)"""
+    if not value:
+        return DRAW, 0
+    if value & 1:
+        return WIN, value
+    return LOSS, value - 2
+
+
+class Material:
+    """一种子力组合以及局面与下标之间的换算"""
+
+    def __init__(self, name):
+        self.name = normalize_name(name)
+        self.codes = [FEN_TO_CODE[letter] for letter in self.name]
+        self.squares = [_allowed_squares(code) for code in self.codes]
+        # slot_of[j][sq]：第 j 个棋子在 sq 时这一位的数字，不能到的格子为 -1
+        self.slot_of = []
+        for allowed in self.squares:
+            slots = [-1] * 90
+            for digit, sq in enumerate(allowed):
+                slots[sq] = digit
+            self.slot_of.append(slots)
+        self.strides = [0] * len(self.codes)
+        stride = 1
+        for j in reversed(range(len(self.codes))):
+            self.strides[j] = stride
+            stride *= len(self.squares[j])
+        self.size = stride  # 每一方走棋的局面数
+        self._slots_by_code = {}
+        for j, code in enumerate(self.codes):
+            self._slots_by_code.setdefault(code, []).append(j)
+
+    def sub_materials(self):
+        """吃掉一个子以后的子残局名称"""
+        names = []
+        for j, letter in enumerate(self.name):
+            if letter not in 'Kk':
+                name = normalize_name(self.name[:j] + self.name[j + 1:])
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def index(self, squares):
+        """局面的下标，棋子不在允许的格子上时返回 -1；同种棋子按格子顺序分配"""
+        used = {}
+        index = 0
+        for sq, code in enumerate(squares):
+            if not code:
+                continue
+            slots = self._slots_by_code.get(code)
+            count = used.get(code, 0)
+            if slots is None or count >= len(slots):
+                return -1
+            j = slots[count]
+            used[code] = count + 1
+            digit = self.slot_of[j][sq]
+            if digit < 0:
+                return -1
+            index += digit * self.strides[j]
+        return index
+
+    def placement(self, index):
+        """下标对应的每个棋子所在格子，两个棋子重叠时返回 None"""
+        placement = [0] * len(self.codes)
+        seen = set()
+        for j in reversed(range(len(self.codes))):
+            index, digit = divmod(index, len(self.squares[j]))
+            sq = self.squares[j][digit]
+            if sq in seen:
+                return None
+            seen.add(sq)
+            placement[j] = sq
+        return placement
+
+    def board(self, placement):
+        squares = bytearray(90)
+        for code, sq in zip(self.codes, placement):
+            squares[sq] = code
+        return squares
+
+
+def table_path(name, directory=DEFAULT_DIR):
+    return os.path.join(directory, name + EXTENSION)
+
+
+def _find_table(name, directory):
+    """返回 (文件名对应的子力, 是否需要红黑互换)，两种写法都没有时返回 None"""
+    for candidate, mirrored in ((name, False), (mirror_name(name), True)):
+        if os.path.exists(table_path(candidate, directory)):
+            return candidate, mirrored
+    return None
+
+
+class Tablebase:
+    """目录下所有残局表的查询接口，表文件按需用 mmap 打开"""
+
+    def __init__(self, directory=DEFAULT_DIR):
+        self.directory = directory
+        self._tables = {}  # 子力名称 -> (Material, mmap, 是否红黑互换)，不在库中为 None
+        self._files = []
+        # 库中最多的棋子数，子多的局面不用算子力名称就能跳过
+        self.max_pieces = max((len(name) - len(EXTENSION) for name in os.listdir(directory)
+                               if name.endswith(EXTENSION)), default=0)
+
+    def _table(self, name):
+        if name in self._tables:
+            return self._tables[name]
+        table = None
+        found = _find_table(name, self.directory)
+        if found:
+            file_name, mirrored = found
+            material = Material(file_name)
+            f = open(table_path(file_name, self.directory), 'rb')
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if data[:HEADER_SIZE] != MAGIC or len(data) != HEADER_SIZE + 2 * material.size:
+                data.close()
+                f.close()
+                raise ValueError('残局表文件损坏: %s' % table_path(file_name, self.directory))
+            self._files.append((f, data))
+            table = (material, data, mirrored)
+        self._tables[name] = table
+        return table
+
+    def probe(self, pos):
+        """返回走棋方视角的 (胜负, 步数)，子力不在库中时返回 None"""
+        squares = pos.squares
+        if 90 - squares.count(0) > self.max_pieces:
+            return None
+        table = self._table(material_name(squares))
+        if table is None:
+            return None
+        material, data, mirrored = table
+        side = pos.side
+        if mirrored:
+            squares = mirror_squares(squares)
+            side ^= 1
+        index = material.index(squares)
+        if index < 0:
+            return None
+        return decode_value(data[HEADER_SIZE + side * material.size + index])
+
+    def close(self):
+        for f, data in self._files:
+            data.close()
+            f.close()
+        self._files = []
+        self._tables = {}
+        self.max_pieces = 0
+
+
+def open_tablebase(directory=DEFAULT_DIR):
+    """目录不存在时返回 None"""
+    if not os.path.isdir(directory):
+        return None
+    return Tablebase(directory)
+
+
+# ---- 生成 ----
+
+_material = None
+_tablebase = None
+
+
+def _init_worker(name, directory):
+    global _material, _tablebase
+    _material = Material(name)
+    _tablebase = Tablebase(directory)
+
+
+def _scan_chunk(bounds):
+    """扫描 [start, stop) 的局面，返回每个局面的初始信息
+
+    counts：留在本表内的走法数加上吃子后成和的走法数，倒推时每遇到一个
+    对方赢棋的后继减一，减到 0 就是输棋；wins：吃子后对方被杀得出的最快
+    赢棋步数；floors：吃子后对方赢棋得出的最慢输棋步数。
+    """
+    start, stop = bounds
+    material = _material
+    size = material.size
+    count = stop - start
+    invalid = bytearray(count)
+    counts = array('H', bytes(2 * count))
+    wins = bytearray(count)
+    floors = bytearray(count)
+    for offset in range(count):
+        side, index = divmod(start + offset, size)
+        placement = material.placement(index)
+        if placement is None:
+            invalid[offset] = 1
+            continue
+        pos = Position(material.board(placement), side)
+        if pos.in_check(side ^ 1):
+            invalid[offset] = 1  # 轮到对方走时己方帅/将已经被照着
+            continue
+        moves_left = 0
+        best_win = 0
+        floor = 0
+        squares = pos.squares
+        for move in pos.generate_legal_moves():
+            if not squares[move & 127]:
+                moves_left += 1
+                continue
+            captured = pos.do_move(move)
+            wdl, dtm = _tablebase.probe(pos)
+            pos.undo_move(move, captured)
+            if wdl == LOSS:
+                if not best_win or dtm + 1 < best_win:
+                    best_win = dtm + 1
+            elif wdl == WIN:
+                floor = max(floor, dtm + 1)
+            else:
+                moves_left += 1  # 吃子成和，永远不会减到 0
+        counts[offset] = moves_left
+        wins[offset] = best_win
+        floors[offset] = floor
+    return start, invalid, counts, wins, floors
+
+
+def _predecessors(chunk):
+    """chunk 中每个局面的上一步局面下标（只算不吃子的走法，可以重复）"""
+    material = _material
+    size = material.size
+    result = []
+    for position_index in chunk:
+        side, index = divmod(position_index, size)
+        mover = side ^ 1
+        placement = material.placement(index)
+        pos = Position(material.board(placement), mover)
+        squares = pos.squares
+        base = mover * size
+        for j, code in enumerate(material.codes):
+            if code >> 3 != mover:
+                continue
+            sq = placement[j]
+            slots = material.slot_of[j]
+            digit = slots[sq]
+            for origin in _UNMOVE_CANDIDATES[code & 7][sq]:
+                if squares[origin] or slots[origin] < 0:
+                    continue
+                squares[sq] = 0
+                squares[origin] = code
+                ok = make_move(origin, sq) in pos.generate_piece_moves(origin)
+                squares[origin] = 0
+                squares[sq] = code
+                if ok:
+                    result.append(base + index + (slots[origin] - digit) * material.strides[j])
+    return result
+
+
+def _run(pool, func, items):
+    if pool is None:
+        return map(func, items)
+    return pool.imap_unordered(func, items)
+
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def generate(name, directory=DEFAULT_DIR, processes=None, verbose=True):
+    """生成 name 的残局表（连同缺少的子残局），已经存在时直接返回"""
+    material = Material(name)
+    os.makedirs(directory, exist_ok=True)
+    for sub in material.sub_materials():
+        generate(sub, directory, processes, verbose)
+    if _find_table(material.name, directory):
+        return
+
+    start_time = time.perf_counter()
+    total = 2 * material.size
+    processes = processes or os.cpu_count() or 1
+    if processes > 1:
+        pool = Pool(processes, initializer=_init_worker, initargs=(material.name, directory))
+    else:
+        pool = None
+        _init_worker(material.name, directory)
+    try:
+        invalid = bytearray(total)
+        counts = array('H', bytes(2 * total))
+        wins = bytearray(total)
+        floors = bytearray(total)
+        step = max(1000, total // (processes * 16))
+        bounds = [(begin, min(begin + step, total)) for begin in range(0, total, step)]
+        for begin, part_invalid, part_counts, part_wins, part_floors in _run(
+                pool, _scan_chunk, bounds):
+            end = begin + len(part_invalid)
+            invalid[begin:end] = part_invalid
+            counts[begin:end] = part_counts
+            wins[begin:end] = part_wins
+            floors[begin:end] = part_floors
+
+        # 按杀棋步数分层，奇数层是赢棋、偶数层是输棋
+        state = bytearray(total)
+        buckets = {}
+        for position_index in range(total):
+            if invalid[position_index]:
+                state[position_index] = INVALID
+            elif wins[position_index]:
+                buckets.setdefault(wins[position_index], []).append(position_index)
+            elif not counts[position_index]:
+                buckets.setdefault(floors[position_index], []).append(position_index)
+
+        resolved = 0
+        while buckets:
+            level = min(buckets)
+            frontier = []
+            value = encode_value(WIN if level & 1 else LOSS, level)
+            for position_index in buckets.pop(level):
+                if not state[position_index]:
+                    state[position_index] = value
+                    frontier.append(position_index)
+            resolved += len(frontier)
+            for previous in _run(pool, _predecessors, _chunks(frontier, 2000)):
+                for q in previous:
+                    if state[q]:
+                        continue
+                    if not level & 1:
+                        buckets.setdefault(level + 1, []).append(q)
+                    else:
+                        counts[q] -= 1
+                        if not counts[q] and not wins[q]:
+                            buckets.setdefault(max(level + 1, floors[q]), []).append(q)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    for position_index in range(total):
+        if state[position_index] == INVALID:
+            state[position_index] = 0
+    path = table_path(material.name, directory)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(MAGIC)
+        f.write(state)
+    os.replace(path + '.tmp', path)
+    if verbose:
+        print(f'{material.name}: {total} 个局面，{total - invalid.count(1)} 个合法，'
+              f'{resolved} 个分出胜负，{time.perf_counter() - start_time:.1f} 秒')
+
+
+def benchmark(name, directory=DEFAULT_DIR, rounds=100000):
+    """随机局面的查询速度"""
+    material = Material(name)
+    tablebase = Tablebase(directory)
+    rng = random.Random(1)
+    positions = []
+    while len(positions) < 1000:
+        placement = material.placement(rng.randrange(material.size))
+        if placement is not None:
+            positions.append(Position(material.board(placement), rng.randrange(2)))
+    start = time.perf_counter()
+    for i in range(rounds):
+        tablebase.probe(positions[i % len(positions)])
+    elapsed = time.perf_counter() - start
+    print(f'{material.name}: {rounds} 次查询，平均 {elapsed / rounds * 1e6:.2f} 微秒/次')
+    tablebase.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='象棋残局库')
+    parser.add_argument('--dir', default=DEFAULT_DIR, help='残局表所在目录')
+    sub = parser.add_subparsers(dest='command', required=True)
+    generate_parser = sub.add_parser('generate', help='生成残局表')
+    generate_parser.add_argument('names', nargs='+', help='子力，如 KRkaa')
+    generate_parser.add_argument('--processes', type=int, default=None)
+    probe_parser = sub.add_parser('probe', help='查询局面')
+    probe_parser.add_argument('--fen', required=True)
+    bench_parser = sub.add_parser('bench', help='查询速度测试')
+    bench_parser.add_argument('name')
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        for name in args.names:
+            generate(name, args.dir, args.processes)
+    elif args.command == 'probe':
+        result = Tablebase(args.dir).probe(Position.from_fen(args.fen))
+        if result is None:
+            print('不在库中')
+            return 1
+        wdl, dtm = result
+        if wdl == WIN:
+            print(f'走棋方 {dtm} 步杀')
+        elif wdl == LOSS:
+            print(f'走棋方 {dtm} 步后被杀')
+        else:
+            print('和棋')
+    else:
+        benchmark(args.name, args.dir)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""置换表
+
+固定大小，按局面 Zobrist 键取模定位到桶，每个桶两个表项：
+第 0 项深度优先（深度更深或来自旧搜索时才替换），第 1 项总是替换。
+每个表项占两个 64 位整数，整张表是一块连续内存，可以放在 bytearray
+或共享内存里。第一个整数存 键 ^ 数据，读的时候再异或回来校验，
+多个进程同时写同一表项也不会读到拼错的数据。
+
+数据字段（低位到高位）：走法 16 位、分数 16 位（加偏移存成无符号）、
+深度 8 位、边界类型 2 位、搜索代数 8 位。
+"""
+import time
+
+EXACT, LOWER, UPPER = 1, 2, 3
+
+ENTRY_WORDS = 2
+BUCKET_WORDS = 2 * ENTRY_WORDS
+BUCKET_BYTES = BUCKET_WORDS * 8
+
+
+def table_bytes(size_mb):
+    """size_mb 兆字节内能放下的最大 2 的幂个桶所占的字节数"""
+    buckets = 1
+    while buckets * 2 * BUCKET_BYTES <= size_mb * 1024 * 1024:
+        buckets *= 2
+    return buckets * BUCKET_BYTES
+
+
+def _pack(move, score, depth, flag, generation):
+    return (move | ((score + 32768) << 16) | (depth << 32)
+            | (flag << 40) | (generation << 42))
+
+
+class TranspositionTable:
+    def __init__(self, size_mb=16, buffer=None):
+        """buffer 可以传入共享内存，不传时按 size_mb 新建"""
+        if buffer is None:
+            buffer = bytearray(table_bytes(size_mb))
+        self.buffer = buffer
+        self._view = memoryview(buffer)
+        self.words = self._view.cast('Q')
+        # 共享内存可能按页向上取整，桶数取不超过容量的最大 2 的幂
+        buckets = 1
+        while buckets * 2 * BUCKET_WORDS <= len(self.words):
+            buckets *= 2
+        self.bucket_mask = buckets - 1
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    @property
+    def size_mb(self):
+        return (self.bucket_mask + 1) * BUCKET_BYTES / (1024 * 1024)
+
+    def close(self):
+        """释放对 buffer 的引用，关闭共享内存前必须调用"""
+        self.words.release()
+        self._view.release()
+
+    def clear(self):
+        self._view[:] = bytes(len(self._view))
+        self.generation = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    def new_search(self):
+        """开始新一轮搜索，旧代的深度优先表项可以被替换"""
+        self.generation = (self.generation + 1) & 255
+
+    def probe(self, key):
+        """返回 (走法, 分数, 深度, 边界类型)，没命中返回 None"""
+        self.probes += 1
+        words = self.words
+        index = (key & self.bucket_mask) * BUCKET_WORDS
+        for slot in (index, index + ENTRY_WORDS):
+            data = words[slot + 1]
+            if data and words[slot] ^ data == key:
+                self.hits += 1
+                return (data & 0xFFFF, ((data >> 16) & 0xFFFF) - 32768,
+                        (data >> 32) & 0xFF, (data >> 40) & 3)
+        return None
+
+    def store(self, key, depth, flag, score, move):
+        self.stores += 1
+        words = self.words
+        index = (key & self.bucket_mask) * BUCKET_WORDS
+        generation = self.generation
+        data = _pack(move, score, max(0, min(depth, 255)), flag, generation)
+
+        old = words[index + 1]
+        old_key = words[index] ^ old
+        if (not old or old_key == key or ((old >> 42) & 255) != generation
+                or depth >= (old >> 32) & 0xFF):
+            # 同一局面没有新走法时保留原来的最佳走法
+            if old_key == key and not move:
+                data |= old & 0xFFFF
+            words[index] = key ^ data
+            words[index + 1] = data
+        else:
+            slot = index + ENTRY_WORDS
+            if not move and words[slot] ^ words[slot + 1] == key:
+                data |= words[slot + 1] & 0xFFFF
+            words[slot] = key ^ data
+            words[slot + 1] = data
+
+    def hit_rate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+    def hashfull(self):
+        """抽样统计当前代表项的占用率（千分比）"""
+        words = self.words
+        buckets = min(500, self.bucket_mask + 1)
+        used = 0
+        for bucket in range(buckets):
+            for slot in (bucket * BUCKET_WORDS, bucket * BUCKET_WORDS + ENTRY_WORDS):
+                data = words[slot + 1]
+                if data and ((data >> 42) & 255) == self.generation:
+                    used += 1
+        return used * 1000 // (buckets * 2)
+
+
+def benchmark(depth=5, sizes=(0.25, 1, 4, 16)):
+    """不同大小的置换表搜同一深度，比较节点数、命中率和用时"""
+    from xiangqi_engine import Engine
+    from xiangqi_position import Position
+
+    result = Engine(hash_mb=0).search(Position.initial(), max_depth=depth)
+    print(f"无置换表: 节点 {result['nodes']:8d}  {result['time']:.2f} 秒")
+    for size in sizes:
+        engine = Engine(hash_mb=size)
+        start = time.perf_counter()
+        result = engine.search(Position.initial(), max_depth=depth)
+        elapsed = time.perf_counter() - start
+        print(f"{engine.tt.size_mb:6.2f} MB: 节点 {result['nodes']:8d}  "
+              f"命中率 {engine.tt.hit_rate():.1%}  {elapsed:.2f} 秒")
+
+
+if __name__ == '__main__':
+    benchmark()
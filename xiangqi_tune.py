@@ -0,0 +1,246 @@
+"""估值表自动调参（Texel 方法）
+
+用带胜负标签的局面拟合 xiangqi_eval 的子力分和位置分表：把估值 s 经过
+1 / (1 + 10 ** (-K * s / 400)) 换算成红方得分的预测值，最小化与实际结果
+的均方误差。整批局面用 NumPy 向量化估值和求梯度，参数用 Adam 更新。
+
+数据集是定长二进制记录，每条 91 字节：90 字节棋子编码加 1 字节结果
+（0 黑胜、1 和、2 红胜）。训练时按块从磁盘读取，内存占用与数据集大小无关。
+
+    python xiangqi_tune.py extract 棋谱目录 -o data.bin --skip 10   # 从棋谱提取局面
+    python xiangqi_tune.py pack positions.txt -o data.bin           # 每行 "FEN 结果"
+    python xiangqi_tune.py tune data.bin -o xiangqi_eval.json --epochs 20
+
+结果写成 xiangqi_eval 读取的 JSON 格式，放在程序旁边就会在导入时生效。
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+import xiangqi_eval
+from xiangqi_book import game_files
+from xiangqi_notation import load_games
+from xiangqi_position import Position, FEN_TO_CODE, BLACK, EVAL_PHASE
+
+RECORD_SIZE = 91
+PIECE_LETTERS = xiangqi_eval.PIECE_LETTERS
+RESULT_LABELS = {'1-0': 2, '0-1': 0, '1/2-1/2': 1,
+                 '1': 2, '0': 0, '0.5': 1, '1.0': 2, '0.0': 0}
+
+# 每种棋子在 16 * 90 的展开表中红方、黑方对应的下标
+_RED_INDEX = np.array([[FEN_TO_CODE[letter] * 90 + sq for sq in range(90)]
+                       for letter in PIECE_LETTERS])
+_BLACK_INDEX = np.array([[(FEN_TO_CODE[letter] | BLACK) * 90 + (9 - sq // 9) * 9 + sq % 9
+                          for sq in range(90)] for letter in PIECE_LETTERS])
+_SQUARES = np.arange(90)
+
+
+def _record(pos, label):
+    return bytes(pos.squares) + bytes((label,))
+
+
+def extract(paths, output, skip=10):
+    """从棋谱中提取有结果的对局里、没有被将军的局面"""
+    count = 0
+    with open(output, 'wb') as f:
+        for path in game_files(paths):
+            for game in load_games(path):
+                label = RESULT_LABELS.get(game['tags'].get('Result'))
+                if label is None:
+                    continue
+                pos = Position.from_fen(game['fen'])
+                for ply, move in enumerate(game['moves']):
+                    if ply >= skip and not pos.in_check():
+                        f.write(_record(pos, label))
+                        count += 1
+                    pos.do_move(move)
+    print(f'写入 {count} 个局面到 {output}')
+
+
+def pack(path, output):
+    """把每行 "FEN 结果" 的文本数据集转换为二进制记录"""
+    count = 0
+    with open(path, encoding='utf-8') as source, open(output, 'wb') as f:
+        for line in source:
+            fields = line.replace('[', ' ').replace(']', ' ').replace(';', ' ').split()
+            if not fields:
+                continue
+            label = RESULT_LABELS.get(fields[-1].strip('"'))
+            if label is None:
+                raise ValueError('无法识别的结果: %r' % line)
+            f.write(_record(Position.from_fen(' '.join(fields[:2])), label))
+            count += 1
+    print(f'写入 {count} 个局面到 {output}')
+
+
+def read_chunks(path, chunk_size):
+    """按块读取数据集，返回 (棋子编码 (n, 90), 红方得分 (n,))"""
+    with open(path, 'rb') as f:
+        while True:
+            data = np.fromfile(f, dtype=np.uint8, count=chunk_size * RECORD_SIZE)
+            if not data.size:
+                break
+            records = data.reshape(-1, RECORD_SIZE)
+            yield records[:, :90], records[:, 90] / 2.0
+
+
+class Model:
+    """可微的估值：material (7, 2) 为 [中局, 残局] 子力分，pst (7, 2, 90) 为位置分"""
+
+    def __init__(self, tables):
+        self.phase_table = tables['phase']
+        self.material = np.array([tables['material'][letter] for letter in PIECE_LETTERS],
+                                 dtype=np.float64)
+        self.pst = np.array([[np.ravel(tables[stage][letter]) for stage in ('mg', 'eg')]
+                             for letter in PIECE_LETTERS], dtype=np.float64)
+        self.phase_weights = np.array(EVAL_PHASE, dtype=np.float64)
+        self.max_phase = xiangqi_eval.MAX_PHASE
+        # 帅将双方都有，子力分固定为 0
+        self.trainable_material = np.array([letter != 'K' for letter in PIECE_LETTERS])
+
+    def flat_tables(self):
+        """展开成 (2, 16 * 90) 的表，与 xiangqi_position.EVAL 的排列相同"""
+        values = self.material[:, :, None] + self.pst  # (7, 2, 90)
+        flat = np.zeros((2, 16 * 90))
+        for stage in range(2):
+            flat[stage, _RED_INDEX] = values[:, stage]
+            flat[stage, _BLACK_INDEX] = -values[:, stage]
+        return flat
+
+    def evaluate(self, codes):
+        """红方视角的估值，返回 (分数, 索引, 中局比例)"""
+        index = codes.astype(np.int64) * 90 + _SQUARES
+        flat = self.flat_tables()
+        mg = flat[0][index].sum(axis=1)
+        eg = flat[1][index].sum(axis=1)
+        phase = np.minimum(self.phase_weights[codes].sum(axis=1), self.max_phase)
+        ratio = phase / self.max_phase
+        return mg * ratio + eg * (1 - ratio), index, ratio
+
+    def gradient(self, codes, results, k):
+        """返回 (损失, 子力分梯度, 位置分梯度)"""
+        score, index, ratio = self.evaluate(codes)
+        predicted = 1 / (1 + 10 ** (-k * score / 400))
+        error = predicted - results
+        loss = float(np.mean(error ** 2))
+        slope = (2 * error * predicted * (1 - predicted) * k * math.log(10) / 400
+                 / len(results))
+        flat_grad = np.empty((2, 16 * 90))
+        for stage, weight in ((0, ratio), (1, 1 - ratio)):
+            flat_grad[stage] = np.bincount(
+                index.ravel(), weights=np.repeat(slope * weight, 90), minlength=16 * 90)
+        pst_grad = np.stack([flat_grad[:, _RED_INDEX[i]] - flat_grad[:, _BLACK_INDEX[i]]
+                             for i in range(len(PIECE_LETTERS))])  # (7, 2, 90)
+        material_grad = pst_grad.sum(axis=2) * self.trainable_material[:, None]
+        return loss, material_grad, pst_grad
+
+    def loss(self, path, k, chunk_size=65536):
+        total = 0.0
+        count = 0
+        for codes, results in read_chunks(path, chunk_size):
+            score = self.evaluate(codes)[0]
+            predicted = 1 / (1 + 10 ** (-k * score / 400))
+            total += float(np.sum((predicted - results) ** 2))
+            count += len(results)
+        return total / count if count else 0.0
+
+    def to_tables(self):
+        """转换为 xiangqi_eval 的 JSON 表格式，分数取整"""
+        tables = {'material': {}, 'phase': dict(self.phase_table), 'mg': {}, 'eg': {}}
+        for i, letter in enumerate(PIECE_LETTERS):
+            tables['material'][letter] = [int(round(v)) for v in self.material[i]]
+            for stage, name in enumerate(('mg', 'eg')):
+                values = np.rint(self.pst[i, stage]).astype(int).reshape(10, 9)
+                tables[name][letter] = values.tolist()
+        return tables
+
+
+def fit_k(model, path, sample=200000):
+    """在数据集开头的一部分上用三分法找使误差最小的 K"""
+    codes, results = next(read_chunks(path, sample))
+    score = model.evaluate(codes)[0]
+
+    def loss(k):
+        predicted = 1 / (1 + 10 ** (-k * score / 400))
+        return float(np.mean((predicted - results) ** 2))
+
+    low, high = 0.1, 4.0
+    for _ in range(40):
+        a = low + (high - low) / 3
+        b = high - (high - low) / 3
+        if loss(a) < loss(b):
+            high = b
+        else:
+            low = a
+    return (low + high) / 2
+
+
+def tune(path, output, epochs=10, batch=16384, rate=1.0, k=None, shuffle_batches=16, seed=1):
+    size = os.path.getsize(path)
+    if size % RECORD_SIZE:
+        raise ValueError('数据集大小不是 %d 字节的整数倍: %s' % (RECORD_SIZE, path))
+    model = Model(xiangqi_eval.tables)
+    if k is None:
+        k = fit_k(model, path)
+    print(f'{size // RECORD_SIZE} 个局面，K = {k:.3f}，初始误差 {model.loss(path, k):.6f}')
+
+    rng = np.random.default_rng(seed)
+    params = [model.material, model.pst]
+    moments = [np.zeros_like(p) for p in params]
+    squares = [np.zeros_like(p) for p in params]
+    beta1, beta2, eps = 0.9, 0.999, 1e-8
+    step = 0
+    for epoch in range(1, epochs + 1):
+        start = time.perf_counter()
+        # 一次读入若干批打乱顺序，相邻局面多来自同一盘棋
+        for codes, results in read_chunks(path, batch * shuffle_batches):
+            order = rng.permutation(len(results))
+            for begin in range(0, len(order), batch):
+                chosen = order[begin:begin + batch]
+                _, material_grad, pst_grad = model.gradient(codes[chosen], results[chosen], k)
+                step += 1
+                for i, grad in enumerate((material_grad, pst_grad)):
+                    moments[i] = beta1 * moments[i] + (1 - beta1) * grad
+                    squares[i] = beta2 * squares[i] + (1 - beta2) * grad ** 2
+                    corrected = moments[i] / (1 - beta1 ** step)
+                    params[i] -= rate * corrected / (np.sqrt(squares[i] / (1 - beta2 ** step)) + eps)
+        print(f'第 {epoch} 轮: 误差 {model.loss(path, k):.6f}，'
+              f'{size // RECORD_SIZE / (time.perf_counter() - start):.0f} 局面/秒')
+    xiangqi_eval.save_tables(output, model.to_tables())
+    print(f'已写入 {output}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='估值表自动调参')
+    sub = parser.add_subparsers(dest='command', required=True)
+    extract_parser = sub.add_parser('extract', help='从棋谱提取带结果的局面')
+    extract_parser.add_argument('paths', nargs='+')
+    extract_parser.add_argument('-o', '--output', required=True)
+    extract_parser.add_argument('--skip', type=int, default=10, help='跳过每盘开头的步数')
+    pack_parser = sub.add_parser('pack', help='把 "FEN 结果" 文本转换为二进制数据集')
+    pack_parser.add_argument('path')
+    pack_parser.add_argument('-o', '--output', required=True)
+    tune_parser = sub.add_parser('tune', help='调参并写出估值表')
+    tune_parser.add_argument('dataset')
+    tune_parser.add_argument('-o', '--output', default=xiangqi_eval.DEFAULT_TABLES_PATH)
+    tune_parser.add_argument('--epochs', type=int, default=10)
+    tune_parser.add_argument('--batch', type=int, default=16384)
+    tune_parser.add_argument('--rate', type=float, default=1.0, help='Adam 学习率（分）')
+    tune_parser.add_argument('--k', type=float, default=None, help='不指定时自动拟合')
+    args = parser.parse_args(argv)
+
+    if args.command == 'extract':
+        extract(args.paths, args.output, args.skip)
+    elif args.command == 'pack':
+        pack(args.path, args.output)
+    else:
+        tune(args.dataset, args.output, args.epochs, args.batch, args.rate, args.k)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
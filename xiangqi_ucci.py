@@ -0,0 +1,285 @@
+"""UCCI 协议引擎入口
+
+通过标准输入输出和界面或比赛程序通信，不依赖 PyQt5：
+
+    python xiangqi_ucci.py          # 等待 ucci 命令
+    python xiangqi_ucci.py --bench  # 启动时间和 stop 响应时间
+
+支持的命令：ucci、isready、setoption、position {fen ... | startpos} [moves ...]、
+banmoves、go [ponder] {depth N | nodes N | time T [movestogo M | increment I]
+| infinite}、ponderhit、stop、quit。时间单位为毫秒。
+
+搜索在后台线程里进行，主线程一直在读输入，stop 只是给引擎设置停止标志，
+引擎每 256 个节点检查一次，随后输出 bestmove。停止标志在 go 启动线程前清除，
+搜索本身不清除，go 之后马上到来的 stop 也不会丢失。为了缩短启动时间，
+置换表在第一次 isready 或 go 时才分配，开局库和残局库也在那时才加载。
+"""
+import argparse
+import subprocess
+import sys
+import threading
+import time
+
+from xiangqi_engine import Engine
+from xiangqi_notation import move_to_iccs, iccs_to_move
+from xiangqi_position import Position, START_FEN
+
+ENGINE_NAME = 'xiangqi_engine'
+# 选项名: (类型, 默认值, 最小值, 最大值)
+OPTIONS = {
+    'hashsize': ('spin', 16, 0, 1024),
+    'usebook': ('check', True, None, None),
+    'usetablebase': ('check', True, None, None),
+}
+
+
+def parse_bool(text):
+    return text.lower() in ('true', 'on', '1', 'yes')
+
+
+def time_budget(total, movestogo=None, increment=0.0):
+    """剩余时间换算为本步的思考秒数（参数都是秒）"""
+    if movestogo:
+        limit = total / movestogo
+    else:
+        limit = total / 30 + increment * 0.8
+    # 给通信和线程切换留出余量
+    return max(0.01, min(limit, total * 0.5) - 0.02)
+
+
+class UCCIEngine:
+    """解析 UCCI 命令，search 在后台线程中运行"""
+
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.output_lock = threading.Lock()
+        self.options = {name: spec[1] for name, spec in OPTIONS.items()}
+        self.engine = None
+        self.book = None
+        self.position = Position.from_fen(START_FEN)
+        self.history = [self.position.key]
+        self.banned = set()
+        self.thread = None
+        self.pondering = False
+        self.ponder_limit = None
+        self.infinite = False
+
+    def send(self, line):
+        with self.output_lock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    def ensure_engine(self):
+        """第一次需要时才创建引擎、加载开局库和残局库"""
+        if self.engine is not None:
+            return
+        tablebase = None
+        if self.options['usetablebase']:
+            import xiangqi_tablebase
+            tablebase = xiangqi_tablebase.open_tablebase()
+        if self.options['usebook']:
+            import xiangqi_book
+            self.book = xiangqi_book.open_book()
+        self.engine = Engine(hash_mb=self.options['hashsize'], tablebase=tablebase)
+
+    def handle(self, line):
+        """处理一行命令，收到 quit 时返回 False"""
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == 'ucci':
+            self.send('id name ' + ENGINE_NAME)
+            for name, (kind, default, low, high) in OPTIONS.items():
+                if kind == 'spin':
+                    self.send(f'option {name} spin min {low} max {high} default {default}')
+                else:
+                    self.send(f'option {name} check default {str(default).lower()}')
+            self.send('ucciok')
+        elif command == 'isready':
+            self.ensure_engine()
+            self.send('readyok')
+        elif command == 'setoption':
+            self.wait_search()
+            self.set_option(args)
+        elif command == 'position':
+            self.wait_search()
+            self.set_position(args)
+        elif command == 'banmoves':
+            self.banned = {iccs_to_move(text) for text in args}
+        elif command == 'go':
+            self.wait_search()
+            self.go(args)
+        elif command == 'ponderhit':
+            self.ponderhit()
+        elif command == 'stop':
+            if self.thread is not None:
+                self.pondering = False
+                self.infinite = False
+                self.engine.stop()
+        elif command == 'quit':
+            self.wait_search(stop=True)
+            self.send('bye')
+            return False
+        return True
+
+    def set_option(self, args):
+        # UCCI 的 "setoption hashsize 32"，也接受 UCI 的 "setoption name hashsize value 32"
+        if args and args[0] == 'name':
+            args = [arg for arg in args[1:] if arg != 'value']
+        if not args or args[0].lower() not in OPTIONS:
+            return
+        name = args[0].lower()
+        kind, default, low, high = OPTIONS[name]
+        value = args[1] if len(args) > 1 else str(default)
+        if kind == 'spin':
+            self.options[name] = min(max(int(value), low), high)
+        else:
+            self.options[name] = parse_bool(value)
+        # 选项改变后下次用到时重新创建
+        self.engine = None
+
+    def set_position(self, args):
+        if args and args[0] == 'startpos':
+            fen, rest = START_FEN, args[1:]
+        elif args and args[0] == 'fen':
+            end = args.index('moves') if 'moves' in args else len(args)
+            fen, rest = ' '.join(args[1:end]), args[end:]
+        else:
+            return
+        pos = Position.from_fen(fen)
+        history = [pos.key]
+        if rest and rest[0] == 'moves':
+            for text in rest[1:]:
+                pos.do_move(iccs_to_move(text))
+                history.append(pos.key)
+        self.position = pos
+        self.history = history
+        self.banned = set()
+
+    def go(self, args):
+        self.ensure_engine()
+        ponder = 'ponder' in args
+        values = {}
+        for i, arg in enumerate(args[:-1]):
+            if arg in ('depth', 'nodes', 'time', 'movestogo', 'increment'):
+                values[arg] = int(args[i + 1])
+        time_limit = None
+        if 'time' in values:
+            time_limit = time_budget(values['time'] / 1000, values.get('movestogo'),
+                                     values.get('increment', 0) / 1000)
+        max_depth = values.get('depth', 64)
+        node_limit = values.get('nodes')
+
+        if not ponder and not self.banned and self.book is not None:
+            move = self.book.choose(self.position)
+            if move:
+                self.send('bestmove ' + move_to_iccs(move))
+                return
+
+        # 后台思考时不限时，ponderhit 之后再按本步的时间设置截止时间
+        self.pondering = ponder
+        self.ponder_limit = time_limit if ponder else None
+        # go infinite 即使提前搜到杀棋也要等 stop 才给出走法
+        self.infinite = 'infinite' in args
+        # 在这里而不是在搜索线程里清除停止标志，紧跟着到来的 stop 不会被覆盖
+        self.engine.clear_stop()
+        self.thread = threading.Thread(
+            target=self.search, args=(self.position.copy(), list(self.history), max_depth,
+                                      None if ponder else time_limit, node_limit),
+            daemon=True)
+        self.thread.start()
+
+    def search(self, pos, history, max_depth, time_limit, node_limit):
+        def on_info(info):
+            self.send(f"info depth {info['depth']} score {info['score']} "
+                      f"time {int(info['time'] * 1000)} nodes {info['nodes']} "
+                      f"nps {info['nps']} pv {' '.join(map(move_to_iccs, info['pv']))}")
+
+        result = self.engine.search(pos, max_depth=max_depth, time_limit=time_limit,
+                                    info_callback=on_info, history=history,
+                                    node_limit=node_limit, excluded=self.banned)
+        # 后台思考和 go infinite 即使搜完也要等 ponderhit 或 stop 才能给出走法
+        while self.pondering or self.infinite:
+            time.sleep(0.001)
+        if not result['move']:
+            self.send('nobestmove')
+        elif len(result['pv']) > 1:
+            self.send(f"bestmove {move_to_iccs(result['move'])} "
+                      f"ponder {move_to_iccs(result['pv'][1])}")
+        else:
+            self.send('bestmove ' + move_to_iccs(result['move']))
+
+    def ponderhit(self):
+        """对方走了猜测的那步，后台思考转为正常计时"""
+        if self.thread is None or not self.pondering:
+            return
+        if self.ponder_limit is not None:
+            self.engine.deadline = time.perf_counter() + self.ponder_limit
+        self.pondering = False
+
+    def wait_search(self, stop=False):
+        if self.thread is None:
+            return
+        if stop:
+            self.pondering = False
+            self.infinite = False
+            self.engine.stop()
+        self.thread.join()
+        self.thread = None
+
+
+def run(input_stream=sys.stdin, output=sys.stdout):
+    engine = UCCIEngine(output)
+    for line in input_stream:
+        if not engine.handle(line.strip()):
+            break
+
+
+def benchmark(rounds=5):
+    """启动子进程测量到 ucciok 的时间，以及 go infinite 之后 stop 到 bestmove 的时间"""
+    startups = []
+    stops = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, __file__], stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, text=True, bufsize=1)
+
+        def command(text, until):
+            process.stdin.write(text + '\n')
+            process.stdin.flush()
+            while True:
+                line = process.stdout.readline()
+                if not line or line.startswith(until):
+                    return line
+
+        command('ucci', 'ucciok')
+        startups.append(time.perf_counter() - start)
+        command('isready', 'readyok')
+        process.stdin.write('position startpos moves h2e2 h9g7\ngo infinite\n')
+        process.stdin.flush()
+        time.sleep(1.0)
+        start = time.perf_counter()
+        command('stop', 'bestmove')
+        stops.append(time.perf_counter() - start)
+        command('quit', 'bye')
+        process.wait()
+    print(f'启动到 ucciok: 平均 {sum(startups) / rounds * 1000:.1f} 毫秒，'
+          f'最长 {max(startups) * 1000:.1f} 毫秒')
+    print(f'stop 到 bestmove: 平均 {sum(stops) / rounds * 1000:.1f} 毫秒，'
+          f'最长 {max(stops) * 1000:.1f} 毫秒')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='UCCI 协议引擎')
+    parser.add_argument('--bench', action='store_true', help='测量启动时间和 stop 响应时间')
+    args = parser.parse_args(argv)
+    if args.bench:
+        benchmark()
+    else:
+        run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())